@@ -0,0 +1,36 @@
+"""add indexes for common lookups
+
+Revision ID: 3c1f7a9e2d54
+Revises: b5a2c82718b8
+Create Date: 2026-10-18 10:12:47.120931
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f7a9e2d54'
+down_revision = 'b5a2c82718b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_account_user_id_provider_name', 'account', ['user_id', 'provider_name'], unique=False)
+    op.create_index('ix_account_provider_name_username', 'account', ['provider_name', 'username'], unique=False)
+    op.create_index('ix_audit_log_table_name_row_id', 'audit_log', ['table_name', 'row_id'], unique=False)
+    op.create_index('ix_enrollment_course_id_user_id', 'enrollment', ['course_id', 'user_id'], unique=False)
+    op.create_index('ix_group_course_id_kind', 'group', ['course_id', 'kind'], unique=False)
+    op.create_index('ix_last_sync_obj_type_obj_id', 'last_sync', ['obj_type', 'obj_id'], unique=False)
+    op.create_index('ix_membership_group_id_user_id', 'membership', ['group_id', 'user_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_membership_group_id_user_id', table_name='membership')
+    op.drop_index('ix_last_sync_obj_type_obj_id', table_name='last_sync')
+    op.drop_index('ix_group_course_id_kind', table_name='group')
+    op.drop_index('ix_enrollment_course_id_user_id', table_name='enrollment')
+    op.drop_index('ix_audit_log_table_name_row_id', table_name='audit_log')
+    op.drop_index('ix_account_provider_name_username', table_name='account')
+    op.drop_index('ix_account_user_id_provider_name', table_name='account')
@@ -0,0 +1,24 @@
+"""add audit log timestamp index
+
+Revision ID: 8f2d4b6a1c37
+Revises: 3c1f7a9e2d54
+Create Date: 2026-10-18 19:04:12.503118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f2d4b6a1c37'
+down_revision = '3c1f7a9e2d54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_audit_log_timestamp', 'audit_log', ['timestamp'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_audit_log_timestamp', table_name='audit_log')
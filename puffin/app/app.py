@@ -8,8 +8,10 @@ import sys
 from puffin.db import database
 from puffin.gitlab.users import GitlabConnection
 from puffin.canvas.canvas import CanvasConnection
+from puffin.canvas.async_canvas import AsyncCanvasConnection
 from puffin.maint.sonarqube import SonarConnection
 from puffin.util.errors import ErrorResponse
+from puffin.util.json_provider import PuffinJSONProvider
 from puffin.app import view_projects
 from os.path import dirname, abspath, join, isabs
 from sqlalchemy import select
@@ -36,7 +38,6 @@ from flask import (
     session,
     Response,
 )
-import json
 from datetime import datetime
 from .proxy_fix import ProxyFix
 
@@ -165,8 +166,10 @@ def create_app(config_only=False):
     if app.config.get("TRUST_X_REAL_IP", False):
         app.wsgi_app = ProxyFix(app.wsgi_app)
 
+    app.json = PuffinJSONProvider(app)
     CSRFProtect(app)
     CanvasConnection(app)
+    AsyncCanvasConnection(app)
     GitlabConnection(app)
     SonarConnection(app)
 
@@ -261,6 +264,7 @@ def shell_setup():
 
     def reload_all():
         CanvasConnection(app)
+        AsyncCanvasConnection(app)
         GitlabConnection(app)
         SonarConnection(app)
         for m in list(sys.modules.values()):
@@ -396,7 +400,7 @@ def handle_error_exception(e: ErrorResponse):
     # start with the correct headers and status code from the error
     response = make_response()
     # replace the body with JSON
-    response.data = json.dumps(e.to_dict())
+    response.data = app.json.dumps(e.to_dict())
     response.status_code = e.status_code
     response.content_type = "application/json"
     logger.error(f"{e.status_code} {e.to_dict()}")
@@ -418,7 +422,7 @@ def handle_sql_exception(e: SQLAlchemyError):
         error["message"] = "Not found"
     response = make_response()
     # replace the body with JSON
-    response.data = json.dumps(error)
+    response.data = app.json.dumps(error)
     response.status_code = error["status_code"]
     response.content_type = "application/json"
     logger.error(f"sql error: ", e)
@@ -436,7 +440,7 @@ def handle_gitlab_auth_error(e: gitlab.exceptions.GitlabAuthenticationError):
     }
     response = make_response()
     # replace the body with JSON
-    response.data = json.dumps(error)
+    response.data = app.json.dumps(error)
     response.status_code = error["status_code"]
     response.content_type = "application/json"
     return response
@@ -0,0 +1,190 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, NamedTuple
+import logging
+
+from simpleeval import simple_eval
+import sqlalchemy as sa
+
+from puffin.canvas import CanvasConnection
+from puffin.canvas.canvas import CanvasGroup
+from puffin.gitlab.users import GitlabConnection
+from puffin.db.model_tables import Account, AuditLog, Course, Enrollment, Group, JoinModel, LastSync, Membership
+from puffin.db.model_util import course_audit_log, new_ids, sync_batch
+
+logger = logging.getLogger(__name__)
+
+
+class MemberSource(NamedTuple):
+    """One function call in a group's join_source, e.g. gitlab("inf101/team-1")."""
+
+    kind: str  # 'gitlab' or 'canvas'
+    spec: Any  # GitLab project, or Canvas group id
+    students_only: bool
+
+
+class GroupSync:
+    """Sync the AUTO memberships of many groups in a course with their join sources.
+
+    All member lists (Canvas groups and GitLab projects) are fetched concurrently, with at most
+    `max_workers` requests at a time. The membership changes are then computed in memory and
+    applied in a single transaction, and the audit log entries for the sync are returned.
+
+    Has the same effect as syncing the groups one by one the old way: a member of a source who
+    is enrolled in the course (as a student, if `students_only`) gets an AUTO membership (or has a
+    REMOVED one restored, or the role of an AUTO one updated); AUTO memberships of other users are
+    REMOVED if the group has a Canvas source; unmapped GitLab users are noted in the group's
+    json_data. A group whose join_source or member lists couldn't be read is left unchanged, and
+    the errors are logged and kept in `errors`."""
+
+    def __init__(
+        self,
+        session: sa.orm.Session,
+        course: Course,
+        canvas: CanvasConnection | None = None,
+        gitlab: GitlabConnection | None = None,
+        max_workers: int = 8,
+        sync_time: datetime | None = None,
+    ):
+        self.session = session
+        self.course = course
+        self.canvas = canvas
+        self.gitlab = gitlab
+        self.max_workers = max_workers
+        self.sync_time = sync_time
+        self.unmapped: dict[int, list[str]] = {}  # group id → GitLab usernames without a Puffin user
+        self.errors: dict[int, list[str]] = {}  # group id → why it wasn't synced
+
+    def sources(self, group: Group) -> list[MemberSource]:
+        """Evaluate the group's join_source, recording the sources instead of fetching them."""
+        sources = []
+
+        def source(kind: str) -> Callable:
+            def add(spec, students_only=True):
+                sources.append(MemberSource(kind, spec, students_only))
+            return add
+
+        if group.join_source:
+            simple_eval(
+                group.join_source,
+                functions={
+                    "gitlab": source("gitlab"),
+                    "canvas_section": source("canvas"),
+                    "canvas_group": source("canvas"),
+                },
+                names={"COURSE_ID": self.course.id},
+            )
+        return sources
+
+    def fetch(self, group: Group, source: MemberSource) -> list:
+        if source.kind == "gitlab":
+            if self.gitlab == None:
+                raise ValueError("No GitLab connection")
+            return self.gitlab.list_members(source.spec, indirect=False)
+        else:
+            if self.canvas == None:
+                raise ValueError("No Canvas connection")
+            # like the old canvas_sync(), this always uses the group's own Canvas group
+            return CanvasGroup(self.canvas, {"id": group.external_id}).members()
+
+    def _error(self, group: Group, what: str, e: Exception):
+        logger.error("GroupSync(%s): failed to read %s: %s", group.slug, what, e)
+        self.errors.setdefault(group.id, []).append(f"{what}: {e}")
+
+    def sync(self, groups: list[Group]) -> list[dict[str, Any]]:
+        """Sync the groups (those without a join_source are skipped); returns the group and
+        membership changes from the audit log."""
+        self.errors = {}
+        group_sources: dict[int, tuple[Group, list[MemberSource]]] = {}
+        for g in groups:
+            if g.join_source:
+                try:
+                    group_sources[g.id] = (g, self.sources(g))
+                except Exception as e:
+                    self._error(g, f"join_source {g.join_source!r}", e)
+        jobs = [(g, s) for (g, sources) in group_sources.values() for s in sources]
+        logger.info("GroupSync(%s): fetching %d member lists for %d groups", self.course.slug, len(jobs), len(group_sources))
+
+        def fetch(job: tuple[Group, MemberSource]) -> list | None:
+            try:
+                return self.fetch(*job)
+            except Exception as e:
+                self._error(job[0], f"{job[1].kind}({job[1].spec!r})", e)
+                return None
+
+        with ThreadPoolExecutor(max(1, min(self.max_workers, len(jobs)))) as pool:
+            member_lists = list(pool.map(fetch, jobs))
+        # skip groups with a failed source, so we don't remove members we just couldn't see
+        for gid in self.errors:
+            group_sources.pop(gid, None)
+        fetched = [(job, ms) for (job, ms) in zip(jobs, member_lists) if job[0].id in group_sources]
+        jobs, member_lists = [job for (job, _) in fetched], [ms for (_, ms) in fetched]
+
+        canvas_ids = {m.get("user_id") for ((_, s), ms) in zip(jobs, member_lists) if s.kind == "canvas" for m in ms}
+        canvas_users = dict(self.session.execute(
+            sa.select(Account.external_id, Account.user_id).where(
+                Account.provider_name == "canvas", Account.external_id.in_(canvas_ids))).tuples().all()) if canvas_ids else {}
+        gitlab_ids = {u.id for ((_, s), ms) in zip(jobs, member_lists) if s.kind == "gitlab" for u in ms}
+        gitlab_users = {gid: u.id for (gid, u) in self.gitlab.map_gitlab_users(self.session, gitlab_ids).items()} \
+            if self.gitlab and gitlab_ids else {}
+        roles: dict[int, str] = dict(self.session.execute(
+            sa.select(Enrollment.user_id, Enrollment.role).where(Enrollment.course_id == self.course.id)).tuples().all())
+
+        # wanted members (user id → role) for each group
+        wanted: dict[int, dict[int, str]] = {gid: {} for gid in group_sources}
+        self.unmapped = {}
+        for ((group, source), members) in zip(jobs, member_lists):
+            if source.kind == "gitlab":
+                user_ids = [gitlab_users.get(u.id) for u in members]
+                self.unmapped.setdefault(group.id, []).extend(
+                    u.username for (u, uid) in zip(members, user_ids) if uid == None)
+            else:
+                user_ids = [canvas_users.get(m.get("user_id")) for m in members]
+            for uid in user_ids:
+                role = roles.get(uid)  # type: ignore
+                if role == None:
+                    logger.info("GroupSync(%s): user %s not enrolled in course", group.slug, uid)
+                elif source.students_only and role != "student":
+                    logger.info("GroupSync(%s): skipping non-student: %s", group.slug, uid)
+                else:
+                    wanted[group.id][uid] = role  # type: ignore
+
+        with sync_batch(self.session):
+            # read under the write lock, so no one else changes them before we're done
+            existing: dict[tuple[int, int], Membership] = {
+                (m.group_id, m.user_id): m for m in self.session.execute(
+                    sa.select(Membership).where(Membership.group_id.in_(list(group_sources)))).scalars()}
+            lastlog = self.session.execute(sa.select(sa.func.max(AuditLog.id))).scalar()
+            synced: list[Membership] = []
+            added: list[tuple[int, int, str]] = []
+            for (gid, (group, sources)) in group_sources.items():
+                for (uid, role) in wanted[gid].items():
+                    m = existing.get((gid, uid))
+                    if m == None:
+                        added.append((gid, uid, role))
+                        continue
+                    if m.join_model == JoinModel.REMOVED:
+                        m.join_model = JoinModel.AUTO
+                    if m.join_model == JoinModel.AUTO and m.role != role:
+                        m.role = role
+                    synced.append(m)
+                if any(s.kind == "canvas" for s in sources):
+                    for ((g, uid), m) in existing.items():
+                        if g == gid and m.join_model == JoinModel.AUTO and uid not in wanted[gid]:
+                            m.join_model = JoinModel.REMOVED
+                if any(s.kind == "gitlab" for s in sources):
+                    unmapped = self.unmapped.get(gid, [])
+                    if group.json_data.get("unmapped", []) != unmapped:
+                        group.json_data["unmapped"] = unmapped
+            for ((gid, uid, role), id) in zip(added, new_ids(self.session, Membership, len(added))):
+                m = Membership(id=id, group_id=gid, user_id=uid, role=role, join_model=JoinModel.AUTO)
+                self.session.add(m)
+                synced.append(m)
+            self.session.flush()
+            if self.sync_time:
+                LastSync.set_sync_many(self.session, synced, self.sync_time)
+                LastSync.set_sync_many(self.session, [g for (g, _) in group_sources.values()], self.sync_time)
+        logger.info("GroupSync(%s): %d new memberships, %d checked", self.course.slug, len(added), len(synced) - len(added))
+
+        log = course_audit_log(self.session, self.course, since=lastlog or 0, tables=["group", "membership"], limit=None)
+        return [l.to_json() for l in log]
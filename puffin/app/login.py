@@ -225,7 +225,8 @@ def authorize_gitlab():
 # the User object for a given user id
 @login_manager.user_loader
 def user_loader(user_id):
-    user = db_session.get(User, int(user_id))
+    profile = current_app.config.get('LOGIN_USER_LOAD_PROFILE', 'accounts')
+    user = db_session.get(User, int(user_id), options=User.load_options(profile))
     return user
 
 @login_manager.unauthorized_handler
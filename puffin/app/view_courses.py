@@ -4,6 +4,8 @@ import random
 from io import StringIO
 import csv
 import re
+import zlib
+from typing import Iterator
 from puffin.canvas import CanvasConnection, CanvasCourse
 from wtforms import (
     StringField,
@@ -21,21 +23,25 @@ from puffin.canvas.canvas import CanvasGroup
 from puffin.util.util import *
 from puffin.util.errors import ErrorResponse
 from puffin.gitlab.users import GitlabConnection
-from simpleeval import simple_eval
-from sqlalchemy.orm import aliased
+from puffin.app.group_sync import GroupSync
+from sqlalchemy.orm import Session, aliased
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import alias, and_, or_, select, column
+from sqlalchemy import alias, and_, or_, select, column, event
 from puffin.db.database import db_session as db
 from puffin.db.model_util import (
     check_group_membership,
     check_unique,
+    COURSE_AUDIT_TABLES,
+    course_audit_log,
     new_id,
     get_or_define,
+    sync_batch,
     update_from_uib,
+    update_from_uib_bulk,
     update_sections_from_uib,
 )
 from puffin.db.model_views import CourseUser, UserAccount
-from datetime import datetime, timezone
+from datetime import datetime
 import os
 import posixpath
 from flask import (
@@ -43,8 +49,11 @@ from flask import (
     Flask,
     current_app,
     flash,
+    g,
+    has_app_context,
     request,
     session,
+    stream_with_context,
     url_for,
     make_response,
 )
@@ -78,22 +87,66 @@ def init(app: Flask, parent: Blueprint):
     (parent or app).register_blueprint(bp)
 
 
+def request_cache(name: str) -> dict:
+    """A dict that lives as long as the current request (on flask.g), or until the next database write"""
+    return g.setdefault(f"cache_{name}", {})
+
+
+def clear_request_caches():
+    """Forget the lookups cached by request_cache() and current_enrollments()"""
+    if has_app_context():
+        for name in [name for name in g if name.startswith("cache_")]:
+            g.pop(name)
+        g.pop("current_enrollments", None)
+
+
+@event.listens_for(Session, "after_flush")
+def _clear_after_flush(session, flush_context):
+    # enrollments may have changed, or a group been renamed or removed
+    clear_request_caches()
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _clear_before_write(orm_execute_state):
+    if not orm_execute_state.is_select:
+        clear_request_caches()
+
+
+def current_enrollments() -> dict[int, str]:
+    """Course id → role for the current user, loaded once per request"""
+    enrollments = g.get("current_enrollments")
+    if enrollments == None:
+        enrollments = g.current_enrollments = {
+            course_id: role
+            for (course_id, role) in db.execute(
+                select(Enrollment.course_id, Enrollment.role).where(
+                    Enrollment.user_id == current_user.id
+                )
+            ).all()
+        }
+    return enrollments
+
+
 def get_course(course_id_or_slug):
     course_id_or_slug = intify(course_id_or_slug)
+    courses = request_cache("courses")
+    if course_id_or_slug in courses:
+        return courses[course_id_or_slug]
     if isinstance(course_id_or_slug, int):
         where = Course.external_id == course_id_or_slug
     elif isinstance(course_id_or_slug, str):
         where = Course.slug == course_id_or_slug
     if current_user.is_admin:
-        return db.execute(select(Course).where(where)).scalar_one_or_none()
-    else:
-        return db.execute(
-            select(Course).where(
-                where,
-                Enrollment.course_id == Course.id,
-                Enrollment.user_id == current_user.id,
-            )
+        course = db.execute(select(Course).where(where)).scalar_one_or_none()
+    elif current_enrollments():
+        course = db.execute(
+            select(Course).where(where, Course.id.in_(current_enrollments().keys()))
         ).scalar_one_or_none()
+    else:
+        course = None
+    if course != None:
+        courses[course_id_or_slug] = course
+    return course
 
 
 def get_course_or_fail(course_id_or_slug):
@@ -112,10 +165,15 @@ def get_group(course, group_id_or_slug, privileged=False):
     elif isinstance(group_id_or_slug, str):
         where = and_(Group.slug == group_id_or_slug, Group.course_id == course.id)
 
-    if privileged or is_privileged(current_user, course):
-        return db.execute(select(Group).where(where)).scalar_one_or_none()
+    privileged = privileged or is_privileged(current_user, course)
+    groups = request_cache("groups")
+    key = (course.id, group_id_or_slug, privileged)
+    if key in groups:
+        return groups[key]
+    if privileged:
+        group = db.execute(select(Group).where(where)).scalar_one_or_none()
     else:
-        return db.execute(
+        group = db.execute(
             select(Group).where(
                 where,
                 Membership.group_id == Group.id,
@@ -123,6 +181,9 @@ def get_group(course, group_id_or_slug, privileged=False):
                 Membership.user_id == current_user.id,
             )
         ).scalar_one_or_none()
+    if group != None:
+        groups[key] = group
+    return group
 
 
 def get_group_or_fail(course, group_id_or_slug, privileged=False):
@@ -167,6 +228,9 @@ def get_assignment_or_fail(course, asgn_id_or_slug):
 def is_privileged(user, course):
     if user.is_admin:
         return True
+    if isinstance(course, (Course, int)):
+        course_id = course.id if isinstance(course, Course) else course
+        return current_enrollments().get(course_id) in PRIVILEGED_ROLES
     en = current_user.enrollment(course)
     if not en:
         return False
@@ -321,52 +385,61 @@ def _sync_course(course: Course):
     logger.info("sync_course: %s, %s, %s", course, request.args, request.form)
 
     if request.args.get("sync_canvas") or request.form.get("sync_canvas"):
-        known_users = {
-            uid: (fn, enr)
-            for (uid, fn, enr) in db.execute(
-                select(Account.user_id, Account.fullname, Enrollment).where(
-                    Account.user_id == Enrollment.user_id,
-                    Account.provider_name == "canvas",
-                    Enrollment.course_id == course.id,
-                    Enrollment.join_model != JoinModel.REMOVED,
-                )
-            ).all()
-        }
         cc: CanvasConnection = current_app.extensions["puffin_canvas_connection"]
         canvas_course = CanvasCourse(cc, {"id": course.external_id})
-        userlist = canvas_course.get_users()
-        for row in userlist:
-            acc = update_from_uib(db, row, course, changes=changes, sync_time=sync_time)
-            if acc.user_id not in known_users:
-                logger.warn("sync_canvas: New user", acc)
-            else:
-                del known_users[acc.user_id]
-            if acc:
-                canvas_accs += 1
-        for uid in known_users.keys():
-            logger.warn("sync_canvas: Removing user %s:%s", uid, known_users[uid][0])
-            known_users[uid][1].join_model = JoinModel.REMOVED
-            db.add(known_users[uid][1])
-            for m, slug in db.execute(
-                select(Membership, Group.slug).where(
-                    Membership.user_id == uid,
-                    Membership.join_model != JoinModel.REMOVED,
-                    Membership.group_id == Group.id,
-                    Group.course_id == course.id,
-                )
-            ).all():
-                logger.warn(
-                    "sync_canvas: ...  Removing %s:%s from group %s",
-                    uid,
-                    known_users[uid][0],
-                    slug,
-                )
-                m.join_model = JoinModel.REMOVED
-                db.add(m)
-
-            db.commit()
+        # fetch the whole list before writing (rather than streaming it into the sync), so we
+        # don't hold the database write lock while waiting for Canvas
+        canvas_users = canvas_course.get_users()
+        cats = canvas_course.get_group_categories()
+        with sync_batch(db):
+            # read under the write lock, so enrollments changed while we waited for Canvas are seen
+            known_users = {
+                uid: (fn, enr)
+                for (uid, fn, enr) in db.execute(
+                    select(Account.user_id, Account.fullname, Enrollment)
+                    .where(
+                        Account.user_id == Enrollment.user_id,
+                        Account.provider_name == "canvas",
+                        Enrollment.course_id == course.id,
+                        Enrollment.join_model != JoinModel.REMOVED,
+                    )
+                    .execution_options(populate_existing=True)
+                ).all()
+            }
+            skipped = []
+            accs = update_from_uib_bulk(db, canvas_users, course, changes=changes, sync_time=sync_time, skipped=skipped)
+            if skipped:
+                # couldn't be synced, but they're still in the course
+                for uid in db.execute(select(User.id).where(User.key.in_([f'canvas#{row["id"]}' for row in skipped]))).scalars():
+                    known_users.pop(uid, None)
+            for acc in accs:
+                if acc.user_id not in known_users:
+                    logger.warn("sync_canvas: New user", acc)
+                else:
+                    del known_users[acc.user_id]
+                if acc:
+                    canvas_accs += 1
+            for uid in known_users.keys():
+                logger.warn("sync_canvas: Removing user %s:%s", uid, known_users[uid][0])
+                known_users[uid][1].join_model = JoinModel.REMOVED
+                db.add(known_users[uid][1])
+                for m, slug in db.execute(
+                    select(Membership, Group.slug).where(
+                        Membership.user_id == uid,
+                        Membership.join_model != JoinModel.REMOVED,
+                        Membership.group_id == Group.id,
+                        Group.course_id == course.id,
+                    )
+                ).all():
+                    logger.warn(
+                        "sync_canvas: ...  Removing %s:%s from group %s",
+                        uid,
+                        known_users[uid][0],
+                        slug,
+                    )
+                    m.join_model = JoinModel.REMOVED
+                    db.add(m)
         if True or not course.json_data.get("canvas_group_category") or not course.json_data.get("canvas_team_category"):
-            cats = canvas_course.get_group_categories()
             for c in cats:
                 # TODO
                 if 'Grupper' in c.name: # and not course.json_data.get("canvas_group_category"):
@@ -382,18 +455,17 @@ def _sync_course(course: Course):
         course_groups_sync(course.external_id)
     if request.args.get("sync_gitlab") or request.form.get("sync_gitlab"):
         gc: GitlabConnection = current_app.extensions["puffin_gitlab_connection"]
-        for user in (
+        users = (
             db.execute(
-                select(User).where(
-                    Enrollment.user_id == User.id, Enrollment.course_id == course.id
-                )
+                select(User)
+                .where(Enrollment.user_id == User.id, Enrollment.course_id == course.id)
+                .options(*User.load_options("accounts"))
             )
             .scalars()
             .all()
-        ):
-            acc = gc.find_gitlab_account(db, user, sync_time=sync_time)
-            if acc:
-                gitlab_accs += 1
+        )
+        accs = gc.find_gitlab_accounts(db, users, sync_time=sync_time)
+        gitlab_accs = len([acc for acc in accs.values() if acc])
         result["num_gitlab_users"] = gitlab_accs
 
     return changes
@@ -432,122 +504,181 @@ def course_users(course_spec):  #
     else:
         where = [CourseUser.join_model != JoinModel.REMOVED]  # type: ignore
 
-    result = []
-    if request.args.get("accounts", False) or request.form.get("accounts", False):
+    privileged = is_privileged(current_user, course)
+    batches = __course_users_batches(
+        course,
+        where,
+        privileged,
+        accounts=bool(request.args.get("accounts", False) or request.form.get("accounts", False)),
+        details=bool(request.args.get("details") or request.form.get("details")),
+    )
+
+    if (
+        request.args.get("csv")
+        or request.form.get("csv")
+        or request.accept_mimetypes.best_match(
+            ["application/json", "text/html", "text/csv"]
+        )
+        == "text/csv"
+    ):
+        return __csv_response(batches, privileged, f"{course.slug}_users.csv")
+
+    result = [entry for batch in batches for entry in batch]
+    logger.info("users: found %s records", len(result))
+    return result
+
+
+def __course_users_batches(
+    course: Course, where: list, privileged: bool, accounts=False, details=False, batch_size=500
+) -> Iterator[list[dict[str, Any]]]:
+    """The course_users result, in batches read from the database with a server-side cursor."""
+    if accounts:
         query = (
             select(CourseUser, UserAccount)
             .where(CourseUser.course_id == course.id, CourseUser.id == UserAccount.id, *where)  # type: ignore
             .order_by((CourseUser.role == "student").desc(), CourseUser.lastname)  # type: ignore
         )
-        # print('query', query)
-        users = db.execute(query).all()
-        logger.info("users: found %s records", len(users))
-        for u, a in users:
-            u = u.to_result(is_privileged(current_user, course))
-            u.update(a.to_result(is_privileged(current_user, course)))
-            u["_type"] = "course_user,user_account"
-            result.append(u)
-    else:
-        users = db.execute(
+        for rows in db.execute(query.execution_options(yield_per=batch_size)).partitions():
+            batch = []
+            for u, a in rows:
+                entry = u.to_result(privileged)
+                entry.update(a.to_result(privileged))
+                entry["_type"] = "course_user,user_account"
+                batch.append(entry)
+            yield batch
+    elif details:
+        query = (
             select(User, CourseUser)
             .where(CourseUser.course_id == course.id, User.id == CourseUser.id, *where)  # type: ignore
             .order_by((CourseUser.role == "student").desc(), CourseUser.lastname)  # type: ignore
-        ).all()
+            .options(*User.load_options("lazy"))
+        )
+        for rows in db.execute(query.execution_options(yield_per=batch_size)).partitions():
+            yield __course_users_details([u for (u, cu) in rows], {cu.id: cu.role for (u, cu) in rows}, course)
+    else:
+        query = (
+            select(*CourseUser.__table__.c)
+            .where(CourseUser.course_id == course.id, *where)  # type: ignore
+            .order_by((CourseUser.role == "student").desc(), CourseUser.lastname)  # type: ignore
+        )
+        for rows in db.execute(query.execution_options(yield_per=batch_size)).partitions():
+            yield CourseUser.serializer().rows(rows, privileged)
 
-        logger.info("users: found %s records", len(users))
-        if request.args.get("details") or request.form.get("details"):
-            result = [__user_details(u, course) for (u, cu) in users]
-        else:
-            users = [cu for (u, cu) in users]
-            result = [u.to_result(is_privileged(current_user, course)) for u in users]
 
-    if (
-        request.args.get("csv")
-        or request.form.get("csv")
-        or request.accept_mimetypes.best_match(
-            ["application/json", "text/html", "text/csv"]
+def __csv_entry(entry: dict[str, Any], privileged: bool) -> dict[str, Any]:
+    entry["sortable_name"] = f'{entry.get("lastname")}, {entry.get("firstname")}'
+    groups = entry.get("groups")
+    if groups != None:
+        entry["section"] = ",".join(
+            [g["group_slug"] for g in groups if g["kind"] == "section" and g["role"] == "student"]
         )
-        == "text/csv"
-    ):
-        response = make_response()
-        for entry in result:
-            entry["sortable_name"] = (
-                f'{entry.get("lastname")}, {entry.get("firstname")}'
-            )
-            groups = entry.get("groups")
-            if groups != None:
-                entry["section"] = ",".join(
-                    [
-                        g["group_slug"]
-                        for g in groups
-                        if g["kind"] == "section" and g["role"] == "student"
-                    ]
-                )
-                entry["team"] = ",".join(
-                    [
-                        g["group_slug"]
-                        for g in groups
-                        if g["kind"] == "team" and g["role"] == "student"
-                    ]
-                )
-                if is_privileged(current_user, course):
-                    entry["review_team"] = ",".join(
-                        [
-                            g["group_slug"]
-                            for g in groups
-                            if g["kind"] == "team" and g["role"] == "reviewer"
-                        ]
-                    )
-                del entry["groups"]
-            for k in ["is_admin", "locale", "expiry_date", "key"]:
-                if k in entry:
-                    del entry[k]
-        with StringIO() as f:
-            fieldnames = [n for n in result[0].keys() if not n.startswith("_")]
-            w = csv.DictWriter(f, fieldnames, extrasaction="ignore", dialect="excel")
-            w.writeheader()
-            w.writerows(result)
-            print("CSV: ", f.getvalue())
-            print(result[0].keys())
-            response.content_type = "text/csv"
-            # response.charset = 'utf-8'
-            response.data = f.getvalue()
-            response.headers.add(
-                "Content-Disposition", f'attachment; filename="{course.slug}_users.csv"'
+        entry["team"] = ",".join(
+            [g["group_slug"] for g in groups if g["kind"] == "team" and g["role"] == "student"]
+        )
+        if privileged:
+            entry["review_team"] = ",".join(
+                [g["group_slug"] for g in groups if g["kind"] == "team" and g["role"] == "reviewer"]
             )
-            print("response", response)
-            return response
+        del entry["groups"]
+    for k in ["is_admin", "locale", "expiry_date", "key"]:
+        if k in entry:
+            del entry[k]
+    return entry
+
+
+def __csv_response(batches: Iterator[list[dict[str, Any]]], privileged: bool, filename: str):
+    """Stream the batches as CSV (gzipped if the client accepts it); the header row is taken from the first entry."""
+    use_gzip = "gzip" in request.accept_encodings
+
+    def generate():
+        f = StringIO()
+        w = None
+        compressor = zlib.compressobj(wbits=31) if use_gzip else None
+        for batch in batches:
+            for entry in batch:
+                __csv_entry(entry, privileged)
+                if w == None:
+                    fieldnames = [n for n in entry.keys() if not n.startswith("_")]
+                    w = csv.DictWriter(f, fieldnames, extrasaction="ignore", dialect="excel")
+                    w.writeheader()
+                w.writerow(entry)
+            data = f.getvalue().encode()
+            f.seek(0)
+            f.truncate()
+            if compressor != None:
+                data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        if compressor != None:
+            yield compressor.flush()
+
+    response = current_app.response_class(stream_with_context(generate()), content_type="text/csv")
+    response.headers.add("Content-Disposition", f'attachment; filename="{filename}"')
+    response.headers.add("Vary", "Accept-Encoding")
+    if use_gzip:
+        response.headers.add("Content-Encoding", "gzip")
+    return response
 
+
+def __user_details(user: User, course: Course) -> dict[str, Any]:
+    return __make_user_details(
+        user,
+        user.enrollment(course).role,  # type: ignore
+        __course_memberships(course, [user.id]).get(user.id, []),
+        {p: user.account(p) for p in ("canvas", "gitlab")},
+    )
+
+
+def __course_users_details(users: list[User], roles: dict[int, str], course: Course) -> list[dict[str, Any]]:
+    """Same as __user_details for each user, but with one query for all accounts and one for all memberships."""
+    user_ids = [u.id for u in users]
+    accounts: dict[int, dict[str, Account]] = {}
+    for acc in db.execute(
+        select(Account)
+        .where(Account.user_id.in_(user_ids), Account.provider_name.in_(("canvas", "gitlab")))
+        .order_by(Account.id)
+    ).scalars():
+        accounts.setdefault(acc.user_id, {}).setdefault(acc.provider_name, acc)
+    memberships = __course_memberships(course, user_ids)
+    return [
+        __make_user_details(u, roles[u.id], memberships.get(u.id, []), accounts.get(u.id, {}))
+        for u in users
+    ]
+
+
+def __course_memberships(course: Course, user_ids: list[int]) -> dict[int, list[dict[str, Any]]]:
+    """The (non-removed) group memberships of the given users in a course, by user id."""
+    query = select(Membership.user_id, Membership.group_id, Membership.role, Membership.join_model, Group.slug, Group.kind).where(
+        Membership.user_id.in_(user_ids),
+        Membership.group_id == Group.id,
+        Group.course_id == course.id,
+        Membership.join_model != JoinModel.REMOVED,
+    )
+    result: dict[int, list[dict[str, Any]]] = {}
+    for row in db.execute(query.order_by(Membership.id)):
+        result.setdefault(row.user_id, []).append(
+            {
+                "group_id": row.group_id,
+                "group_slug": row.slug,
+                "role": row.role,
+                "kind": row.kind,
+                "joined": row.join_model.name,
+            }
+        )
     return result
 
 
-def __user_details(user: User, course: Course) -> dict[str, Any]:
+def __make_user_details(user: User, role: str, groups: list[dict[str, Any]], accounts: dict[str, Account | None]) -> dict[str, Any]:
     obj = user.to_json()
-    obj["role"] = user.enrollment(course).role  # type: ignore
-    obj["groups"] = [
-        {
-            "group_id": m.group.id,
-            "group_slug": m.group.slug,
-            "role": m.role,
-            "kind": g.kind,
-            "joined": m.join_model.name,
-        }
-        for (m, g) in db.execute(
-            select(Membership, Group).where(
-                Membership.user_id == user.id,
-                Membership.group_id == Group.id,
-                Group.course_id == course.id,
-                Membership.join_model != JoinModel.REMOVED,
-            )
-        ).all()
-    ]
+    obj["role"] = role
+    obj["groups"] = groups
     if not obj.get("locale") and current_app.config.get("DEFAULT_LOCALE"):
         obj["locale"] = current_app.config.get("DEFAULT_LOCALE")
-    canvas_account = user.account("canvas")
+    canvas_account = accounts.get("canvas")
     if canvas_account:
         obj["canvas_id"] = canvas_account.external_id
         obj["canvas_username"] = canvas_account.username
-    gitlab_account = user.account("gitlab")
+    gitlab_account = accounts.get("gitlab")
     if gitlab_account:
         obj["gitlab_id"] = gitlab_account.external_id
         obj["gitlab_username"] = gitlab_account.username
@@ -630,18 +761,16 @@ def get_course_memberships(course_spec):
         ]  # TODO
     else:
         where = [Membership.join_model != JoinModel.REMOVED]
-    members = (
+    members = Membership.serializer().rows(
         db.execute(
-            select(Membership).where(
+            select(*Membership.__table__.c).where(
                 Membership.group_id == Group.id, Group.course_id == course.id, *where
             )
         )
-        .scalars()
-        .all()
     )
     logger.info("memberships: found %s records", len(members))
 
-    return [m.to_json() for m in members]
+    return members
 
 
 # e.g.: {"name":"Microissant","slug":"microissant", "join_model":"AUTO", "join_source":"gitlab(33690, students_only=True)", "kind":"team"}
@@ -1372,136 +1501,101 @@ def course_groups_sync_one(course_spec, group_spec):
     if not is_privileged(current_user, course):
         raise ErrorResponse("Access denied", status_code=403)
 
-    sync_time = now()
-    lastlog = db.execute(select(AuditLog).order_by(AuditLog.id.desc())).scalar()
-
     if not group.join_source:
         raise ErrorResponse("no join source configured", group, status_code=200)
 
-    def gitlab_sync(project: str, students_only=True):
-        gc: GitlabConnection = current_app.extensions["puffin_gitlab_connection"]
-        (members, unmapped) = gc.project_members_incl_unmapped(db, project, indirect=False)
-        logger.info("gitlab_sync(%s,%s)", project, members)
-        # TODO: auto-remove members when they're removed from project
-        for m in members:
-            logger.info("check_group_membership(%s,%s,%s)", course.slug, group.slug, m)
-            if m != None:
-                check_group_membership(
-                    db,
-                    course,
-                    group,
-                    m,
-                    students_only=students_only,
-                    join=JoinModel.AUTO,
-                    sync_time=sync_time,
-                )
-        old_unmapped = group.json_data.get("unmapped", [])
-        if old_unmapped != unmapped:
-            group.json_data["unmapped"] = unmapped
-            db.add(group)
-            db.commit()
-        if len(unmapped) > 0:
-            raise ErrorResponse("user not found", unmapped)
+    sync = __group_sync(course)
+    log = sync.sync([group])
+    if group.id in sync.errors:
+        raise ErrorResponse("sync failed", *sync.errors[group.id], status_code=502)
+    missing = sync.unmapped.get(group.id, [])
+    if len(missing) > 0:
+        raise ErrorResponse("user not found", missing)
+    return log
 
-    def canvas_sync(group_id: str, students_only=True):
-        cc: CanvasConnection = current_app.extensions["puffin_canvas_connection"]
-        canvas_group = CanvasGroup(cc, {"id": group.external_id})
-        members = canvas_group.members()
-        logger.info("canvas_sync(%s,%s): %s", group_id, students_only, members)
-        for m in (
-            db.execute(
-                select(Membership).where(
-                    Membership.group_id == group.id,
-                    Membership.join_model == JoinModel.AUTO,
-                )
-            )
-            .scalars()
-            .all()
-        ):
-            m.join_model = JoinModel.REMOVED
-        for m in members:
-            puffin_user = db.execute(
-                select(User).where(
-                    Account.user_id == User.id,
-                    Account.provider_name == "canvas",
-                    Account.external_id == m.get("user_id"),
-                )
-            ).scalar_one_or_none()
-            if puffin_user != None:
-                check_group_membership(
-                    db,
-                    course,
-                    group,
-                    puffin_user,
-                    students_only=students_only,
-                    join=JoinModel.AUTO,
-                    sync_time=sync_time,
-                )
-            logger.info("    member: %s %s", m.get("user_id"), puffin_user)
-        print(db.dirty)
-        db.commit()
 
-    simple_eval(
-        group.join_source,
-        functions={
-            "gitlab": gitlab_sync,
-            "canvas_section": canvas_sync,
-            "canvas_group": canvas_sync,
-        },
-        names={"COURSE_ID": course.id},
+def __group_sync(course: Course) -> GroupSync:
+    return GroupSync(
+        db,
+        course,
+        canvas=current_app.extensions["puffin_canvas_connection"],
+        gitlab=current_app.extensions["puffin_gitlab_connection"],
+        max_workers=current_app.config.get("GROUP_SYNC_MAX_WORKERS", 8),
+        sync_time=now(),
     )
-    LastSync.set_sync(db, group, sync_time)
-    if lastlog != None:
-        log = (
-            db.execute(select(AuditLog).where(AuditLog.id > lastlog.id)).scalars().all()
-        )
-    else:
-        log = db.execute(select(AuditLog)).scalars().all()
-    log = [l.to_json() for l in log if l.table_name in ["group", "membership"]]
-    print("AFTERLOG:", log)
-    return log
 
 
 @bp.post("/<course_spec>/groups/sync")
 @login_required
 def course_groups_sync(course_spec):
-    changes = []
     course = get_course_or_fail(course_spec)
 
     if not is_privileged(current_user, course):
         raise ErrorResponse("Access denied", status_code=403)
 
-    sync_time = now()
     cc: CanvasConnection = current_app.extensions["puffin_canvas_connection"]
     canvas_course = CanvasCourse(cc, {"id": course.external_id})
-    groups = canvas_course.get_groups(course.json_data.get("canvas_group_category"))
-    for group in groups:
-        errors = []
-        name = group.name
-        name = regex.sub(r"^.*(Gruppe \d+).*$", r"\1", name)
-        group, created = get_or_define(
-            db,
-            Group,
-            {"external_id": group.id},
-            {
-                "name": name,
-                "slug": slugify(name),
-                "course_id": course.id,
-                "join_model": JoinModel.AUTO,
-                "join_source": f"canvas_group({group.id})",
-                "kind": "group",
-            },
-        )
-        if created:
-            logger.info("created group %s", name)
-        db.add(group)
-        course_groups_sync_one(course_spec, group.id)
-        # sections = canvas_course.get_sections_raw()
-        # for row in sections:
-        #     print('group row', row)
-        #     update_sections_from_uib(db, row, course, changes=changes, sync_time=sync_time)
-    db.commit()
-    return changes
+    canvas_groups = canvas_course.get_groups(course.json_data.get("canvas_group_category"))
+    groups = {g.external_id: g for g in db.execute(
+        select(Group).where(Group.external_id.in_([str(cg.id) for cg in canvas_groups]))).scalars()}
+    # committed before the member lists are fetched, so we don't hold the database write lock meanwhile
+    with sync_batch(db):
+        for cg in canvas_groups:
+            if str(cg.id) not in groups:
+                name = regex.sub(r"^.*(Gruppe \d+).*$", r"\1", cg.name)
+                group, _ = get_or_define(
+                    db,
+                    Group,
+                    {"external_id": str(cg.id)},
+                    {
+                        "name": name,
+                        "slug": slugify(name),
+                        "course_id": course.id,
+                        "join_model": JoinModel.AUTO,
+                        "join_source": f"canvas_group({cg.id})",
+                        "kind": "group",
+                    },
+                )
+                logger.info("created group %s", name)
+                groups[str(cg.id)] = group
+    # sections = canvas_course.get_sections_raw()
+    # for row in sections:
+    #     print('group row', row)
+    #     update_sections_from_uib(db, row, course, changes=changes, sync_time=sync_time)
+    return __group_sync(course).sync(list(groups.values()))
+
+
+@bp.get("/<course_spec>/audit")
+@login_required
+def course_audit(course_spec):
+    """Changes to the course, its enrollments, groups and memberships, oldest first.
+
+    Query parameters: `since` (audit log id), `after` (ISO timestamp), `tables` (comma-separated)
+    and `limit`. Pass `next` from the result as `since` to get the following changes."""
+    course = get_course_or_fail(course_spec)
+
+    if not is_privileged(current_user, course):
+        raise ErrorResponse("Access denied", status_code=403)
+
+    since = request.args.get("since", type=int)
+    after = decode_date(request.args.get("after"))
+    tables = request.args.get("tables")
+    tables = tables.split(",") if tables else COURSE_AUDIT_TABLES
+    unknown = [t for t in tables if t not in COURSE_AUDIT_TABLES]
+    if unknown:
+        raise ErrorResponse("unknown tables", *unknown, status_code=400)
+    max_limit = current_app.config.get("AUDIT_LOG_MAX_LIMIT", 10000)
+    limit = request.args.get("limit", 1000, type=int)
+    if limit < 1:
+        raise ErrorResponse("limit must be at least 1", limit, status_code=400)
+    limit = min(limit, max_limit)
+
+    log = course_audit_log(db, course, since=since, after=after, tables=tables, limit=limit)
+    return {
+        "entries": [l.to_json() for l in log],
+        "next": log[-1].id if log else since,
+        "more": len(log) == limit,
+    }
 
 
 @bp.get("/canvas")
@@ -270,12 +270,12 @@ class CanvasAssignment(CanvasCreatableObject):
         return CanvasSubmission(self.conn, {'course_id':self.course_id, 'assignment_id':self.id, 'user_id':user_id})
 
     def get_submissions(self):
-        result = []
-        for data in self.conn.get_paginated(f'courses/{self.course_id}/assignments/{self.id}/submissions',{'include':['group','submission_comments'], 'grouped': True, 'per_page': 200}):
+        return list(self.iter_submissions())
+
+    def iter_submissions(self):
+        for data in self.conn.iter_paginated(f'courses/{self.course_id}/assignments/{self.id}/submissions',{'include':['group','submission_comments'], 'grouped': True, 'per_page': 200}):
             data['course_id'] = self.course_id
-            result.append(CanvasSubmission(self.conn, data))
-            
-        return result
+            yield CanvasSubmission(self.conn, data)
 
     def load(self):
         data = self.conn.get_single(CanvasAssignment.__get_path__.format(course_id = self.course_id, id = self.id))
@@ -0,0 +1,335 @@
+import asyncio
+from typing import Any, Iterable
+import logging
+
+from flask import Flask, current_app
+
+from puffin.util.async_apicalls import AsyncApiConnection
+from puffin.util.apicalls import ObjectLikeDict
+from .lib import CanvasObject, CanvasCreatableObject, term_cache, typename
+from .canvas import CanvasCourse, CanvasGroup, CanvasGroupCategory
+from .assignments import CanvasAssignment, CanvasSubmission, normalize_grade, stickers
+import random
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCanvasConnection(AsyncApiConnection):
+    """asyncio version of CanvasConnection. Objects returned from it have coroutine methods."""
+
+    def __init__(
+        self, app_or_base_url: Flask | str | None = None, token: str | None = None
+    ):
+        if isinstance(app_or_base_url, Flask):
+            app = app_or_base_url
+            app.extensions["puffin_async_canvas_connection"] = self
+            base_url = ''
+        else:
+            app = current_app
+            base_url = app_or_base_url
+        if app:
+            base_url = base_url or app.config.get("CANVAS_BASE_URL")
+            token = token or app.config.get("CANVAS_SECRET_TOKEN")
+            options = {'rate_limit': True, 'cache_size': 8 * 1024 * 1024, **self.options_from_config(app.config, "CANVAS")}
+        else:
+            options = {'rate_limit': True, 'cache_size': 8 * 1024 * 1024}
+
+        super().__init__(base_url or '', token or '', **options)
+
+        # share the synchronous connection's cache instead of keeping a second copy of the same responses
+        sync_conn = app.extensions.get("puffin_canvas_connection") if app else None
+        if self.cache != None and sync_conn != None and sync_conn.cache != None and sync_conn.base_url == self.base_url:
+            self.cache = sync_conn.cache
+
+        if app:
+            term_cache.configure(app.config.get("CANVAS_TERM_CACHE_TTL"), app.config.get("CANVAS_TERM_CACHE_PATH"))
+        self.terms = term_cache
+
+    async def get_term(self, root, term_id) -> dict[str, Any]:
+        term = await self.maybe_get_term(root, term_id, raise_on_error=True)
+        assert term != None
+        return term
+
+    async def maybe_get_term(self, root, term_id, raise_on_error=False):
+        result = self.terms.get(root, term_id)
+        if not result and not self.terms.is_loaded(root):
+            await self.load_terms(root)
+            result = self.terms.get(root, term_id)
+        if not result:
+            result = await self.maybe_request(
+                "GET", f"accounts/{root}/terms/{term_id}", raise_on_error=raise_on_error
+            )
+            if result:
+                self.terms.put(root, [result])
+        return result
+
+    async def load_terms(self, root) -> list[dict[str, Any]]:
+        """Fetch all terms of a root account into the shared term cache (see CanvasConnection.load_terms)."""
+        url = f'{self.base_url.rstrip("/")}/accounts/{root}/terms'
+        params = {"per_page": 200}
+        terms = []
+        while url:
+            page = await self._get_page(url, params, {}, False, False)
+            if page == None:
+                break
+            terms.extend(page[0].get("enrollment_terms", []))
+            url = page[1].get("next", {}).get("url")
+            params = None
+        self.terms.put(root, terms, all_terms=True)
+        return terms
+
+    async def course(self, id: int, stub: bool = False, **kwargs):
+        return await AsyncCanvasCourse.by_id(self, id, stub=stub, **kwargs)
+
+    async def group(self, id: int, stub: bool = False, **kwargs):
+        return await AsyncCanvasGroup.by_id(self, id, stub=stub, **kwargs)
+
+    async def group_category(self, id: int, stub: bool = False, **kwargs):
+        return await AsyncCanvasGroupCategory.by_id(self, id, stub=stub, **kwargs)
+
+
+class AsyncCanvasObject(ObjectLikeDict):
+    """asyncio counterpart of CanvasObject: the same data, but methods that talk to Canvas are coroutines.
+
+    Paths, attributes and the helpers that don't make requests come from the synchronous `sync_class`."""
+
+    sync_class: type[CanvasObject] = CanvasObject
+    id: int
+
+    def __init__(self, conn: AsyncCanvasConnection, data: dict):
+        self.conn = conn
+        super().__init__(data)
+
+    @classmethod
+    async def by_id(cls, conn: AsyncCanvasConnection, id: int, stub: bool = False, **kwargs):
+        if stub == True:
+            data = {"id": id}
+            data.update(kwargs)
+            return cls(conn, data)
+        path = getattr(cls.sync_class, "__get_path__", typename(cls.sync_class) + "s/{id}").format(
+            id=id, **kwargs
+        )
+        result = await conn.get_single(path)
+        return cls(conn, result)
+
+
+class AsyncCanvasCreatableObject(AsyncCanvasObject):
+    sync_class: type[CanvasCreatableObject] = CanvasCreatableObject
+
+    @classmethod
+    async def create(cls, conn: AsyncCanvasConnection, **kwargs):
+        path, params = cls.sync_class.create_params(**kwargs)
+        result = await conn.post(path, params)
+        return cls(conn, result)
+
+
+class AsyncCanvasCourse(AsyncCanvasObject):
+    sync_class = CanvasCourse
+
+    clean_with_term = CanvasCourse.clean_with_term
+    set_user_role = staticmethod(CanvasCourse.set_user_role)
+    open_sync_csv = staticmethod(CanvasCourse.open_sync_csv)
+
+    async def clean(self):
+        term = None
+        if self.root_account_id and self["enrollment_term_id"]:
+            term = await self.conn.maybe_get_term(
+                self["root_account_id"], self["enrollment_term_id"]
+            )
+        return self.clean_with_term(term)
+
+    @staticmethod
+    async def get_user_courses(conn: AsyncCanvasConnection, userid="self", enrollment=None):
+        params = {}
+        if enrollment:
+            params = {'enrollment_type':enrollment}
+        return [
+            AsyncCanvasCourse(conn, c) for c in await conn.get_paginated(f"users/{userid}/courses", params)
+        ]
+
+    @staticmethod
+    async def get_profile(conn: AsyncCanvasConnection, userid):
+        return await conn.get_single(f"users/{userid}/profile")
+
+    async def get_users_raw(self):
+        return [u async for u in self.iter_users_raw()]
+
+    async def iter_users_raw(self):
+        params = {
+            "include[]": [
+                "email",
+                "avatar_url",
+                "enrollments",
+                "locale",
+                "effective_locale",
+                "test_student",
+                "login_id"
+            ],
+            "per_page": "200",
+        }
+        async for u in self.conn.iter_paginated(f"courses/{self.id}/users", params):
+            yield u
+
+    async def get_sections_raw(self):
+        params = {"include[]": ["students"], "per_page": "200"}
+        return await self.conn.get_paginated(f"courses/{self.id}/sections", params)
+
+    async def get_peer_reviews(self, assignment_id):
+        return await self.conn.get_paginated(
+            f"courses/{self.id}/assignments/{assignment_id}/peer_reviews"
+        )
+
+    async def get_submissions(self, assignment_id):
+        return await self.conn.get_paginated(
+            f"courses/{self.id}/assignments/{assignment_id}/submissions"
+        )
+
+    async def get_users(self):
+        return [u async for u in self.iter_users()]
+
+    async def iter_users(self):
+        """Yield course users (with role and canvas_role) as pages arrive from Canvas."""
+        with CanvasCourse.open_sync_csv() as writer:
+            async for u in self.iter_users_raw():
+                if CanvasCourse.set_user_role(u):
+                    if writer:
+                        writer.writerow(u)
+                    yield u
+
+    async def get_groups(self, category:int|None = None):
+        if category != None:
+            result = await self.conn.get_paginated(f"group_categories/{category}/groups")
+        else:
+            result = await self.conn.get_paginated(f"courses/{self.id}/groups")
+        return [AsyncCanvasGroup(self.conn, data) for data in result]
+
+    async def get_group_categories(self):
+        result = await self.conn.get_paginated(f"courses/{self.id}/group_categories")
+        return [AsyncCanvasGroupCategory(self.conn, data) for data in result]
+
+    async def get_group_categories_by_name(self):
+        result = await self.conn.get_paginated(f"courses/{self.id}/group_categories")
+        return {data["name"]: AsyncCanvasGroupCategory(self.conn, data) for data in result}
+
+    async def get_assignment_submissions(self, assignment_id):
+        return [AsyncCanvasAssignment(self.conn, data) for data in await self.conn.get_paginated(f'courses/{self.id}/assignments/{assignment_id}/submissions',{'include':['group','submission_comments'], 'grouped': True})]
+
+    def get_assignment(self, assignment_id):
+        return AsyncCanvasAssignment(self.conn, {'course_id':self.id, 'id':assignment_id})
+
+    async def grade_assignment_submission(self, assignment_id, user_id, posted_grade, text_comment = None, sticker = None):
+        params = {'submission': {'posted_grade':posted_grade}}
+        if text_comment != None:
+            params['text_comment'] = {'text_comment' : text_comment, 'group_comment' : True}
+        if sticker != None:
+            params['submission']['sticker'] = sticker
+        return await self.conn.request('PUT', f'courses/{self.id}/assignments/{assignment_id}/submissions/{user_id}',params)
+
+
+class AsyncCanvasGroup(AsyncCanvasCreatableObject):
+    sync_class = CanvasGroup
+
+    async def add_member(self, user_id: int | Iterable[int], moderator=False):
+        if isinstance(user_id, int):
+            return await self.conn.post(f"groups/{self.id}/memberships", {"user_id": user_id})
+        else:
+            return await asyncio.gather(*[self.add_member(i) for i in user_id])
+
+    async def remove_member(self, user_id: int | Iterable[int]):
+        if isinstance(user_id, int):
+            return await self.conn.request("DELETE", f"groups/{self.id}/users/{user_id}")
+        else:
+            return await asyncio.gather(*[self.remove_member(i) for i in user_id])
+
+    async def members(self):
+        return await self.conn.get_paginated(f"groups/{self.id}/memberships")
+
+    async def set_members(self, members: list[int]):
+        return await self.conn.request("PUT", f"groups/{self.id}", {"members":members})
+
+
+class AsyncCanvasGroupCategory(AsyncCanvasCreatableObject):
+    sync_class = CanvasGroupCategory
+
+    async def get_groups(self):
+        result = await self.conn.get_paginated(f"group_categories/{self.id}/groups")
+        return [AsyncCanvasGroup(self.conn, data) for data in result]
+
+    async def get_groups_by_name(self):
+        result = await self.conn.get_paginated(f"group_categories/{self.id}/groups")
+        return {data["name"]: AsyncCanvasGroup(self.conn, data) for data in result}
+
+
+class AsyncCanvasAssignment(AsyncCanvasCreatableObject):
+    sync_class = CanvasAssignment
+
+    def get_submission(self, user_id):
+        return AsyncCanvasSubmission(self.conn, {'course_id':self.course_id, 'assignment_id':self.id, 'user_id':user_id})
+
+    async def get_submissions(self):
+        return [s async for s in self.iter_submissions()]
+
+    async def iter_submissions(self):
+        async for data in self.conn.iter_paginated(f'courses/{self.course_id}/assignments/{self.id}/submissions',{'include':['group','submission_comments'], 'grouped': True, 'per_page': 200}):
+            data['course_id'] = self.course_id
+            yield AsyncCanvasSubmission(self.conn, data)
+
+    async def load(self):
+        data = await self.conn.get_single(CanvasAssignment.__get_path__.format(course_id = self.course_id, id = self.id))
+        self.update(data)
+        return self
+
+
+class AsyncCanvasSubmission(AsyncCanvasCreatableObject):
+    sync_class = CanvasSubmission
+
+    find_name_in_comment = CanvasSubmission.find_name_in_comment
+    find_users_in_comment = CanvasSubmission.find_users_in_comment
+
+    async def load(self):
+        data = await self.conn.get_single(CanvasSubmission.__get_path__.format(course_id = self.course_id, assignment_id = self.assignment_id, user_id = self.user_id), {'include':['submission_comments']})
+        self.update(data)
+        return self
+
+    async def post_grade(self, posted_grade : float|str|int):
+        if normalize_grade(self.grade) == normalize_grade(posted_grade):
+            print(f'grade {posted_grade} already set for {self.user_id}')
+            return self
+        else:
+            print(f'setting grade {posted_grade} for {self.user_id}')
+
+        data = {
+            'submission' : {
+                'posted_grade' : posted_grade,
+                'sticker' : random.choice(stickers),
+            }
+        }
+
+        result = await self.conn.put(CanvasSubmission.__put_path__.format(course_id = self.course_id, assignment_id = self.assignment_id, user_id = self.user_id), data, debug = True)
+        self.update(result)
+        return self
+
+    async def submit(self, submission_type, url = None, body = None, comment = None):
+        if submission_type not in ['online_text_entry', 'online_url', 'online_upload', 'media_recording', 'basic_lti_launch', 'student_annotation']:
+            raise ValueError('Illegal submission type')
+
+        if self.submission_type == submission_type and self.url == url and self.body == body:
+            print('already submitted')
+            return
+
+        data = {
+            'submission' : {
+                'submission_type' : submission_type,
+                'user_id' : self.user_id
+            }
+        }
+        if comment:
+            data['comment'] = {'text_comment' : comment}
+        if submission_type == 'online_url':
+            data['submission']['url'] = url
+        if submission_type == 'online_text_entry':
+            data['submission']['body'] = body
+
+        result = await self.conn.post(CanvasSubmission.__create_path__.format(course_id = self.course_id, assignment_id = self.assignment_id, user_id = self.user_id), data, debug = True)
+        self.update(result)
+        return self
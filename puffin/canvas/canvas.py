@@ -1,7 +1,9 @@
 from flask import current_app
+from contextlib import contextmanager, suppress
 from typing import Any, Iterable, Self, Annotated
 import csv
 import os
+import tempfile
 from flask import Flask, current_app
 import logging
 
@@ -18,20 +20,24 @@ from .lib import *
 class CanvasCourse(CanvasObject):
 
     def clean(self):
-        result = {}
+        term = None
         if self.root_account_id and self["enrollment_term_id"]:
             term = self.conn.maybe_get_term(
                 self["root_account_id"], self["enrollment_term_id"]
             )
-            if term:
-                self["start_at"] = self["start_at"] or term["start_at"]
-                self["end_at"] = self["end_at"] or term["end_at"]
-                result["term"] = term["name"]
-                result["term_slug"] = term["term_slug"]
-                if result["term_slug"]:
-                    result["slug"] = (
-                        f"{self['course_code'].lower()}-{term['term_slug']}"
-                    )
+        return self.clean_with_term(term)
+
+    def clean_with_term(self, term: dict[str, Any] | None):
+        result = {}
+        if term:
+            self["start_at"] = self["start_at"] or term["start_at"]
+            self["end_at"] = self["end_at"] or term["end_at"]
+            result["term"] = term["name"]
+            result["term_slug"] = term["term_slug"]
+            if result["term_slug"]:
+                result["slug"] = (
+                    f"{self['course_code'].lower()}-{term['term_slug']}"
+                )
         for k in [
             "id",
             "course_code",
@@ -64,6 +70,9 @@ class CanvasCourse(CanvasObject):
         return conn.get_single(f"users/{userid}/profile")
 
     def get_users_raw(self):
+        return list(self.iter_users_raw())
+
+    def iter_users_raw(self):
         params = {
             "include[]": [
                 "email",
@@ -76,7 +85,7 @@ class CanvasCourse(CanvasObject):
             ],
             "per_page": "200",
         }
-        return self.conn.get_paginated(f"courses/{self.id}/users", params)
+        return self.conn.iter_paginated(f"courses/{self.id}/users", params)
 
     def get_sections_raw(self):
         params = {"include[]": ["students"], "per_page": "200"}
@@ -93,52 +102,78 @@ class CanvasCourse(CanvasObject):
         )
 
     def get_users(self):
-        jsonUsers = self.get_users_raw()
-        users = []
-
-        for u in jsonUsers:
-            role = ""
-            specific_role = ""
-            enrollments = u.get("enrollments", [])
-            print("\n")
-            print(u["name"], u.get('login_id'))
-            for e in enrollments:
-                print(" * ", e["enrollment_state"], e["type"], e["role"])
-                if e["type"] == "StudentEnrollment" and role in [""]:
-                    role = "student"
-                    specific_role = e["role"]
-                elif e["type"] == "TaEnrollment" and role in ["", "student"]:
-                    role = "ta"
-                    specific_role = e["role"]
-                elif e["type"] == "TeacherEnrollment" and role in ["", "ta", "student"]:
-                    role = "teacher"
-                    specific_role = e["role"]
-                elif e["type"] == "Administrasjon" and role in ["", "ta", "student"]:
-                    role = "admin"
-                    specific_role = e["role"]
-
-            if role != "":
-                if role.startswith("Admin"):
-                    role = "admin"
-                u["role"] = role
-                u["canvas_role"] = specific_role or role
-                print("→", role, specific_role)
-                users.append(u)
+        return list(self.iter_users())
+
+    def iter_users(self):
+        """Yield course users (with role and canvas_role) as pages arrive from Canvas."""
+        with CanvasCourse.open_sync_csv() as writer:
+            for u in self.iter_users_raw():
+                if CanvasCourse.set_user_role(u):
+                    if writer:
+                        writer.writerow(u)
+                    yield u
+
+    @staticmethod
+    def set_user_role(u) -> bool:
+        """Set role and canvas_role from the user's enrollments. Returns False if the user has no relevant role."""
+        role = ""
+        specific_role = ""
+        enrollments = u.get("enrollments", [])
+        print("\n")
+        print(u["name"], u.get('login_id'))
+        for e in enrollments:
+            print(" * ", e["enrollment_state"], e["type"], e["role"])
+            if e["type"] == "StudentEnrollment" and role in [""]:
+                role = "student"
+                specific_role = e["role"]
+            elif e["type"] == "TaEnrollment" and role in ["", "student"]:
+                role = "ta"
+                specific_role = e["role"]
+            elif e["type"] == "TeacherEnrollment" and role in ["", "ta", "student"]:
+                role = "teacher"
+                specific_role = e["role"]
+            elif e["type"] == "Administrasjon" and role in ["", "ta", "student"]:
+                role = "admin"
+                specific_role = e["role"]
+
+        if role != "":
+            if role.startswith("Admin"):
+                role = "admin"
+            u["role"] = role
+            u["canvas_role"] = specific_role or role
+            print("→", role, specific_role)
+            return True
+        return False
+
+    @staticmethod
+    @contextmanager
+    def open_sync_csv():
+        """A CSV writer for last_canvas_sync.csv (None if it can't be written).
+
+        Rows go to a temporary file which replaces the old one when the sync is done, so
+        concurrent syncs don't mix their rows, and an aborted sync leaves the last complete file."""
+        fields = "sortable_name,name,login_id,email,id,avatar_url,role,canvas_role".split(
+            ","
+        )
         try:
-            fields = "sortable_name,name,login_id,email,id,avatar_url,role,canvas_role".split(
-                ","
+            path = os.path.join(current_app.config["APP_PATH"], "last_canvas_sync.csv")
+            f = tempfile.NamedTemporaryFile(
+                "w", dir=os.path.dirname(path), prefix="last_canvas_sync.", suffix=".tmp", delete=False
             )
-            with open(
-                os.path.join(current_app.config["APP_PATH"], "last_canvas_sync.csv"),
-                "w",
-            ) as f:
+            tmp_path = f.name
+        except Exception:
+            yield None
+            return
+        try:
+            with f:
                 writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
                 writer.writeheader()
-                writer.writerows(users)
-        except:
-            pass
-
-        return users
+                yield writer
+        except BaseException:
+            with suppress(OSError):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
 
     def get_groups(self, category:int|None = None):
         if category != None:
@@ -5,12 +5,121 @@ import re
 from flask import Flask, current_app
 import re
 import logging
+import json
+import os
+import threading
+import time
 
 from slugify import slugify
 from puffin.util.apicalls import ApiConnection, ObjectLikeDict, Undefined, all_attrs, required_attrs
 
 logger = logging.getLogger(__name__)
 
+
+def add_term_slug(term: dict[str, Any]) -> dict[str, Any]:
+    """Add a short slug for the term, e.g. '24h' for 'Haust 2024'"""
+    mo = re.match(r"^(\w).*(\d\d)$", term.get("name", ""))
+    if mo:
+        term["term_slug"] = f"{mo.group(2)}{mo.group(1).lower()}"
+    else:
+        term["term_slug"] = slugify(term["name"])
+    return term
+
+
+class TermCache:
+    """Enrollment terms by (root account, term id), shared by all Canvas connections in the process.
+
+    Terms are loaded for a whole root account at a time. Entries expire after `ttl` seconds.
+    If `path` is set, the cache is also saved to that JSON file, so other worker
+    processes (and restarts) can use it."""
+
+    def __init__(self, ttl: float = 24 * 3600, path: str | None = None):
+        self.ttl = ttl
+        self.path = path
+        self.lock = threading.Lock()
+        self.terms: dict[tuple[int, int], tuple[float, dict[str, Any]]] = {}  # → (time cached, term)
+        self.loaded: dict[int, float] = {}  # root account → time of last bulk load
+        self.file_mtime = None
+
+    def configure(self, ttl: float | None = None, path: str | None = None):
+        with self.lock:
+            if ttl != None:
+                self.ttl = ttl
+            if path != None and path != self.path:
+                self.path = path
+                self.file_mtime = None
+
+    def get(self, root: int, term_id: int) -> dict[str, Any] | None:
+        with self.lock:
+            self._read_file()
+            entry = self.terms.get((root, term_id))
+            if entry == None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                del self.terms[(root, term_id)]
+                return None
+            return entry[1]
+
+    def is_loaded(self, root: int) -> bool:
+        """True if all terms of the root account were loaded recently."""
+        with self.lock:
+            self._read_file()
+            return time.time() - self.loaded.get(root, 0) <= self.ttl
+
+    def put(self, root: int, terms: list[dict[str, Any]], all_terms: bool = False):
+        now = time.time()
+        with self.lock:
+            self._read_file()
+            for term in terms:
+                self.terms[(root, term["id"])] = (now, add_term_slug(term))
+            if all_terms:
+                self.loaded[root] = now
+            self._write_file()
+
+    def clear(self):
+        with self.lock:
+            self.terms.clear()
+            self.loaded.clear()
+            self._write_file()
+
+    def _read_file(self):
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self.file_mtime:
+                return
+            with open(self.path) as f:
+                data = json.load(f)
+            self.terms.update({(e["account_id"], e["term"]["id"]): (e["cached_at"], e["term"]) for e in data.get("terms", [])})
+            self.loaded.update({int(k): v for k, v in data.get("loaded", {}).items()})
+            self.file_mtime = mtime
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Failed to read term cache %s: %s", self.path, e)
+
+    def _write_file(self):
+        if not self.path:
+            return
+        try:
+            data = {
+                "terms": [{"account_id": root, "cached_at": t, "term": term} for (root, _), (t, term) in self.terms.items()],
+                "loaded": self.loaded,
+            }
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+            self.file_mtime = os.stat(self.path).st_mtime
+        except Exception as e:
+            logger.warning("Failed to write term cache %s: %s", self.path, e)
+
+
+# keep the cache when the module is reloaded
+term_cache: TermCache = globals().get("term_cache") or TermCache()
+
+
 class CanvasConnection(ApiConnection):
 
     def __init__(
@@ -26,10 +135,15 @@ class CanvasConnection(ApiConnection):
         if app:
             base_url = base_url or app.config.get("CANVAS_BASE_URL")
             token = token or app.config.get("CANVAS_SECRET_TOKEN")
+            options = {'rate_limit': True, 'cache_size': 8 * 1024 * 1024, **self.options_from_config(app.config, "CANVAS")}
+        else:
+            options = {'rate_limit': True, 'cache_size': 8 * 1024 * 1024}
 
-        super().__init__(base_url or '', token or '')
+        super().__init__(base_url or '', token or '', **options)
 
-        self.terms = {}
+        if app:
+            term_cache.configure(app.config.get("CANVAS_TERM_CACHE_TTL"), app.config.get("CANVAS_TERM_CACHE_PATH"))
+        self.terms = term_cache
 
     def get_term(self, root, term_id) -> dict[str, Any]:
         term = self.maybe_get_term(root, term_id, raise_on_error=True)
@@ -37,20 +151,36 @@ class CanvasConnection(ApiConnection):
         return term
 
     def maybe_get_term(self, root, term_id, raise_on_error=False):
-        result = self.terms.get((root, term_id))
+        result = self.terms.get(root, term_id)
+        if not result and not self.terms.is_loaded(root):
+            self.load_terms(root)
+            result = self.terms.get(root, term_id)
         if not result:
             result = self.maybe_request(
                 "GET", f"accounts/{root}/terms/{term_id}", raise_on_error=raise_on_error
             )
             if result:
-                mo = re.match(r"^(\w).*(\d\d)$", result.get("name", ""))
-                if mo:
-                    result["term_slug"] = f"{mo.group(2)}{mo.group(1).lower()}"
-                else:
-                    result["term_slug"] = slugify(result["name"])
-                self.terms[(root, term_id)] = result
+                self.terms.put(root, [result])
         return result
 
+    def load_terms(self, root) -> list[dict[str, Any]]:
+        """Fetch all terms of a root account into the term cache.
+
+        Only admins may list terms; for others this fails quietly (once per TTL) and
+        terms are fetched one by one instead."""
+        url = f'{self.base_url.rstrip("/")}/accounts/{root}/terms'
+        params = {"per_page": 200}
+        terms = []
+        while url:
+            page = self._get_page(url, params, {}, False, False)
+            if page == None:
+                break
+            terms.extend(page[0].get("enrollment_terms", []))
+            url = page[1].get("next", {}).get("url")
+            params = None
+        self.terms.put(root, terms, all_terms=True)
+        return terms
+
     def course(self, id: int, stub: bool = False, **kwargs):
         from .canvas import CanvasCourse
         return CanvasCourse.by_id(self, id, stub=stub, **kwargs)
@@ -113,6 +243,12 @@ class CanvasObject(ObjectLikeDict):
 class CanvasCreatableObject(CanvasObject):
     @classmethod
     def create(cls, conn: CanvasConnection, **kwargs):
+        path, params = cls.create_params(**kwargs)
+        result = conn.post(path, params)
+        return cls(conn, result)
+
+    @classmethod
+    def create_params(cls, **kwargs) -> tuple[str, dict[str, Any]]:
         path = getattr(cls, "__create_path__").format(id=id, **kwargs)
         for n, t, _ in required_attrs(cls):
             if not isinstance(kwargs.get(n), t):
@@ -123,6 +259,5 @@ class CanvasCreatableObject(CanvasObject):
                 params[n] = kwargs[n]
             elif d is not Undefined:
                 params[n] = d
-        print("payload", params)
-        result = conn.post(path, params)
-        return cls(conn, result)
+        logger.debug("create %s: %s", path, params)
+        return path, params
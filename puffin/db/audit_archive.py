@@ -0,0 +1,142 @@
+"""Audit log retention: archive old entries to monthly files, and drop UPDATEs that changed nothing.
+
+The audit log grows with every sync, since the triggers from create_triggers() log every row
+write. Entries older than the retention period can be moved to compressed JSON Lines files
+(`audit_log-YYYY-MM.jsonl.gz`, one entry per line, same fields as AuditLog.to_json()), and UPDATE
+entries with identical old and new data can be deleted.
+
+The newest entry of each object (table_name, row_id) is never archived, so the log always has the
+last known state of every row. In particular, the newest entry overall is kept: on SQLite, audit
+log ids are rowids, and removing the entry with the highest id would let its id be reused, which
+confuses clients of course_audit_log(). Compaction keeps the entry with the highest id too.
+"""
+from datetime import datetime, timezone
+import gzip
+import json
+import logging
+import os
+from typing import Callable, Iterator
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from puffin.util.json_provider import dumps
+from . import database
+from .model_tables import AuditLog, LogType
+
+logger = logging.getLogger(__name__)
+
+Progress = Callable[[int, int], None]  # (entries done, entries to do)
+
+
+def _max_id(session: sa.orm.Session) -> int:
+    return session.execute(sa.select(sa.func.max(AuditLog.id))).scalar() or 0
+
+
+def audit_log_time(session: sa.orm.Session, when: datetime):
+    """`when` (naive means UTC) as a value to compare with AuditLog.timestamp.
+
+    The triggers store CURRENT_TIMESTAMP in a column without time zone: that's UTC on SQLite, but
+    the session's local time on PostgreSQL, so there the conversion is left to the database."""
+    if when.tzinfo == None:
+        when = when.replace(tzinfo=timezone.utc)
+    if session.get_bind().dialect.name == 'postgresql':
+        return sa.cast(sa.literal(when, sa.DateTime(timezone=True)), sa.DateTime())
+    return when.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _is_noop(session: sa.orm.Session):
+    if session.get_bind().dialect.name == 'postgresql':
+        # the log function stores json, which has no equality operator
+        return sa.cast(AuditLog.old_data, postgresql.JSONB) == sa.cast(AuditLog.new_data, postgresql.JSONB)
+    # json_object() output, compared as text
+    return sa.type_coerce(AuditLog.old_data, sa.Text) == sa.type_coerce(AuditLog.new_data, sa.Text)
+
+
+def compact_audit_log(session: sa.orm.Session, batch_size: int = 10000, dry_run=False,
+                      progress: Progress | None = None) -> int:
+    """Delete UPDATE entries where the old and new data are the same. Returns the number of entries
+    deleted (or that would be deleted, with `dry_run`).
+
+    Works through the log in id ranges of `batch_size`, committing after each, so that other
+    writers aren't locked out for long."""
+    last = _max_id(session)
+    first = session.execute(sa.select(sa.func.min(AuditLog.id))).scalar() or 0
+    noop = sa.and_(AuditLog.type == LogType.UPDATE, _is_noop(session))
+    deleted = 0
+    for lo in range(first - 1, last - 1, batch_size):
+        in_range = sa.and_(AuditLog.id > lo, AuditLog.id <= min(lo + batch_size, last - 1))
+        if dry_run:
+            deleted += session.execute(sa.select(sa.func.count()).select_from(AuditLog).where(in_range, noop)).scalar() or 0
+        else:
+            database.begin_write(session)
+            deleted += session.execute(sa.delete(AuditLog).where(in_range, noop)).rowcount
+            session.commit()
+        if progress:
+            progress(min(lo + batch_size, last) - first + 1, last - first + 1)
+    logger.info("compact_audit_log: %s %d no-op updates", "found" if dry_run else "deleted", deleted)
+    return deleted
+
+
+def archive_audit_log(session: sa.orm.Session, before: datetime, directory: str, batch_size: int = 10000,
+                      dry_run=False, progress: Progress | None = None) -> int:
+    """Move entries older than `before` (naive means UTC) to monthly archive files in `directory`,
+    except the newest entry of each object. Returns the number of entries archived (or that would
+    be archived, with `dry_run`).
+
+    Entries are appended to the files before they are deleted from the database, one batch at a
+    time. If this is interrupted, the last batch may end up in the archive twice; read_archive()
+    skips such duplicates."""
+    newer = sa.orm.aliased(AuditLog)
+    newest = sa.select(sa.func.max(newer.id)).where(
+        newer.table_name == AuditLog.table_name, newer.row_id == AuditLog.row_id).scalar_subquery()
+    old = sa.and_(AuditLog.timestamp < audit_log_time(session, before), AuditLog.id < newest)
+    total = session.execute(sa.select(sa.func.count()).select_from(AuditLog).where(old)).scalar() or 0
+    if dry_run or total == 0:
+        return total
+    os.makedirs(directory, exist_ok=True)
+    done = 0
+    last_id = 0
+    while True:
+        entries = session.execute(
+            sa.select(AuditLog).where(old, AuditLog.id > last_id).order_by(AuditLog.id).limit(batch_size)).scalars().all()
+        if not entries:
+            break
+        by_month: dict[str, list[str]] = {}
+        for e in entries:
+            by_month.setdefault(e.timestamp.strftime('%Y-%m'), []).append(dumps(e.to_json()))
+        for (month, lines) in by_month.items():
+            # appending makes a multi-member gzip file, which gzip.open() reads as one
+            with gzip.open(archive_path(directory, month), 'at') as f:
+                f.write('\n'.join(lines) + '\n')
+        last_id = entries[-1].id
+        database.begin_write(session)
+        session.execute(sa.delete(AuditLog).where(AuditLog.id.in_([e.id for e in entries])))
+        session.commit()
+        session.expunge_all()
+        done += len(entries)
+        if progress:
+            progress(done, total)
+    logger.info("archive_audit_log: archived %d entries older than %s to %s", done, before, directory)
+    return done
+
+
+def archive_path(directory: str, month: str) -> str:
+    return os.path.join(directory, f'audit_log-{month}.jsonl.gz')
+
+
+def read_archive(directory: str, month: str | None = None) -> Iterator[dict]:
+    """Archived entries (as dicts), oldest first, for one month (YYYY-MM) or all months."""
+    if month:
+        files = [archive_path(directory, month)]
+    else:
+        files = sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                       if f.startswith('audit_log-') and f.endswith('.jsonl.gz'))
+    seen = set()
+    for path in files:
+        with gzip.open(path, 'rt') as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry['id'] not in seen:
+                    seen.add(entry['id'])
+                    yield entry
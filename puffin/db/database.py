@@ -1,24 +1,121 @@
 from datetime import datetime
-import enum
 from io import TextIOWrapper
-import json
+import operator
 from typing import Any, cast
 from flask import Flask
-from sqlalchemy import Column, MetaData, Table, create_engine, select, event
-from sqlalchemy.orm import Session, scoped_session, sessionmaker, DeclarativeBase, Query,MappedAsDataclass
+from sqlalchemy import Column, MetaData, Table, create_engine, make_url, select, event, Enum as SAEnum
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, scoped_session, sessionmaker, DeclarativeBase, Query,MappedAsDataclass, Mapper
 from werkzeug.security import generate_password_hash
 
-from puffin.util.util import DateEncoder
+from puffin.util import json_provider
 
 db_scoped_session : scoped_session = scoped_session(sessionmaker())
 db_session : Session = cast(Session, db_scoped_session)
 
+# PRAGMAs set on each new SQLite connection, selected with SQLITE_PROFILE (and adjusted with
+# SQLITE_PRAGMAS). 'production' uses WAL so readers don't block the writer, and waits for locks
+# instead of failing with "database is locked".
+SQLITE_PROFILES : dict[str, dict[str, Any]] = {
+    'default': {},
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',    # with WAL, only a power loss can lose the last commits
+        'busy_timeout': 10000,      # ms
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,   # KiB
+        'temp_store': 'MEMORY',
+    },
+}
+
 def configure(app:Flask):
     global engine
-    engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'], echo=False, future=True)
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    options = {}
+    if url.get_backend_name() == 'postgresql':
+        # each gunicorn worker gets its own pool; keep it small and drop dead/old connections
+        options = {
+            'pool_size': app.config.get('SQLALCHEMY_POOL_SIZE', 5),
+            'max_overflow': app.config.get('SQLALCHEMY_MAX_OVERFLOW', 10),
+            'pool_timeout': app.config.get('SQLALCHEMY_POOL_TIMEOUT', 30),
+            'pool_recycle': app.config.get('SQLALCHEMY_POOL_RECYCLE', 1800),
+            'pool_pre_ping': True,
+            'pool_use_lifo': True,   # lets idle connections time out on the server side
+        }
+    engine = create_engine(url, echo=False, future=True, **options)
+    if engine.dialect.name == 'sqlite':
+        pragmas = dict(SQLITE_PROFILES[app.config.get('SQLITE_PROFILE', 'production')])
+        pragmas.update(app.config.get('SQLITE_PRAGMAS', {}))
+        configure_sqlite(engine, pragmas, app.config.get('SQLITE_BEGIN', 'DEFERRED'))
     db_scoped_session.configure(autocommit=False,
                          autoflush=False,
                          bind=engine)
+
+def configure_sqlite(engine, pragmas : dict[str, Any], begin : str = 'DEFERRED'):
+    """Set `pragmas` on every new connection, and start transactions with BEGIN `begin`.
+
+    pysqlite's own transaction handling is turned off, so that we can emit BEGIN IMMEDIATE
+    for write transactions (see begin_write()) and SAVEPOINTs work properly."""
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def on_begin(conn):
+        conn.exec_driver_sql(f'BEGIN {conn.get_execution_options().get("sqlite_begin", begin)}')
+
+def dialect_insert(session : Session | scoped_session, entity):
+    """An INSERT for `entity` that supports on_conflict_do_update() on the session's database (SQLite or PostgreSQL)."""
+    if session.get_bind().dialect.name == 'postgresql':
+        return postgresql.insert(entity)
+    else:
+        return sqlite.insert(entity)
+
+def begin_write(session : Session | scoped_session = db_scoped_session):
+    """Start the session's transaction as a write transaction (BEGIN IMMEDIATE on SQLite).
+
+    A DEFERRED transaction that reads first and then writes can fail with "database is locked"
+    without waiting, if another connection wrote in the meantime; an IMMEDIATE transaction takes
+    the write lock up front (waiting up to busy_timeout), and holds it until commit – so call this
+    right before writing, after any slow work (e.g. fetching from Canvas/GitLab) is done.
+
+    On SQLite, a transaction that has only read so far is ended first (keeping the loaded objects
+    as they are), so the write transaction can start. No effect if the session has already written.
+
+    Those objects may be out of date by the time the lock is taken: callers must re-query anything
+    their writes depend on after this call, with `populate_existing=True` for objects that are
+    already in the session (or expire them first)."""
+    if isinstance(session, scoped_session):
+        session = session()
+    if session.in_transaction() and session.get_bind().dialect.name == 'sqlite' \
+            and not session.info.get('wrote') and not (session.new or session.dirty or session.deleted):
+        expire_on_commit = session.expire_on_commit
+        session.expire_on_commit = False
+        try:
+            session.commit()
+        finally:
+            session.expire_on_commit = expire_on_commit
+    if not session.in_transaction():
+        session.connection(execution_options={'sqlite_begin': 'IMMEDIATE'})
+
+@event.listens_for(Session, 'after_flush')
+def _after_flush(session, flush_context):
+    session.info['wrote'] = True
+
+@event.listens_for(Session, 'do_orm_execute')
+def _on_execute(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info['wrote'] = True
+
+@event.listens_for(Session, 'after_transaction_end')
+def _after_transaction_end(session, transaction):
+    if transaction.parent == None:
+        session.info.pop('wrote', None)
+
 _naming_convention = {
         "ix": "ix_%(column_0_label)s",
         "uq": "uq_%(table_name)s_%(column_0_name)s",
@@ -36,36 +133,80 @@ class PreBase():
         if not hasattr(self, __name) or getattr(self, __name) != __value:
             return super().__setattr__(__name, __value)
 
+    @classmethod
+    def serializer(cls) -> 'Serializer':
+        """The class' serializer, normally made when its mapper is configured."""
+        ser = cls.__dict__.get('__serializer__')
+        if ser == None:
+            ser = Serializer(cls)
+            setattr(cls, '__serializer__', ser)
+        return ser
+
     def to_json(self):
-        def col_json(col):
-            val = getattr(self, col.key)
-            if isinstance(val, enum.Enum):
-                return val.name
-            else:
-                return val
-        result = {col.key : col_json(col) for col in self.__table__.c if not col.info.get('secret', False)}
-        result['_type'] = self.__tablename__
-        return result
-    
+        return self.serializer().obj(self)
+
     def to_result(self, privileged=False):
-        def col_json(col):
-            val = getattr(self, col.key)
-            if isinstance(val, enum.Enum):
-                return val.name
-            else:
-                return val
-        result : dict[str,Any] = {col.key : col_json(col) for col in self.__table__.c if not col.info.get('secret', False)}
-        if not privileged:
-            if 'json_data' in result:
-                tmp = result.copy()
-                allowed = getattr(self, 'info', {}).get('public_json', [])
-                result['json_data'] = {k:v for k,v in result['json_data'].items() if k in allowed}
-                print('PROTECT', allowed, tmp.get('json_data'), result.get('json_data'))
-        result['_type'] = self.__tablename__
-        return result
+        return self.serializer().obj(self, privileged)
 
     def __repr__(self):
-        return json.dumps(self.to_json(), cls=DateEncoder)
+        return json_provider.dumps(self.to_json())
+
+class Serializer:
+    """Builds to_json/to_result dicts for one mapped class.
+
+    The visible columns, enum columns and public json_data keys are worked out once. Besides ORM
+    objects (`obj`), it takes rows from core selects of the class' table (`row`, `rows`), so list
+    endpoints can skip loading objects, e.g. `Membership.serializer().rows(db.execute(select(*Membership.__table__.c)))`."""
+
+    def __init__(self, cls):
+        cols = [col for col in cls.__table__.c if not col.info.get('secret', False)]
+        self.keys = tuple(col.key for col in cols)
+        self.enum_keys = tuple(col.key for col in cols if isinstance(col.type, SAEnum) and col.type.enum_class != None)
+        self.typename = cls.__tablename__
+        self.public_json = getattr(cls, 'info', {}).get('public_json', []) if 'json_data' in self.keys else None
+        self.names = tuple(col.name for col in cols)
+        self._from_obj = operator.attrgetter(*self.keys) if len(self.keys) > 1 else lambda obj: (getattr(obj, self.keys[0]),)
+        self._row_getters = {}
+
+    def _from_row(self, row):
+        """Column values from a row, picked by position (worked out once per set of result columns)."""
+        getter = self._row_getters.get(row._fields)
+        if getter == None:
+            positions = [row._fields.index(name) for name in self.names]
+            getter = operator.itemgetter(*positions) if len(positions) > 1 else lambda r: (r[positions[0]],)
+            self._row_getters[row._fields] = getter
+        return getter(row)
+
+    def obj(self, obj, privileged=True) -> dict[str, Any]:
+        return self._make(self._from_obj(obj), privileged)
+
+    def row(self, row, privileged=True) -> dict[str, Any]:
+        return self._make(self._from_row(row), privileged)
+
+    def rows(self, rows, privileged=True) -> list[dict[str, Any]]:
+        rows = list(rows)
+        if not rows:
+            return []
+        self._from_row(rows[0])
+        make, get = self._make, self._row_getters[rows[0]._fields]
+        return [make(get(row), privileged) for row in rows]
+
+    def _make(self, values, privileged) -> dict[str, Any]:
+        result: dict[str, Any] = dict(zip(self.keys, values))
+        for key in self.enum_keys:
+            val = result[key]
+            if val != None:
+                result[key] = val.name
+        if not privileged and self.public_json != None:
+            allowed = self.public_json
+            result['json_data'] = {k: v for k, v in (result['json_data'] or {}).items() if k in allowed}
+        result['_type'] = self.typename
+        return result
+
+@event.listens_for(Mapper, 'mapper_configured')
+def _make_serializer(mapper, cls):
+    if isinstance(cls, type) and issubclass(cls, PreBase) and hasattr(cls, '__table__'):
+        setattr(cls, '__serializer__', Serializer(cls))
 
 class Base(PreBase, DeclarativeBase):
     metadata = _meta
@@ -79,7 +220,13 @@ def init(app:Flask|None):
     from . import auth_model, model_tables, model_views, model_util
     for cls in model_tables.logged_tables:
         model_util.create_triggers(cls, db_scoped_session)
-        
+    db_scoped_session.commit()  # DDL is transactional on PostgreSQL (and SQLite, see configure_sqlite)
+
+    if engine.dialect.name == 'postgresql':
+        # views depend on each other (full_user on course_user), which drop_all doesn't know
+        with engine.begin() as conn:
+            for mapper in ViewBase.registry.mappers:
+                conn.exec_driver_sql(f'DROP VIEW IF EXISTS "{mapper.class_.__tablename__}" CASCADE')
     _viewmeta.drop_all(engine)
     _viewmeta.create_all(engine)
     if app and app.config.get('PUFFIN_SUPER_USER') and app.config.get('PUFFIN_SUPER_PASSWORD'):
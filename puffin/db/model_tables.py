@@ -3,12 +3,11 @@ import enum
 import json
 from typing import Optional, Type
 from typing_extensions import Annotated
-from sqlalchemy import ForeignKey, ForeignKeyConstraint, UniqueConstraint, inspect, text, JSON
-from sqlalchemy.orm import relationship, Mapped, mapped_column, Session
-from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy import ForeignKey, ForeignKeyConstraint, Index, UniqueConstraint, inspect, text, JSON
+from sqlalchemy.orm import relationship, Mapped, mapped_column, Session, joinedload, selectinload
 from sqlalchemy.ext.mutable import MutableDict
 from datetime import datetime
-from .database import Base
+from .database import Base, dialect_insert
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -69,6 +68,9 @@ class OwnerKind(enum.Enum):
 
 class AuditLog(Base):
     __tablename__ = 'audit_log'
+    __table_args__ = (Index("ix_audit_log_table_name_row_id", "table_name", "row_id"),
+                      Index("ix_audit_log_timestamp", "timestamp"),
+                      )
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
     timestamp: Mapped[datetime] = mapped_column(
         server_default=text('CURRENT_TIMESTAMP'))
@@ -96,7 +98,10 @@ class Id(Base):
 
 class Account(Base):
     __tablename__ = 'account'
-    __table_args__ = (UniqueConstraint("provider_name", "external_id"),)
+    __table_args__ = (UniqueConstraint("provider_name", "external_id"),
+                      Index("ix_account_user_id_provider_name", "user_id", "provider_name"),
+                      Index("ix_account_provider_name_username", "provider_name", "username"),
+                      )
     id: Mapped[int] = mapped_column(
         primary_key=True, autoincrement=False, doc="Internal account id",
         info={'view': {'course_user': False}})
@@ -176,7 +181,9 @@ class Course(Base):
 
 class Group(Base):
     __tablename__ = 'group'
-    __table_args__ = (UniqueConstraint("course_id", "slug"),)
+    __table_args__ = (UniqueConstraint("course_id", "slug"),
+                      Index("ix_group_course_id_kind", "course_id", "kind"),
+                      )
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
     kind: Mapped[str] = \
         mapped_column(info={'form': {'select': 'group_kind'}})
@@ -204,7 +211,9 @@ class Group(Base):
 
 class Membership(Base):
     __tablename__ = 'membership'
-    __table_args__ = (UniqueConstraint("user_id", "group_id"),)
+    __table_args__ = (UniqueConstraint("user_id", "group_id"),
+                      Index("ix_membership_group_id_user_id", "group_id", "user_id"),
+                      )
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
     user_id: Mapped[int] = mapped_column(
         ForeignKey('user.id'), info={'immutable': True,
@@ -225,6 +234,7 @@ class Membership(Base):
 class Enrollment(Base):
     __tablename__ = 'enrollment'
     __table_args__ = (UniqueConstraint("user_id", "course_id"),
+                      Index("ix_enrollment_course_id_user_id", "course_id", "user_id"),
                       ForeignKeyConstraint(['user_id'], ['user.id']),
                       ForeignKeyConstraint(['course_id'], ['course.id'])
                       )
@@ -289,16 +299,60 @@ class User(Base):
     def is_expired(self) -> bool:
         return self.expiry_date != None and self.expiry_date > datetime.now()
 
+    # Loader options for queries that will use the relationship helpers below, e.g.
+    #   select(User).options(*User.load_options('details'))
+    LOAD_PROFILES = {
+        'lazy': [],
+        'accounts': ['accounts'],
+        'enrollments': ['accounts', 'enrollments'],
+        'details': ['accounts', 'enrollments', 'memberships'],
+    }
+
+    @staticmethod
+    def load_options(profile: str = 'details'):
+        relations = User.LOAD_PROFILES[profile]
+        options = []
+        if 'accounts' in relations:
+            options.append(selectinload(User.accounts))
+        if 'enrollments' in relations:
+            options.append(selectinload(User.enrollments).joinedload(Enrollment.course))
+        if 'memberships' in relations:
+            options.append(selectinload(User.memberships).joinedload(Membership.group))
+        return options
+
+    def _index(self, relation: str, key: str, related: str|None = None) -> dict:
+        """Dict of the related objects by attribute `key`, rebuilt when the relationship is (re)loaded or changes size.
+
+        If `key` is a foreign key, give the name of its `related` object too: a pending object, e.g.
+        Enrollment(course=course), only gets its foreign key on flush, so it's indexed by course.id."""
+        items = getattr(self, relation)
+        cached = self.__dict__.get(f'_index_{relation}')
+        if cached == None or cached[0] is not items or cached[1] != len(items):
+            index = {}
+            for item in items:
+                k = getattr(item, key)
+                if k == None and related != None and item.__dict__.get(related) != None:
+                    k = item.__dict__[related].id  # assigned, but not flushed yet
+                index.setdefault(k, item)
+            cached = self.__dict__[f'_index_{relation}'] = (items, len(items), index)
+        return cached[2]
+
     def enrollment(self, course: Course | int | str) -> Enrollment | None:
+        if isinstance(course, Course):
+            return self._index('enrollments', 'course_id', 'course').get(course.id)
+        elif isinstance(course, int):
+            return self._index('enrollments', 'course_id', 'course').get(course)
         for en in self.enrollments:
             if en.course == course or en.course_id == course or en.course.name == course:
                 return en
         return None
 
     def membership(self, course=None, kind=None) -> list[Membership]:
+        if isinstance(course, Course):
+            course = course.id
         ms = []
         for m in self.memberships:
-            if (course == None or m.group.course == course or m.group.course_id == course or m.group.course.name == course) \
+            if (course == None or m.group.course_id == course or (isinstance(course, str) and m.group.course.name == course)) \
                     and (kind == None or m.group.kind == kind) and m.join_model != JoinModel.REMOVED:
                 ms.append(m)
         return ms
@@ -308,16 +362,10 @@ class User(Base):
         """Returns true if user is a member of the group. Group can be a group object or a group_id."""
         if isinstance(group, Group):
             group = group.id
-        for m in self.memberships:
-            if group == m.group_id:
-                return True        
-        return False
+        return group in self._index('memberships', 'group_id', 'group')
     
     def account(self, provider: str) -> Account | None:
-        for acc in self.accounts:
-            if acc.provider_name == provider:
-                return acc
-        return None
+        return self._index('accounts', 'provider_name').get(provider)
 
     @property
     def avatar_url(self) -> str | None:
@@ -449,7 +497,9 @@ class ProjectTestRun(Base):
 
 class LastSync(Base):
     __tablename__ = 'last_sync'
-    __table_args__ = (UniqueConstraint("obj_id", "obj_type"),)
+    __table_args__ = (UniqueConstraint("obj_id", "obj_type"),
+                      Index("ix_last_sync_obj_type_obj_id", "obj_type", "obj_id"),
+                      )
     id: Mapped[int] = mapped_column(primary_key=True)
     obj_id: Mapped[int]
     obj_type: Mapped[_str_30]
@@ -463,8 +513,22 @@ class LastSync(Base):
             data['sync_incoming'] = sync_incoming
         if sync_outgoing:
             data['sync_outgoing'] = sync_outgoing
-        session.execute(insert(LastSync).values(data).on_conflict_do_update(
+        session.execute(dialect_insert(session, LastSync).values(data).on_conflict_do_update(
             index_elements=['obj_id', 'obj_type'], set_=data))
 
+    @staticmethod
+    def set_sync_many(session: Session, objs: list[Base], sync_incoming: datetime|None = None, sync_outgoing: datetime|None = None):
+        """Like set_sync, but for many objects in one statement (none if there are no times to set)."""
+        times = {}
+        if sync_incoming:
+            times['sync_incoming'] = sync_incoming
+        if sync_outgoing:
+            times['sync_outgoing'] = sync_outgoing
+        if len(objs) == 0 or not times:
+            return
+        stmt = dialect_insert(session, LastSync).values([{'obj_id': obj.id, 'obj_type': obj.__tablename__, **times} for obj in objs]) # type: ignore
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=['obj_id', 'obj_type'], set_={k: stmt.excluded[k] for k in times}))
+
 
 logged_tables = Account, Course, User, Enrollment, Membership, Group
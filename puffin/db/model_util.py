@@ -1,16 +1,22 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager
 from datetime import datetime
+import itertools
 import json
 import logging
-from typing import IO, Tuple, Type, TypeVar
+import threading
+import weakref
+from typing import IO, Iterable, Iterator, Tuple, Type, TypeVar
 import regex
 from slugify import slugify
 import sqlalchemy as sa
 from puffin.util.errors import ErrorResponse
 from puffin.db import database
 
+from .audit_archive import audit_log_time
 from .model_views import CourseUser, FullUser, UserAccount
 
-from .model_tables import Account, AssignmentModel, Course, Group, Id, JoinModel, LogType, User, Membership, Enrollment, LastSync, PRIVILEGED_ROLES
+from .model_tables import Account, AssignmentModel, AuditLog, Course, Group, Id, JoinModel, LogType, User, Membership, Enrollment, LastSync, PRIVILEGED_ROLES
 logger = logging.getLogger(__name__)
 
 roles = {
@@ -24,12 +30,29 @@ roles = {
 
 
 def create_triggers(cls, session: sa.orm.Session = None):
+    """Create triggers that record all changes to cls's table in the audit log.
+
+    With a session, the triggers for the session's database are created right away; otherwise
+    they are created along with the table (for SQLite or PostgreSQL, whichever it is)."""
+    if session == None:
+        for ddl in _sqlite_triggers(cls):
+            sa.event.listen(cls.__table__, "after_create", ddl.execute_if(dialect='sqlite'))
+        seq = _postgresql_audit_sequence().execute_if(dialect='postgresql')
+        sa.event.listen(AuditLog.__table__, "after_create", seq)
+        for ddl in _postgresql_triggers(cls):
+            sa.event.listen(cls.__table__, "after_create", ddl.execute_if(dialect='postgresql'))
+    elif session.get_bind().dialect.name == 'postgresql':
+        session.execute(_postgresql_audit_sequence())
+        for ddl in _postgresql_triggers(cls):
+            session.execute(ddl)
+    else:
+        for ddl in _sqlite_triggers(cls):
+            session.execute(ddl)
+
+
+def _sqlite_triggers(cls) -> list[sa.DDL]:
     def quote(s):
         return "'" + s + "'"
-    # PGSql
-    old_data = 'to_jsonb(OLD)'
-    new_data = 'to_jsonb(NEW)'
-    # SQLite
     old_data = f' json_object({",".join([f"{quote(col.name)}, OLD.{col.name}" for col in cls.__table__.columns])})'
     new_data = f' json_object({",".join([f"{quote(col.name)}, NEW.{col.name}" for col in cls.__table__.columns])})'
 
@@ -48,24 +71,174 @@ def create_triggers(cls, session: sa.orm.Session = None):
         + '  INSERT INTO audit_log (timestamp, table_name, row_id, type, old_data, new_data) '
         + f'  VALUES (CURRENT_TIMESTAMP, "{cls.__tablename__}", OLD.id, "DELETE", {old_data}, NULL);'
         + 'END;')
-    if session == None:
-        sa.event.listen(cls.__table__, "after_create", trig1)
-        sa.event.listen(cls.__table__, "after_create", trig2)
-        sa.event.listen(cls.__table__, "after_create", trig3)
-    else:
-        session.execute(trig1)
-        session.execute(trig2)
-        session.execute(trig3)
+    return [trig1, trig2, trig3]
+
+
+def _postgresql_audit_sequence() -> sa.DDL:
+    # audit_log.id has no default (SQLite uses the rowid), so the log function takes ids from
+    # a sequence, which starts after any existing (e.g. imported) entries
+    return sa.DDL(
+        'CREATE SEQUENCE IF NOT EXISTS audit_log_id_seq OWNED BY audit_log.id;\n'
+        + "SELECT setval('audit_log_id_seq', GREATEST((SELECT max(id) FROM audit_log), "
+        + "(SELECT last_value FROM audit_log_id_seq)));")
+
+
+def _postgresql_triggers(cls) -> list[sa.DDL]:
+    func = sa.DDL(
+        'CREATE OR REPLACE FUNCTION log_audit() RETURNS trigger AS $$\n'
+        + 'BEGIN\n'
+        + "  IF TG_OP = 'DELETE' THEN\n"
+        + '    INSERT INTO audit_log (id, timestamp, table_name, row_id, type, old_data, new_data)\n'
+        + "    VALUES (nextval('audit_log_id_seq'), CURRENT_TIMESTAMP, TG_TABLE_NAME, OLD.id, 'DELETE', to_jsonb(OLD)::json, NULL);\n"
+        + "  ELSIF TG_OP = 'UPDATE' THEN\n"
+        + '    INSERT INTO audit_log (id, timestamp, table_name, row_id, type, old_data, new_data)\n'
+        + "    VALUES (nextval('audit_log_id_seq'), CURRENT_TIMESTAMP, TG_TABLE_NAME, NEW.id, 'UPDATE', to_jsonb(OLD)::json, to_jsonb(NEW)::json);\n"
+        + '  ELSE\n'
+        + '    INSERT INTO audit_log (id, timestamp, table_name, row_id, type, old_data, new_data)\n'
+        + "    VALUES (nextval('audit_log_id_seq'), CURRENT_TIMESTAMP, TG_TABLE_NAME, NEW.id, 'INSERT', NULL, to_jsonb(NEW)::json);\n"
+        + '  END IF;\n'
+        + '  RETURN NULL;\n'
+        + 'END;\n'
+        + '$$ LANGUAGE plpgsql;')
+    trig = sa.DDL(
+        f'CREATE OR REPLACE TRIGGER log_{cls.__tablename__} AFTER INSERT OR UPDATE OR DELETE ON "{cls.__tablename__}"\n'
+        + '  FOR EACH ROW EXECUTE FUNCTION log_audit();')
+    return [func, trig]
 
 
 T = TypeVar('T', covariant=True)
 
 
+class IdAllocator:
+    """Hands out new object ids from blocks reserved in the `id` table.
+
+    A block is reserved with a single multi-row INSERT, so every id still has a row
+    recording its type. Ids reserved in a transaction are only shared with the rest of
+    the process once the transaction commits; if it rolls back, they are discarded
+    (the rows are gone, so another process may get the same ids). Unused ids are kept
+    per engine, since they are only reserved in that engine's database."""
+
+    def __init__(self, block_size: int = 50):
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        # committed, unused ids by engine and type
+        self.pools: weakref.WeakKeyDictionary[sa.Engine, defaultdict[str, deque[int]]] = weakref.WeakKeyDictionary()
+        # ids reserved in a session's current transaction, by (engine, type)
+        self.info_key = f'reserved_ids_{id(self)}'
+        for event, listener in self._listeners():
+            sa.event.listen(sa.orm.Session, event, listener)
+
+    def _listeners(self):
+        return [('after_commit', self.after_commit), ('after_soft_rollback', self.after_rollback),
+                ('after_transaction_end', self.after_transaction_end)]
+
+    def close(self):
+        """Stop following session events (the allocator can't be used after this)."""
+        for event, listener in self._listeners():
+            sa.event.remove(sa.orm.Session, event, listener)
+
+    def allocate(self, session: sa.orm.Session, cls, n: int = 1) -> list[int]:
+        type = getattr(cls, '__tablename__')
+        engine = session.get_bind(Id).engine
+        result = []
+        with self.lock:
+            pool = self.pools.get(engine, {}).get(type)
+            while pool and len(result) < n:
+                result.append(pool.popleft())
+        pending = session.info.setdefault(self.info_key, defaultdict(deque))[(engine, type)]
+        while pending and len(result) < n:
+            result.append(pending.popleft())
+        if len(result) < n:
+            count = max(n - len(result), self.block_size)
+            ids = session.execute(sa.insert(Id).returning(Id.id), [{'type': type}] * count).scalars().all()
+            needed = n - len(result)
+            result.extend(ids[:needed])
+            pending.extend(ids[needed:])
+        return result
+
+    def after_commit(self, session: sa.orm.Session):
+        reserved = session.info.pop(self.info_key, None)
+        if reserved:
+            with self.lock:
+                for (engine, type), ids in reserved.items():
+                    self.pools.setdefault(engine, defaultdict(deque))[type].extend(ids)
+
+    def after_rollback(self, session: sa.orm.Session, previous_transaction):
+        # also on savepoint rollback, since we don't know which savepoint reserved which ids
+        session.info.pop(self.info_key, None)
+
+    def after_transaction_end(self, session: sa.orm.Session, transaction):
+        # e.g. session.close() without commit
+        if transaction.parent == None:
+            session.info.pop(self.info_key, None)
+
+
+# keep the allocator (and its event listeners) when the module is reloaded
+id_allocator: IdAllocator = globals().get("id_allocator") or IdAllocator()
+
+
 def new_id(session: sa.orm.Session, cls: Type[T]) -> int:
-    with session.begin_nested() as ss:
-        id = Id(type=getattr(cls,'__tablename__'))
-        session.add(id)
-    return id.id
+    return id_allocator.allocate(session, cls)[0]
+
+
+def new_ids(session: sa.orm.Session, cls: Type[T], n: int) -> list[int]:
+    return id_allocator.allocate(session, cls, n)
+
+
+class SyncBatch:
+    """A unit of work for sync loops, see sync_batch()."""
+
+    def __init__(self, session: sa.orm.Session, flush_every: int):
+        self.session = session
+        self.flush_every = flush_every
+        self.commits = 0  # commits that were skipped
+
+    def commit(self):
+        self.commits += 1
+        if self.commits % self.flush_every == 0:
+            self.session.flush()
+
+
+@contextmanager
+def sync_batch(session: sa.orm.Session, flush_every: int = 100) -> Iterator[SyncBatch]:
+    """Run a sync loop as one transaction: `with sync_batch(db): ...`
+
+    Inside the batch, the commits in update_from_uib, define_gitlab_account, update_sections_from_uib,
+    check_group_membership, find_gitlab_account etc. are skipped (see sync_commit()). Changes are
+    flushed every `flush_every` skipped commits and before queries (autoflush is turned on), and
+    committed once at the end – or rolled back if an exception escapes. A nested sync_batch()
+    joins the outer one."""
+    if isinstance(session, sa.orm.scoped_session):
+        session = session()
+    batch = session.info.get('sync_batch')
+    if batch != None:
+        yield batch
+        return
+    database.begin_write(session)
+    batch = session.info['sync_batch'] = SyncBatch(session, flush_every)
+    autoflush = session.autoflush
+    session.autoflush = True
+    try:
+        yield batch
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.autoflush = autoflush
+        del session.info['sync_batch']
+
+
+def sync_commit(session: sa.orm.Session) -> bool:
+    """Commit, unless we're in a sync_batch(). Returns True if committed."""
+    if isinstance(session, sa.orm.scoped_session):
+        session = session()
+    batch = session.info.get('sync_batch')
+    if batch != None:
+        batch.commit()
+        return False
+    session.commit()
+    return True
 
 
 def get_or_define(session: sa.orm.Session, cls: Type[T], filter: dict, default: dict = {}, add_new=True) -> Tuple[T, bool]:
@@ -134,10 +307,114 @@ def update_from_uib(session: sa.orm.Session, row, course, changes=None, sync_tim
     if changes != None:
         for obj in session.dirty:
             changes.append((obj.__tablename__, obj.id))
-    session.commit()
+    sync_commit(session)
     return uib_user
 
 
+def update_from_uib_bulk(session: sa.orm.Session, rows: Iterable[dict], course, changes=None, sync_time: datetime|None = None, batch_size=500, skipped: list[dict]|None = None) -> list[Account]:
+    """Like update_from_uib, but for many users at once.
+
+    Existing users, accounts and enrollments are loaded with a few queries per batch of rows,
+    changes are written when each batch is flushed, and everything is committed once at the end.
+    Returns the Mitt UiB accounts, in the same order as the rows. Rows without a login_id are
+    logged and skipped (and added to `skipped`, if given)."""
+    enrollments: dict[int, Enrollment] = {}
+    if course != None:
+        enrollments = {en.user_id: en for en in session.execute(
+            sa.select(Enrollment).where(Enrollment.course_id == course.id)).scalars()}
+    result: list[Account] = []
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, batch_size)):
+        result.extend(_update_from_uib_batch(session, batch, course, enrollments, changes, sync_time, skipped))
+
+    ids = [acc.id for acc in result]
+    if sync_commit(session):
+        # reload the (expired) accounts with one query per batch, rather than one per account
+        for i in range(0, len(ids), batch_size):
+            session.execute(sa.select(Account).where(Account.id.in_(ids[i:i+batch_size]))).scalars().all()
+    return result
+
+
+def _update_from_uib_batch(session: sa.orm.Session, rows: list[dict], course, enrollments: dict[int, Enrollment], changes, sync_time: datetime|None, skipped: list[dict]|None) -> list[Account]:
+    missing = [row for row in rows if not row.get('login_id')]
+    if missing:
+        # without a login name we can't tell which account is theirs
+        for row in missing:
+            logger.error('Missing login_id: %s', row)
+        if skipped != None:
+            skipped.extend(missing)
+        rows = [row for row in rows if row.get('login_id')]
+    users = {u.key: u for u in session.execute(
+        sa.select(User).where(User.key.in_([f'canvas#{row["id"]}' for row in rows]))).scalars()}
+    uib_users = {a.username: a for a in session.execute(
+        sa.select(Account).where(Account.provider_name == 'canvas',
+                                 Account.username.in_([row['login_id'] for row in rows]))).scalars()}
+    git_names = [row['gituser'] for row in rows if row.get('gituser') and row.get('gitid')]
+    git_users = {a.username: a for a in session.execute(
+        sa.select(Account).where(Account.provider_name == 'gitlab',
+                                 Account.username.in_(git_names))).scalars()} if git_names else {}
+
+    # new_id() flushes, so session.dirty can't be used to find the changed objects
+    changed = {}
+    def change(obj, attr, value):
+        if getattr(obj, attr) != value:
+            setattr(obj, attr, value)
+            changed[(obj.__tablename__, obj.id)] = True
+
+    result = []
+    for row in rows:
+        name = row['sortable_name']
+        (lastname, firstname) = [s.strip() for s in name.split(',', 1)]
+
+        key = f'canvas#{row["id"]}'
+        user = users.get(key)
+        if user == None:
+            user = users[key] = User(id=new_id(session, User), key=key,
+                                     firstname=firstname, lastname=lastname, email=row['email'])
+            session.add(user)
+
+        uib_user = uib_users.get(row['login_id'])
+        if uib_user == None:
+            uib_user = uib_users[row['login_id']] = Account(
+                id=new_id(session, Account), username=row['login_id'], provider_name='canvas',
+                external_id=int(row['id']), user=user, email=row['email'], fullname=name)
+            session.add(uib_user)
+        # name changed?
+        if uib_user.fullname != name:
+            change(user, 'firstname', firstname)
+            change(user, 'lastname', lastname)
+            change(uib_user, 'fullname', name)
+        # update data
+        locale = row.get('locale') or row.get('effective_locale') or None
+        if uib_user.email != row['email']:
+            change(user, 'email', row['email'])
+            change(uib_user, 'email', row['email'])
+        change(uib_user, 'avatar_url', row['avatar_url'])
+        change(user, 'locale', locale)
+        if course != None:
+            role = row['role']
+            enrollment = enrollments.get(user.id)
+            if enrollment == None:
+                enrollment = enrollments[user.id] = Enrollment(
+                    id=new_id(session, Enrollment), course=course, user=user, role=role)
+                session.add(enrollment)
+            change(enrollment, 'role', role)
+
+        if row.get('gituser') and row.get('gitid') and row['gituser'] not in git_users:
+            git_users[row['gituser']] = Account(
+                id=new_id(session, Account), username=row['gituser'], provider_name='gitlab',
+                user_id=user.id, external_id=int(row['gitid']), fullname=name)
+            session.add(git_users[row['gituser']])
+        result.append(uib_user)
+
+    if changes != None:
+        changes.extend(changed.keys())
+    session.flush()
+    if sync_time:
+        LastSync.set_sync_many(session, result, sync_time)
+    return result
+
+
 def define_gitlab_account(session: sa.orm.Session, user: User, username: str, userid: int, name=None, changes=None, sync_time: datetime|None = None):
     if not name:
         name = f'{user.firstname} {user.lastname}'
@@ -148,7 +425,7 @@ def define_gitlab_account(session: sa.orm.Session, user: User, username: str, us
     if changes != None:
         for obj in session.dirty:
             changes.append((obj.__tablename__, obj.id))
-    session.commit()
+    sync_commit(session)
 
     sa.select(Account).join
     return git_user
@@ -207,7 +484,7 @@ def update_sections_from_uib(session: sa.orm.Session, data, course, changes=None
     if changes != None:
         for obj in session.dirty:
             changes.append((obj.__tablename__, obj.id))
-    session.commit()
+    sync_commit(session)
 
 
 def check_group_membership(db: sa.orm.Session, course: Course, group: Group, user: User, changes=None, students_only=True, join=None, sync_time: datetime|None = None):
@@ -231,13 +508,52 @@ def check_group_membership(db: sa.orm.Session, course: Course, group: Group, use
             if changes != None:
                 for obj in db.dirty:
                     changes.append((obj.__tablename__, obj.id))
-            db.commit()
+            sync_commit(db)
             logger.info(
                 f'check_group_membership(%s): add or update membership: %s', group.slug, membership)
     else:
         logger.info(f'check_group_membership(%s): user %s not enrolled in course %s',
                     group.slug, user.lastname, course)
 
+COURSE_AUDIT_TABLES = ['course', 'enrollment', 'group', 'membership']
+
+
+def course_audit_log(session: sa.orm.Session, course: Course, since: int | None = None, after: datetime | None = None,
+                     tables: Iterable[str] = COURSE_AUDIT_TABLES, limit: int | None = 1000) -> list[AuditLog]:
+    """Audit log entries for the course and its enrollments, groups and memberships, oldest first.
+
+    Only entries with id > `since` and/or timestamp > `after` (naive means UTC) are included, so a
+    client can pass the id of the last entry it has seen to get the next batch. All filtering is done
+    by the database, starting from the primary key (or timestamp) index. Deleted rows are matched by
+    their old data."""
+    course_groups = sa.select(Group.id).where(Group.course_id == course.id)
+
+    def course_rows(cls, *where):
+        return AuditLog.row_id.in_(sa.select(cls.id).where(*where))
+
+    def deleted(key, value):
+        return sa.and_(AuditLog.type == LogType.DELETE, AuditLog.old_data[key].as_integer() == value)
+
+    conditions = {
+        'course': AuditLog.row_id == course.id,
+        'enrollment': sa.or_(course_rows(Enrollment, Enrollment.course_id == course.id),
+                             deleted('course_id', course.id)),
+        'group': sa.or_(course_rows(Group, Group.course_id == course.id),
+                        deleted('course_id', course.id)),
+        'membership': sa.or_(course_rows(Membership, Membership.group_id.in_(course_groups)),
+                             sa.and_(AuditLog.type == LogType.DELETE,
+                                     AuditLog.old_data['group_id'].as_integer().in_(course_groups))),
+    }
+    # sa.false() keeps the WHERE clause if no known tables are given (an empty or_() is dropped)
+    stmt = sa.select(AuditLog).where(
+        sa.or_(sa.false(), *[sa.and_(AuditLog.table_name == t, conditions[t]) for t in tables if t in conditions]))
+    if since != None:
+        stmt = stmt.where(AuditLog.id > since)
+    if after != None:
+        stmt = stmt.where(AuditLog.timestamp > audit_log_time(session, after))
+    return list(session.execute(stmt.order_by(AuditLog.id).limit(limit)).scalars())
+
+
 def check_unique(db: sa.orm.Session, cls : Type[database.Base], message:str, *clauses: tuple[str,sa.ColumnExpressionArgument]):
     not_unique = []
     for (field, column_expr) in clauses:
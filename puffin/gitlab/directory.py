@@ -0,0 +1,188 @@
+from datetime import datetime, timezone
+from typing import Any, Iterable, NamedTuple
+from gitlab import Gitlab
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DirectoryUser(NamedTuple):
+    """The parts of a GitLab user that we keep in the directory. Has the same attributes
+    as the corresponding gitlab.v4.objects.User."""
+
+    id: int
+    username: str
+    name: str
+    state: str
+
+    def get_id(self) -> int:
+        return self.id
+
+    @staticmethod
+    def from_gitlab(user) -> "DirectoryUser":
+        return DirectoryUser(user.id, user.username, user.name, user.state)
+
+
+class UserDirectory:
+    """All GitLab users (id, username, name, state), shared by all GitLab connections in the process.
+
+    The whole directory is reloaded after `ttl` seconds (this is the only way to notice deleted users);
+    in between, it's refreshed after `refresh_interval` seconds with only the users updated since the
+    last refresh (`updated_after`, needs an admin token). If `path` is set, the directory is also saved
+    to that JSON file, so other worker processes (and restarts) can use it."""
+
+    # overlap between incremental refreshes, in case of clock skew
+    REFRESH_MARGIN = 300
+
+    def __init__(self, ttl: float = 7 * 24 * 3600, refresh_interval: float = 600, path: str | None = None):
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.path = path
+        self.lock = threading.Lock()  # held briefly, while reading or changing the data
+        self.refresh_lock = threading.Lock()  # held while fetching users from GitLab
+        self.users: dict[int, DirectoryUser] = {}
+        self.by_username: dict[str, DirectoryUser] = {}  # lower case username → user
+        self.loaded_at = 0.0  # time of last full load
+        self.refreshed_at = 0.0  # time of last (full or incremental) refresh
+        self.file_mtime = None
+
+    def configure(self, ttl: float | None = None, refresh_interval: float | None = None, path: str | None = None):
+        with self.lock:
+            if ttl != None:
+                self.ttl = ttl
+            if refresh_interval != None:
+                self.refresh_interval = refresh_interval
+            if path != None and path != self.path:
+                self.path = path
+                self.file_mtime = None
+
+    def is_loaded(self) -> bool:
+        """True if the directory has been fully loaded within the last `ttl` seconds."""
+        with self.lock:
+            self._read_file()
+            return time.time() - self.loaded_at <= self.ttl
+
+    def refresh(self, gl: Gitlab, full: bool = False) -> int:
+        """Load all users if the directory has expired (or `full` is true), otherwise fetch the users
+        updated since the last refresh, if that's more than `refresh_interval` seconds ago.
+
+        The users are fetched without holding the directory lock, so lookups meanwhile use the old
+        data; if another thread is already refreshing, this returns right away.
+        Returns the number of users fetched."""
+        if not self.refresh_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self.lock:
+                self._read_file()
+                now = time.time()
+                load = full or now - self.loaded_at > self.ttl
+                if not load and now - self.refreshed_at <= self.refresh_interval:
+                    return 0
+                since = datetime.fromtimestamp(self.refreshed_at - self.REFRESH_MARGIN, timezone.utc)
+            if load:
+                logger.info("Loading GitLab user directory")
+                users = [DirectoryUser.from_gitlab(u) for u in gl.users.list(iterator=True, per_page=100)]
+                by_id = {u.id: u for u in users}
+                by_username = {u.username.lower(): u for u in users}
+                with self.lock:
+                    self.users, self.by_username = by_id, by_username
+                    self.loaded_at = now
+            else:
+                users = [DirectoryUser.from_gitlab(u) for u in
+                         gl.users.list(iterator=True, per_page=100, updated_after=since.isoformat())]
+                with self.lock:
+                    self._update(users)
+            with self.lock:
+                self.refreshed_at = now
+                data = self._file_data()
+                total = len(self.users)
+            self._write_file(data)
+            logger.info("GitLab user directory: %d users fetched, %d total", len(users), total)
+            return len(users)
+        finally:
+            self.refresh_lock.release()
+
+    def get(self, user_id: int) -> DirectoryUser | None:
+        with self.lock:
+            self._read_file()
+            return self.users.get(user_id)
+
+    def find_username(self, username: str) -> list[DirectoryUser]:
+        """Users with the given username (like gl.users.list(username=...), ignoring case)."""
+        with self.lock:
+            self._read_file()
+            user = self.by_username.get(username.lower())
+            return [user] if user else []
+
+    def put(self, users: Iterable[Any]):
+        """Add or update users, e.g. from a member list we've fetched anyway."""
+        with self.lock:
+            self._read_file()
+            self._update([DirectoryUser.from_gitlab(u) for u in users])
+
+    def clear(self):
+        with self.lock:
+            self.users.clear()
+            self.by_username.clear()
+            self.loaded_at = self.refreshed_at = 0.0
+            self._write_file(self._file_data())
+
+    def _update(self, users: list[DirectoryUser]):
+        for u in users:
+            old = self.users.get(u.id)
+            if old != None and self.by_username.get(old.username.lower()) is old:
+                del self.by_username[old.username.lower()]  # renamed
+            self.users[u.id] = u
+            self.by_username[u.username.lower()] = u
+
+    def _reindex(self):
+        self.by_username = {u.username.lower(): u for u in self.users.values()}
+
+    def _read_file(self):
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self.file_mtime:
+                return
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("refreshed_at", 0) > self.refreshed_at:
+                self.users = {u[0]: DirectoryUser(*u) for u in data.get("users", [])}
+                self.loaded_at = data.get("loaded_at", 0)
+                self.refreshed_at = data.get("refreshed_at", 0)
+                self._reindex()
+            self.file_mtime = mtime
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Failed to read GitLab user directory %s: %s", self.path, e)
+
+    def _file_data(self) -> dict[str, Any] | None:
+        if not self.path:
+            return None
+        return {
+            "loaded_at": self.loaded_at,
+            "refreshed_at": self.refreshed_at,
+            "users": [list(u) for u in self.users.values()],
+        }
+
+    def _write_file(self, data: dict[str, Any] | None):
+        if not self.path or data == None:
+            return
+        try:
+            tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+            self.file_mtime = os.stat(self.path).st_mtime
+        except Exception as e:
+            logger.warning("Failed to write GitLab user directory %s: %s", self.path, e)
+
+
+# keep the directory when the module is reloaded
+user_directory: UserDirectory = globals().get("user_directory") or UserDirectory()
@@ -67,8 +67,9 @@ DEFAULT_PROJECT_CONFIG = {
 
 class AssignmentFork:
     def __init__(self, assignment: Project | str | int, test_project: Project | str | None = None, gitlab_config: dict|None = None, access_level: int = DEFAULT_ACCESS_LEVEL, gitlab: gitlab.Gitlab | None = None, gitlab_token=TOKEN):
+        # python-gitlab waits out 429s (obey_rate_limit) and retries transient errors, so we don't pause between requests
         self.gl = Gitlab(url='https://git.app.uib.no/',
-                         private_token=gitlab_token) if gitlab == None else gitlab
+                         private_token=gitlab_token, retry_transient_errors=True) if gitlab == None else gitlab
         if self.gl.user == None and TOKEN != None and not TOKEN.isspace():
             self.gl.auth()
         self.assignment = self.get_project(assignment)
@@ -216,7 +217,6 @@ class AssignmentFork:
                 mr = self.assignment.mergerequests.create(req)
                 self.__change('merge_request',proj, source=self.assignment, result=mr.web_url)
                 print(mr.references['full'], '– created:', mr.web_url)
-                time.sleep(2)
             return proj
         except gitlab.GitlabError as e:
             if proj and e.response_code == 409:
@@ -337,7 +337,7 @@ class AssignmentFork:
                     'visibility': config['visibility'],
                     'description': f'{desc}{self.assignment.name} for {user.name}\n\n*Clone →* `git clone {url} {self.assignment.path}`'
                 })
-                time.sleep(1)
+                time.sleep(1)  # not throttling: GitLab creates the fork in the background
             if self.commit:
                 self._last_project = project = self.gl.projects.get(self._last_fork.id)
             else:
@@ -428,10 +428,6 @@ if __name__ == '__main__':
                             else:
                                 proj = assignment.check_user_project(int(row['gitid']), details, row.get('gitoverride'))
                             projects.append((row.get('gitoverride') or row['gituser'], proj))
-                            if details:
-                                time.sleep(1)
-                            else:
-                                time.sleep(0.01)
                     n = n + 1
                 with open('project-links.txt', 'w') as f:
                     for u,p in projects:
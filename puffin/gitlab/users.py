@@ -1,7 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Iterable
 from flask import Flask, current_app
-from gitlab import Gitlab, GitlabGetError
+from gitlab import Gitlab, GitlabError, GitlabGetError
 from gitlab.v4.objects import (
     Project,
     User as GitlabUser,
@@ -11,7 +12,8 @@ from gitlab.v4.objects import (
 )
 import sqlalchemy as sa
 from puffin.db.model_tables import LastSync, User as PuffinUser, Account
-from puffin.db.model_util import define_gitlab_account
+from puffin.db.model_util import define_gitlab_account, sync_batch, sync_commit
+from .directory import DirectoryUser, UserDirectory, user_directory
 import logging
 import threading
 import re
@@ -32,6 +34,15 @@ class GitlabConnection:
         if app:
             base_url = base_url or app.config.get("GITLAB_BASE_URL")
             token = token or app.config.get("GITLAB_SECRET_TOKEN")
+        # concurrent GitLab requests in bulk operations such as find_gitlab_accounts()
+        self.max_workers = app.config.get("GITLAB_MAX_WORKERS", 8) if app else 8
+        # local copy of the GitLab user list, for username searches and account verification
+        self.directory: UserDirectory | None = None
+        if app and app.config.get("GITLAB_USER_DIRECTORY"):
+            user_directory.configure(app.config.get("GITLAB_USER_DIRECTORY_TTL"),
+                                     app.config.get("GITLAB_USER_DIRECTORY_REFRESH"),
+                                     app.config.get("GITLAB_USER_DIRECTORY_PATH"))
+            self.directory = user_directory
         self.base_url = base_url or ''
         self.token = token
         self.thread_local = threading.local()
@@ -58,30 +69,57 @@ class GitlabConnection:
         project: Project | GitlabGroup | str | int,
         indirect=True,
     ) -> tuple[list[PuffinUser], list[str]]:
+        return self.projects_members_incl_unmapped(session, [project], indirect)[0]
+
+    def projects_members_incl_unmapped(
+        self,
+        session: sa.orm.Session,
+        projects: Iterable[Project | GitlabGroup | str | int],
+        indirect=True,
+    ) -> list[tuple[list[PuffinUser], list[str]]]:
+        """(mapped members, unmapped usernames) for each project, in the same order.
+
+        Member lists are fetched concurrently, and all members are mapped to Puffin users with
+        a single query. Bot users are left out of the unmapped usernames."""
+        projects = list(projects)
+        if len(projects) > 1:
+            with ThreadPoolExecutor(min(self.max_workers, len(projects))) as pool:
+                member_lists = list(pool.map(lambda p: self.list_members(p, indirect, bots=True), projects))
+        else:
+            member_lists = [self.list_members(p, indirect, bots=True) for p in projects]
+        users = self.map_gitlab_users(session, {u.id for members in member_lists for u in members})
+        return [
+            ([users[u.id] for u in members if u.id in users],
+             [u.username for u in members if u.id not in users and not bot_user_re.match(u.username)])
+            for members in member_lists
+        ]
+
+    def list_members(self, project: Project | GitlabGroup | str | int, indirect=True, bots=False) -> list[GitlabUser]:
+        """Members of a project or group (except bot users, unless `bots` is set)."""
         p = self.get_project_or_group(project)
         ml = p.members_all if indirect else p.members
-        members: Iterable[GitlabUser] = ml.list(iterator=True) # type:ignore
-        result = [(self.map_gitlab_user(session, u), u) for u in members]
-        return (
-            [pu for (pu, gu) in result if pu],
-            [gu.username for (pu, gu) in result if not pu and not bot_user_re.match(gu.username)],
-        )
-
-    def map_gitlab_user(self, session: sa.orm.Session, user: GitlabUser) -> PuffinUser:
-        puffin_user = session.execute(
-            sa.select(PuffinUser).where(
+        members: list[GitlabUser] = ml.list(get_all=True) # type:ignore
+        if self.directory:
+            self.directory.put(members)
+        return [u for u in members if bots or not bot_user_re.match(u.username)]
+
+    def map_gitlab_users(self, session: sa.orm.Session, user_ids: Iterable[int]) -> dict[int, PuffinUser]:
+        """Puffin users by GitLab user id (users without a GitLab account are left out)."""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        rows = session.execute(
+            sa.select(Account.external_id, PuffinUser).where(
                 Account.user_id == PuffinUser.id,
                 Account.provider_name == "gitlab",
-                Account.external_id == user.get_id(),
-            )
-        ).scalar_one_or_none()
-        print(
-            "Trying to map gitlab user:",
-            user.username,
-            "→",
-            puffin_user.lastname if puffin_user else None,
-        )
-        return puffin_user
+                Account.external_id.in_(user_ids),
+            ).order_by(Account.id)
+        ).all()
+        logger.debug("Mapped %d of %d GitLab users", len(rows), len(user_ids))
+        return {external_id: user for (external_id, user) in rows}
+
+    def map_gitlab_user(self, session: sa.orm.Session, user: GitlabUser) -> PuffinUser | None:
+        return self.map_gitlab_users(session, [user.get_id()]).get(user.get_id()) # type:ignore
 
     def get_project_or_group(
         self, name_or_id: Project | GitlabGroup | str | int
@@ -121,7 +159,72 @@ class GitlabConnection:
         sync_time: datetime = None, # type:ignore
         gitusername: str = None, # type:ignore
     ) -> Account:
-        name = f"{user.lastname}, {user.firstname}"
+        self.refresh_directory()
+        acc = user.account("gitlab")
+        if acc == None:
+            found = {}
+            for username in self.username_candidates(user, gitusername):
+                found[username] = self.list_users(username)
+                logger.debug("Searching with username=%s: %s", username, found[username])
+                if len(found[username]) == 1:
+                    break
+            acc = self._define_found_account(session, user, found, sync_time)
+        elif verify:
+            acc = self._update_verified_account(session, user, acc, self.get_gitlab_user(acc.external_id), sync_time)  # type:ignore
+        return acc  # type:ignore
+
+    def find_gitlab_accounts(
+        self,
+        session: sa.orm.Session,
+        users: Iterable[PuffinUser],
+        verify=True,
+        sync_time: datetime = None, # type:ignore
+        max_workers: int | None = None,
+    ) -> dict[int, Account | None]:
+        """find_gitlab_account() for many users, by user id.
+
+        The GitLab lookups run on a pool of `max_workers` threads (each with its own Gitlab
+        client). Usernames are tried in rounds – the first guess for every user, then the next
+        guess for those still not found, and so on – and a username that is a guess for several
+        users is only looked up once. The database is updated afterwards, in one sync_batch()."""
+        self.refresh_directory()
+        users = list(users)
+        candidates: dict[int, list[str]] = {}  # usernames to try, for users without an account
+        to_verify: dict[int, Account] = {}
+        for user in users:
+            acc = user.account("gitlab")
+            if acc == None:
+                candidates[user.id] = self.username_candidates(user)
+            elif verify:
+                to_verify[user.id] = acc
+
+        found: dict[str, list[GitlabUser | DirectoryUser]] = {}
+        with ThreadPoolExecutor(max_workers or self.max_workers) as pool:
+            verified = pool.map(self.get_gitlab_user, [acc.external_id for acc in to_verify.values()])
+            for i in range(max([len(names) for names in candidates.values()], default=0)):
+                todo = list({names[i] for names in candidates.values()
+                             if len(names) > i and names[i] not in found
+                             and not any(len(found[n]) == 1 for n in names[:i])})
+                logger.info("find_gitlab_accounts: looking up %d usernames", len(todo))
+                found.update(zip(todo, pool.map(self.list_users, todo)))
+            verified = dict(zip(to_verify.keys(), verified))
+
+        result = {}
+        with sync_batch(session):
+            for user in users:
+                if user.id in candidates:
+                    tried = {n: found[n] for n in candidates[user.id] if n in found}
+                    result[user.id] = self._define_found_account(session, user, tried, sync_time)
+                elif user.id in to_verify:
+                    result[user.id] = self._update_verified_account(
+                        session, user, to_verify[user.id], verified[user.id], sync_time)
+                else:
+                    result[user.id] = user.account("gitlab")
+        return result
+
+    @staticmethod
+    def username_candidates(user: PuffinUser, gitusername: str | None = None) -> list[str]:
+        """Likely GitLab usernames for a user, best guess first."""
         def fold_chars(s):
             # æ can be either a or e :(
             s = s.replace('æ','a').replace('Å','A')
@@ -130,81 +233,102 @@ class GitlabConnection:
             return s
 
         (first_firstname, *more_firstnames) = fold_chars(user.firstname).split()
-        acc = user.account("gitlab")
-        gituser: GitlabUser = None # type:ignore
-        if acc == None:
-            username = gitusername or user.email.replace("@uib.no", "").replace(
-                "@student.uib.no", ""
-            )
-            users = self.gl.users.list(username=username)
-            logger.debug("Searching with username=%s: %s", username, users)
-            if len(users) == 1:
-                gituser = users[0] # type:ignore
-            else:
-                username = user.account("canvas").username # type:ignore
-                logger.debug("Searching with username=%s: %s", username, users)
-                more_users = self.gl.users.list(username=username)
-                if len(more_users) == 1:
-                    gituser = more_users[0] # type:ignore
-                else:
-                    username = f"{first_firstname}.{fold_chars(user.lastname)}"
-                    logger.debug("Searching with username=%s: %s", username, users)
-                    more_users = self.gl.users.list(username=username)
-                    if len(more_users) == 1:
-                        gituser = more_users[0]  # type:ignore
+        result = [gitusername or user.email.replace("@uib.no", "").replace("@student.uib.no", "")]
+        canvas_account = user.account("canvas")
+        if canvas_account:
+            result.append(canvas_account.username)
+        result.append(f"{first_firstname}.{fold_chars(user.lastname)}")
+        return result
+
+    def refresh_directory(self, full=False):
+        """Bring the user directory (if enabled) up to date; see UserDirectory.refresh()."""
+        if self.directory:
+            try:
+                self.directory.refresh(self.gl, full)
+            except GitlabError as e:
+                logger.warning("Failed to refresh GitLab user directory: %s", e)
+
+    def list_users(self, username: str) -> list[GitlabUser | DirectoryUser]:
+        if self.directory and self.directory.is_loaded():
+            return self.directory.find_username(username)  # type:ignore
+        return self.gl.users.list(username=username)  # type:ignore
 
+    def get_gitlab_user(self, user_id: int) -> GitlabUser | DirectoryUser | None:
+        if self.directory and self.directory.is_loaded():
+            gituser = self.directory.get(user_id)
             if gituser:
-                logger.info("Defined gitlab account: %s %s %s %s", user, gituser.username, gituser.id, gituser.name)
-                acc = define_gitlab_account(
-                    session,
-                    user,
-                    gituser.username,
-                    gituser.id,
-                    gituser.name,
-                    sync_time=sync_time,
+                return gituser
+            # not seen since the last full load – ask GitLab before concluding that the user is gone
+        try:
+            return self.gl.users.get(user_id)
+        except GitlabGetError as e:
+            if e.response_code == 404:
+                return None
+            raise
+
+    def _define_found_account(
+        self, session: sa.orm.Session, user: PuffinUser, found: dict[str, list[GitlabUser | DirectoryUser]], sync_time: datetime
+    ) -> Account | None:
+        """Define the GitLab account from the first username search with a single result."""
+        gituser = next((users[0] for users in found.values() if len(users) == 1), None)
+        if gituser:
+            logger.info("Defined gitlab account: %s %s %s %s", user, gituser.username, gituser.id, gituser.name)
+            acc = define_gitlab_account(
+                session,
+                user,
+                gituser.username,
+                gituser.id,
+                gituser.name,
+                sync_time=sync_time,
+            )
+            logger.info("Defined gitlab account: %s", acc)
+            return acc
+        users = next(iter(found.values()), [])
+        if len(users) == 0:
+            if "uib.no" in user.email:
+                logger.warn(
+                    "Missing GitLab user – maybe not registered yet? %s", user
                 )
-                logger.info("Defined gitlab account: %s", acc)
-            elif len(users) == 0:
-                if "uib.no" in user.email:
-                    logger.warn(
-                        "Missing GitLab user – maybe not registered yet? %s", user
-                    )
-                else:
-                    logger.warning("Missing GitLab user: %s", user)
-            else:
-                logger.warning("Ambiguous GitLab user: %s: %s", user, users)
-        elif verify:
-            gituser = self.gl.users.get(acc.external_id)  # type:ignore
-            if gituser:
-                if gituser.username != acc.username:
-                    logger.error(
-                        "GitLab user %d: expected username %s, was %s for user %s",
-                        acc.external_id,
-                        acc.username,
-                        gituser.username,
-                        user,
-                    )
-                    acc.username = gituser.username
-                    session.add(acc)
-                if gituser.name != acc.fullname:
-                    logger.info("Gitlab user %s: name change: %s → %s", gituser.name, acc.fullname, gituser.name)
-                    acc.fullname = gituser.name
-                    session.add(acc)
-                if gituser.state != 'active':
-                    logger.warning("Gitlab user %s: not active: state=%s", gituser.name, gituser.state)
-                session.commit()
             else:
+                logger.warning("Missing GitLab user: %s", user)
+        else:
+            logger.warning("Ambiguous GitLab user: %s: %s", user, users)
+        return None
+
+    def _update_verified_account(
+        self, session: sa.orm.Session, user: PuffinUser, acc: Account, gituser: GitlabUser | DirectoryUser | None, sync_time: datetime
+    ) -> Account | None:
+        """Update a GitLab account from the user's current GitLab data (or delete it if the GitLab user is gone)."""
+        if gituser:
+            if gituser.username != acc.username:
                 logger.error(
-                    "GitLab user %d doesn't exist: account=%s, user=%s",
+                    "GitLab user %d: expected username %s, was %s for user %s",
                     acc.external_id,
-                    acc,
+                    acc.username,
+                    gituser.username,
                     user,
                 )
-                session.delete(acc)
-                acc = None
-            if sync_time and acc:
-                LastSync.set_sync(session, acc, sync_time)
-        return acc  # type:ignore
+                acc.username = gituser.username
+                session.add(acc)
+            if gituser.name != acc.fullname:
+                logger.info("Gitlab user %s: name change: %s → %s", gituser.name, acc.fullname, gituser.name)
+                acc.fullname = gituser.name
+                session.add(acc)
+            if gituser.state != 'active':
+                logger.warning("Gitlab user %s: not active: state=%s", gituser.name, gituser.state)
+            sync_commit(session)
+        else:
+            logger.error(
+                "GitLab user %d doesn't exist: account=%s, user=%s",
+                acc.external_id,
+                acc,
+                user,
+            )
+            session.delete(acc)
+            acc = None  # type:ignore
+        if sync_time and acc:
+            LastSync.set_sync(session, acc, sync_time)
+        return acc
 
     def group_mergerequest_to_project_mergerequest(
         self, gmreq: GroupMergeRequest
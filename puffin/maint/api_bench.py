@@ -0,0 +1,111 @@
+#! /usr/bin/python
+"""Benchmark for ApiConnection's pooled HTTP sessions, against a local stub server.
+
+Runs N threads making GET requests for a few seconds, once with a fresh connection per request
+(plain requests.get, as ApiConnection did before it kept sessions) and once through ApiConnection,
+and reports throughput, latency and how many TCP connections the server had to accept.
+`--latency` adds a delay to each response, like a remote API would have.
+
+    python -m puffin.maint.api_bench --threads 8 --seconds 5 --latency 0.01
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import socket
+import threading
+import time
+
+import requests
+
+from puffin.util.apicalls import ApiConnection
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.latency = latency
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}/api/v1/'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    server: StubServer
+
+    def setup(self):
+        super().setup()
+        # headers and body are written separately; don't let Nagle hold back the body on kept-alive sockets
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))  # ApiConnection sends params as a JSON body
+        time.sleep(self.server.latency)
+        body = json.dumps({'id': 1, 'path': self.path, 'data': 'x' * 1000}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def run(server: StubServer, pooled: bool, threads: int, seconds: float):
+    conn = ApiConnection(server.url, 'token', pool_size=threads)
+    server.connections = 0
+    stop = time.time() + seconds
+    times = []
+    lock = threading.Lock()
+
+    def worker():
+        my_times = []
+        while time.time() < stop:
+            t0 = time.perf_counter()
+            if pooled:
+                conn.get_single('items/1')
+            else:
+                requests.get(f'{server.url}items/1', headers={'Authorization': 'Bearer token'}).json()
+            my_times.append(time.perf_counter() - t0)
+        with lock:
+            times.extend(my_times)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return times, server.connections
+
+
+def summary(times, seconds):
+    if not times:
+        return '0/s'
+    times = sorted(times)
+    return f'{len(times)/seconds:8.0f}/s  p50 {times[len(times)//2]*1000:6.2f} ms  p95 {times[int(len(times)*.95)]*1000:7.2f} ms'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ApiConnection connection pooling benchmark')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each response')
+    args = parser.parse_args()
+
+    server = StubServer(args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        for pooled in (False, True):
+            times, connections = run(server, pooled, args.threads, args.seconds)
+            print(f'{"pooled" if pooled else "unpooled":9}  {summary(times, args.seconds)}'
+                  f'  connections {connections}')
+    finally:
+        server.shutdown()
@@ -0,0 +1,86 @@
+#! /usr/bin/python
+"""Audit log maintenance: archive old entries and compact no-op updates (see puffin.db.audit_archive).
+
+    python -m puffin.maint.audit_log --compact --archive --days 365 --archive-dir /srv/puffin/audit
+    python -m puffin.maint.audit_log --compact --dry-run
+
+The retention period and archive directory default to AUDIT_LOG_RETENTION_DAYS (365) and
+AUDIT_LOG_ARCHIVE_DIR from the app config.
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+import sys
+import time
+
+from flask import Flask
+
+from puffin.db import database
+from puffin.db.database import db_session
+from puffin.db.audit_archive import archive_audit_log, compact_audit_log
+
+
+def reporter(what):
+    start = time.time()
+    last = [0.0]
+
+    def report(done, total):
+        now = time.time()
+        if now - last[0] >= 1 or done >= total:
+            last[0] = now
+            elapsed = now - start
+            eta = elapsed / done * (total - done) if done else 0
+            print(f'\r{what}: {done}/{total} ({100 * done / max(total, 1):5.1f}%), '
+                  f'{elapsed:.0f}s elapsed, ~{eta:.0f}s left   ', end='', file=sys.stderr, flush=True)
+            if done >= total:
+                print(file=sys.stderr)
+    return report
+
+
+def vacuum():
+    """Give the space back to the file system (SQLite) or update the planner statistics (PostgreSQL)."""
+    if database.engine.dialect.name == 'postgresql':
+        # VACUUM can't run in a transaction block
+        with database.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.exec_driver_sql('VACUUM ANALYZE audit_log')
+        return
+    conn = database.engine.raw_connection()
+    try:
+        conn.cursor().execute('VACUUM')
+    finally:
+        conn.close()
+
+
+def main(argv: list[str] | None = None, app: Flask | None = None):
+    """Run the command with `argv` (default: sys.argv) on `app`'s database (default: the Puffin app)."""
+    if app == None:
+        from puffin.app.app import app
+    parser = argparse.ArgumentParser(description='Audit log retention and compaction')
+    parser.add_argument('--compact', action='store_true', help='delete UPDATE entries that changed nothing')
+    parser.add_argument('--archive', action='store_true', help='move old entries to monthly archive files')
+    parser.add_argument('--days', type=int, default=app.config.get('AUDIT_LOG_RETENTION_DAYS', 365),
+                        help='keep entries newer than this in the database')
+    parser.add_argument('--archive-dir', default=app.config.get('AUDIT_LOG_ARCHIVE_DIR'))
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--vacuum', action='store_true', help='VACUUM the database afterwards')
+    parser.add_argument('--dry-run', action='store_true', help='only count the entries')
+    args = parser.parse_args(argv)
+    if not (args.compact or args.archive):
+        parser.error('nothing to do: use --compact and/or --archive')
+    if args.archive and not args.archive_dir:
+        parser.error('--archive needs --archive-dir (or AUDIT_LOG_ARCHIVE_DIR)')
+
+    if args.compact:
+        n = compact_audit_log(db_session, args.batch_size, args.dry_run, progress=reporter('compacting'))
+        print(f'{"Found" if args.dry_run else "Deleted"} {n} no-op updates')
+    if args.archive:
+        before = datetime.now(timezone.utc) - timedelta(days=args.days)
+        n = archive_audit_log(db_session, before, args.archive_dir, args.batch_size, args.dry_run,
+                              progress=reporter('archiving'))
+        print(f'{"Found" if args.dry_run else "Archived"} {n} entries from before {before:%Y-%m-%d}')
+    if args.vacuum and not args.dry_run:
+        db_session.close()  # end the session's transaction first
+        vacuum()
+
+
+if __name__ == '__main__':
+    main()
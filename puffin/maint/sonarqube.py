@@ -27,8 +27,11 @@ class SonarConnection(ApiConnection):
         if app:
             base_url = base_url or app.config.get("SONARQUBE_BASE_URL")
             token = token or app.config.get("SONARQUBE_SECRET_TOKEN")
+            options = {'cache_size': 8 * 1024 * 1024, **self.options_from_config(app.config, "SONARQUBE")}
+        else:
+            options = {'cache_size': 8 * 1024 * 1024}
 
-        super().__init__(base_url or '', token or '')
+        super().__init__(base_url or '', token or '', **options)
 
         self.__groups : dict[str,Any] = {}
         self.__users = {}
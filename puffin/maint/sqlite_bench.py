@@ -0,0 +1,108 @@
+#! /usr/bin/python
+"""Concurrency benchmark for the SQLite engine profiles in puffin.db.database.
+
+Runs N reader and M writer threads against a scratch database for a few seconds per profile,
+and reports throughput, latency and "database is locked" errors. Writers read a row before
+updating it, like most of our sync code, so DEFERRED transactions can hit lock upgrade errors.
+
+    python -m puffin.maint.sqlite_bench --readers 8 --writers 2 --seconds 5
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from puffin.db.database import SQLITE_PROFILES, configure_sqlite
+
+ROWS = 10000
+
+
+def setup(path):
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.begin() as conn:
+        conn.exec_driver_sql('CREATE TABLE item (id INTEGER PRIMARY KEY, user_id INTEGER, value TEXT)')
+        conn.exec_driver_sql('CREATE INDEX ix_item_user_id ON item (user_id)')
+        conn.execute(text('INSERT INTO item (id, user_id, value) VALUES (:id, :user_id, :value)'),
+                     [{'id': i, 'user_id': i % 500, 'value': 'x' * 100} for i in range(ROWS)])
+    engine.dispose()
+
+
+def run(path, profile, begin_immediate, readers, writers, seconds):
+    engine = create_engine(f'sqlite:///{path}', pool_size=readers + writers)
+    configure_sqlite(engine, SQLITE_PROFILES[profile])
+    stop = time.time() + seconds
+    stats = {'read': [], 'write': [], 'errors': 0}
+    lock = threading.Lock()
+
+    def reader():
+        times = []
+        while time.time() < stop:
+            t0 = time.perf_counter()
+            with Session(engine) as session:
+                session.execute(text('SELECT * FROM item WHERE user_id = :u'), {'u': random.randrange(500)}).all()
+            times.append(time.perf_counter() - t0)
+        with lock:
+            stats['read'].extend(times)
+
+    def writer():
+        times = []
+        errors = 0
+        while time.time() < stop:
+            t0 = time.perf_counter()
+            with Session(engine) as session:
+                if begin_immediate:
+                    session.connection(execution_options={'sqlite_begin': 'IMMEDIATE'})
+                try:
+                    i = random.randrange(ROWS)
+                    value = session.execute(text('SELECT value FROM item WHERE id = :i'), {'i': i}).scalar()
+                    session.execute(text('UPDATE item SET value = :v WHERE id = :i'), {'i': i, 'v': value[::-1]})
+                    session.commit()
+                except OperationalError:
+                    session.rollback()
+                    errors += 1
+                    continue
+            times.append(time.perf_counter() - t0)
+        with lock:
+            stats['write'].extend(times)
+            stats['errors'] += errors
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)] + \
+              [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    engine.dispose()
+    return stats
+
+
+def summary(times, seconds):
+    if not times:
+        return '0/s'
+    times = sorted(times)
+    return f'{len(times)/seconds:8.0f}/s  p50 {times[len(times)//2]*1000:6.2f} ms  p95 {times[int(len(times)*.95)]*1000:7.2f} ms'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SQLite concurrency benchmark')
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--profiles', nargs='*', default=list(SQLITE_PROFILES))
+    args = parser.parse_args()
+
+    for profile in args.profiles:
+        for begin_immediate in (False, True):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, 'bench.db')
+                setup(path)
+                stats = run(path, profile, begin_immediate, args.readers, args.writers, args.seconds)
+            print(f'{profile:10} {"IMMEDIATE" if begin_immediate else "DEFERRED":9}'
+                  f'  reads {summary(stats["read"], args.seconds)}'
+                  f'  writes {summary(stats["write"], args.seconds)}  lock errors {stats["errors"]}')
@@ -1,6 +1,7 @@
 import csv
 from datetime import datetime
 import sys
+from typing import Iterable
 from gitlab import Gitlab, GitlabGetError
 from gitlab.v4.objects  import Project as GitlabProject, User as GitlabUser, Group as GitlabGroup
 from slugify import slugify
@@ -122,7 +123,7 @@ class Submission:
                 self.__pipeline_status__ = 'na'
         return self.__pipeline_status__
     
-def get_all_course_user_projects(course_id, projects : list[GitlabProject], canvas_subs : list[CanvasSubmission] = []):
+def get_all_course_user_projects(course_id, projects : list[GitlabProject], canvas_subs : Iterable[CanvasSubmission] = ()):
     users = db_session.execute(select(User,Enrollment,Account).where(User.id == Enrollment.user_id, Enrollment.course_id == course_id, Enrollment.role == 'student', Account.user_id == User.id, Account.provider_name == 'gitlab')).all()
     projectsByUser = {p.path.split('_',1)[0]:p for p in projects}
     submissionsByUser = {s.user_id:s for s in canvas_subs}
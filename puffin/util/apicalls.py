@@ -1,28 +1,375 @@
-from collections import UserDict, namedtuple
+from collections import UserDict, deque, namedtuple
 import os
 from flask import current_app
-from typing import Any, Annotated
+from typing import Any, Annotated, Iterable, Iterator
 import typing
 import re
 import json
 from flask import Flask, current_app
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
 import logging
+import threading
+import time
+import hashlib
+import concurrent.futures
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 from puffin.util.errors import ErrorResponse
+from puffin.util.response_cache import CacheEntry, ResponseCache
 
 logger = logging.getLogger(__name__)
 
-LogEntry = namedtuple('LogEntry', ['msg', 'method', 'url', 'params', 'headers', 'result'])
-class ApiConnection:
+LogEntry = namedtuple('LogEntry', ['msg', 'method', 'url', 'params', 'headers', 'result', 'status'], defaults=[None])
+
+class RequestLog:
+    """Fixed-capacity log of recent requests, newest first (log[0] is the latest request).
+
+    Results larger than `max_result_size` characters (as JSON) are stored truncated."""
+
+    def __init__(self, maxlen: int = 200, max_result_size: int | None = None):
+        self.entries: deque[LogEntry] = deque(maxlen=maxlen)
+        self.max_result_size = max_result_size
+        # entries are recorded from the prefetch worker threads too
+        self.lock = threading.Lock()
+
+    def record(self, entry: LogEntry) -> LogEntry:
+        if self.max_result_size != None and entry.result != None:
+            text = json.dumps(entry.result)
+            if len(text) > self.max_result_size:
+                entry = entry._replace(result=text[:self.max_result_size] + '…')
+        with self.lock:
+            self.entries.appendleft(entry)
+        return entry
+
+    def snapshot(self) -> list[LogEntry]:
+        with self.lock:
+            return list(self.entries)
+
+    def query(self, method: str | None = None, url_prefix: str | None = None,
+              status: int | Iterable[int] | None = None) -> list[LogEntry]:
+        """Find logged requests, e.g. log.query(method='PUT', status=range(400, 600))"""
+        if isinstance(status, int):
+            status = (status,)
+        return [e for e in self.snapshot()
+                if (method == None or e.method.rstrip('*') == method.upper())
+                and (url_prefix == None or e.url.startswith(url_prefix))
+                and (status == None or e.status in status)]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    @property
+    def maxlen(self) -> int | None:
+        return self.entries.maxlen
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __getitem__(self, index: int | slice):
+        if isinstance(index, slice):
+            return self.snapshot()[index]
+        with self.lock:
+            return self.entries[index]
+
+    def __repr__(self):
+        return f'RequestLog({len(self)}/{self.maxlen} entries)'
+
+class RateLimiter:
+    """Token bucket for one API host, shared by all connections and threads in the process.
+
+    Canvas meters each token with a leaky bucket (about 700 units, draining at ~10 units/s),
+    reports what is left in `X-Rate-Limit-Remaining` and what the last request cost in
+    `X-Request-Cost`, and answers 403 "Rate Limit Exceeded" when the bucket runs dry.
+    We keep an estimate of the remaining quota, only let as many requests run at once as the
+    quota can pay for, and back off exponentially when throttled anyway."""
+
+    limiters: dict[str, 'RateLimiter'] = {}
+    limiters_lock = threading.Lock()
+
+    def __init__(self, capacity: float = 700.0, refill_rate: float = 10.0, reserve: float = 100.0,
+                 max_concurrency: int = 8, max_backoff: float = 60.0, clock: typing.Callable[[], float] = time.monotonic):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.reserve = reserve
+        self.max_concurrency = max_concurrency
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.lock = threading.Condition()
+        self.remaining = capacity
+        self.updated = clock()
+        self.cost = 50.0  # Canvas charges 50 up front for every request
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.backoff = 1.0
+
+    @classmethod
+    def for_host(cls, host: str, **options) -> 'RateLimiter':
+        with cls.limiters_lock:
+            limiter = cls.limiters.get(host)
+            if limiter == None:
+                limiter = cls.limiters[host] = cls(**options)
+            return limiter
+
+    def reserve_slot(self) -> float:
+        """Claim a request slot and return 0, or return the number of seconds to wait before trying again."""
+        with self.lock:
+            now = self.clock()
+            self.remaining = min(self.capacity, self.remaining + (now - self.updated) * self.refill_rate)
+            self.updated = now
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            available = self.remaining - self.reserve - self.in_flight * self.cost
+            if self.in_flight == 0 and self.remaining >= self.cost or \
+                    self.in_flight < self.max_concurrency and available >= self.cost:
+                self.in_flight += 1
+                return 0
+            return max(0.05, (self.cost - available) / self.refill_rate)
+
+    def acquire(self):
+        while (delay := self.reserve_slot()) > 0:
+            with self.lock:
+                self.lock.wait(delay)
+
+    def release(self, status: int | None, headers: typing.Mapping[str, str] = {}, text: str = '') -> bool:
+        """Update the estimate from a response; returns True if the request was throttled and should be retried."""
+        with self.lock:
+            self.in_flight -= 1
+            now = self.clock()
+            cost = headers.get('X-Request-Cost')
+            if cost != None:
+                self.cost = 0.8 * self.cost + 0.2 * float(cost)
+            remaining = headers.get('X-Rate-Limit-Remaining')
+            if remaining != None:
+                self.remaining = float(remaining)
+                self.updated = now
+            throttled = status == 429 or status == 403 and 'Rate Limit Exceeded' in text
+            if throttled:
+                self.remaining = 0.0
+                self.updated = now
+                self.blocked_until = now + self.backoff
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+                logger.warning('Rate limit exceeded, backing off for %.1fs', self.blocked_until - now)
+            elif status != None:
+                self.backoff = max(1.0, self.backoff / 2)
+            self.lock.notify_all()
+            return throttled
+
+    def __repr__(self):
+        return f'RateLimiter(remaining={self.remaining:.0f}, cost={self.cost:.1f}, in_flight={self.in_flight})'
+
+class BaseApiConnection:
+    """What ApiConnection and its asyncio twin (puffin.util.async_apicalls) have in common:
+    options, the request log, the rate limiter, the response cache and turning responses into results.
+
+    The helpers work with both requests and httpx responses."""
+
+    config_options = ['max_retries', 'timeout', 'log_size', 'log_result_size', 'rate_limit',
+                      'cache_size', 'cache_ttl', 'cache_path']
 
     def __init__(
-        self, base_url: str, token: str
+        self, base_url: str, token: str, max_retries: int = 3,
+        timeout: float | tuple[float, float] | None = (10, 120),
+        log_size: int = 200, log_result_size: int | None = None, rate_limit: bool = False,
+        cache_size: int = 0, cache_ttl: float = 24 * 3600, cache_path: str | None = None
     ):
         self.token = token
         self.base_url = base_url
-        self.log = []
+        self.log = RequestLog(log_size, log_result_size)
+        # one limiter per host, so that all connections to the same server share the quota
+        self.limiter = RateLimiter.for_host(urlsplit(base_url).netloc) if rate_limit else None
+        # cache_size is in bytes of response bodies kept in memory (0 turns the cache off)
+        self.cache = ResponseCache(cache_size, cache_ttl, cache_path) if cache_size > 0 else None
+        # cached responses are only valid for the token that fetched them
+        self.cache_namespace = hashlib.sha256(token.encode()).hexdigest()[:16]
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+    @classmethod
+    def options_from_config(cls, config, prefix: str) -> dict[str, Any]:
+        """Collect connection options from app config keys like CANVAS_POOL_SIZE."""
+        options = {}
+        for key in cls.config_options:
+            value = config.get(f'{prefix}_{key.upper()}')
+            if value != None:
+                options[key] = value
+        return options
+
+    def _cache_lookup(self, method, url, kwargs: dict) -> tuple[str, CacheEntry | None] | None:
+        """Find the cached response for a request, and make the request conditional (changes `kwargs`).
+
+        Returns None if the response can't be cached."""
+        if self.cache == None or method != 'GET':
+            return None
+        key = self.cache.key(self.cache_namespace, method, url, kwargs.get('params') or kwargs.get('json'))
+        entry = self.cache.get(key)
+        if entry != None:
+            headers = dict(kwargs.get('headers') or {})
+            if 'ETag' in entry.headers:
+                headers['If-None-Match'] = entry.headers['ETag']
+            if 'Last-Modified' in entry.headers:
+                headers['If-Modified-Since'] = entry.headers['Last-Modified']
+            kwargs['headers'] = headers
+        return key, entry
+
+    def _cache_update(self, lookup: tuple[str, CacheEntry | None] | None, req):
+        """Fill the cached body into a 304 Not Modified response, or cache a new response."""
+        if lookup == None or self.cache == None:
+            return req
+        key, entry = lookup
+        if req.status_code == 304 and entry != None:
+            self.cache.hit(key, entry)
+            req._content = entry.content
+            req.headers.update(entry.headers)
+        elif req.status_code == 200 and ('ETag' in req.headers or 'Last-Modified' in req.headers) \
+                and 'no-store' not in req.headers.get('Cache-Control', ''):
+            self.cache.miss(key, req.content, req.headers)
+        return req
+
+    def _throttled(self, req, method, url, attempt: int) -> bool:
+        """Report a response to the rate limiter; True if it was throttled and should be retried."""
+        assert self.limiter != None
+        throttled = self.limiter.release(req.status_code, req.headers, req.text if req.status_code == 403 else '')
+        if throttled and attempt < self.max_retries:
+            logger.info('Retrying throttled request: %s %s', method, url)
+            return True
+        return False
+
+    def _result(self, req, log_entry: LogEntry, endpoint, raise_on_error) -> dict[str, Any] | None:
+        log_entry = log_entry._replace(status=req.status_code)
+        if req.status_code < 400:  # like requests' Response.ok, so 304s count
+            if 'json' in req.headers.get('Content-Type', ''):
+                result = req.json()
+            else:
+                result = {'status':'ok', 'data':req.text}
+            self.log.record(log_entry._replace(result=result))
+            return result
+        elif not raise_on_error:
+            self.log.record(log_entry)
+            return None
+        else:
+            if 'json' in req.headers.get('Content-Type', ''):
+                result = req.json()
+                result['status_code'] = req.status_code
+            else:
+                result ={'status':'error', 'status_code':req.status_code, 'data':req.text}
+            self.log.record(log_entry._replace(result=result))
+            logger.error(
+                f"Request failed: {self.base_url}{endpoint} {req.status_code} {self._reason(req)}"
+            )
+            raise ErrorResponse(
+                f"Request failed: {self._reason(req)}", endpoint, status_code=req.status_code
+            )
+
+    def _page_result(self, req, log_entry: LogEntry, url, raise_on_error) -> tuple[list[dict[str, Any]], dict] | None:
+        log_entry = log_entry._replace(status=req.status_code)
+        if req.status_code < 400:
+            result = req.json()
+            self.log.record(log_entry._replace(result=result))
+            return result, req.links
+        self.log.record(log_entry)
+        if raise_on_error:
+            logger.error(
+                f"Request failed: {url} {req.status_code} {self._reason(req)}"
+            )
+            raise ErrorResponse(
+                f"Request failed: {self._reason(req)}",
+                url,
+                status_code=req.status_code,
+            )
+        else:
+            return None
+
+    @staticmethod
+    def _reason(req) -> str:
+        # requests has .reason, httpx .reason_phrase
+        return getattr(req, 'reason', None) or getattr(req, 'reason_phrase', '')
+
+    def debug_request(self, method, url, params, headers, debug) -> LogEntry:
+        params = params or {}
+        headers = {k:headers[k] for k in headers or {} if k not in ['Authorization','Cookie']}
+        logger.info(
+            "ApiConnection:  %s %s%sparams=%s%sheaders=%s",
+            method,
+            url,
+            '\n\t' if debug and len(params) > 0 else ', ',
+            json.dumps(params),
+            '\n\t' if debug and len(headers) > 0 else ', ',
+            json.dumps(headers),
+        )
+        return LogEntry(f'{method} {url}', method, url, params, headers, None)
+
+    @staticmethod
+    def _page_urls(links: dict) -> list[str] | None:
+        """URLs of all remaining pages, computed from numbered `next` and `last` links (or None if not numbered)."""
+        if "next" not in links or "last" not in links:
+            return None
+        next_url = urlsplit(links["next"]["url"])
+        last_url = urlsplit(links["last"]["url"])
+        next_page = dict(parse_qsl(next_url.query)).get('page', '')
+        last_page = dict(parse_qsl(last_url.query)).get('page', '')
+        if not (next_page.isdigit() and last_page.isdigit()):
+            return None
+        query = parse_qsl(last_url.query, keep_blank_values=True)
+        return [
+            urlunsplit(last_url._replace(query=urlencode([(k, str(n) if k == 'page' else v) for (k, v) in query])))
+            for n in range(int(next_page), int(last_page) + 1)
+        ]
+
+class ApiConnection(BaseApiConnection):
+
+    def __init__(
+        self, base_url: str, token: str, pool_size: int = 10, max_retries: int = 3,
+        timeout: float | tuple[float, float] | None = (10, 120), prefetch_workers: int = 4,
+        log_size: int = 200, log_result_size: int | None = None, rate_limit: bool = False,
+        cache_size: int = 0, cache_ttl: float = 24 * 3600, cache_path: str | None = None
+    ):
+        super().__init__(base_url, token, max_retries=max_retries, timeout=timeout, log_size=log_size,
+                         log_result_size=log_result_size, rate_limit=rate_limit,
+                         cache_size=cache_size, cache_ttl=cache_ttl, cache_path=cache_path)
+        self.pool_size = pool_size
+        self.thread_local = threading.local()
+        self.thread_local.session = None
+        self.prefetch_workers = prefetch_workers
+        self.executor_lock = threading.Lock()
+        self._executor = None
+
+    config_options = ['pool_size', 'prefetch_workers', *BaseApiConnection.config_options]
+
+    @property
+    def session(self) -> requests.Session:
+        """A pooled, keep-alive session – one per thread, since requests.Session isn't thread-safe."""
+        if getattr(self.thread_local, "session", None) == None:
+            self.thread_local.session = self.create_session()
+        return self.thread_local.session
+
+    def create_session(self) -> requests.Session:
+        session = requests.Session()
+        # only retries idempotent methods (urllib3 default), and only on connection errors / gateway trouble
+        retry = Retry(total=self.max_retries, backoff_factor=0.5, status_forcelist=[502, 503, 504],
+                      raise_on_status=False, respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers["Authorization"] = f"Bearer {self.token}"
+        return session
+
+    def close(self):
+        """Close the current thread's session and shut down the page prefetch workers."""
+        session = getattr(self.thread_local, "session", None)
+        if session != None:
+            session.close()
+            self.thread_local.session = None
+        with self.executor_lock:
+            if self._executor != None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
 
     def get_single(self, endpoint, params={}, headers={}, use_form=False) -> dict[str, Any]:
         result = self.maybe_request(
@@ -87,52 +434,41 @@ class ApiConnection:
         url = f'{self.base_url.rstrip("/")}/{endpoint.lstrip("/")}'
 
         log_entry = self.debug_request(method, url, params, headers, debug)
-        self.log.insert(0, log_entry)
-        
+
         if do_nothing:
+            self.log.record(log_entry)
             return params
 
-        headers["Authorization"] = f"Bearer {self.token}"
         # TODO: add Accept
         if use_form:
-            req = requests.request(method, url, params=params, headers=headers)
+            req = self.send(method, url, params=params, headers=headers)
         else:
-            req = requests.request(method, url, json=params, headers=headers)
-
-        if req.ok:
-            if 'json' in req.headers.get('Content-Type', ''):
-                log_entry = log_entry._replace(result=req.json())
-            else:
-                log_entry = log_entry._replace(result={'status':'ok', 'data':req.text})
-            return log_entry.result
-        elif not raise_on_error:
-            return None
-        else:
-            if 'json' in req.headers.get('Content-Type', ''):
-                result = req.json()
-                result['status_code'] = req.status_code
-            else:
-                result ={'status':'error', 'status_code':req.status_code, 'data':req.text}
-            logger.error(
-                f"Request failed: {self.base_url}{endpoint} {req.status_code} {req.reason}"
-            )
-            raise ErrorResponse(
-                f"Request failed: {req.reason}", endpoint, status_code=req.status_code
-            )
-
-    def debug_request(self, method, url, params, headers, debug) -> LogEntry:
-        params = params or {}
-        headers = {k:headers[k] for k in headers or {} if k not in ['Authorization','Cookie']}
-        logger.info(
-            "ApiConnection:  %s %s%sparams=%s%sheaders=%s",
-            method,
-            url,
-            '\n\t' if debug and len(params) > 0 else ', ',
-            json.dumps(params),
-            '\n\t' if debug and len(headers) > 0 else ', ',
-            json.dumps(headers),
-        )
-        return LogEntry(f'{method} {url}', method, url, params, headers, None)
+            req = self.send(method, url, json=params, headers=headers)
+
+        return self._result(req, log_entry, endpoint, raise_on_error)
+
+    def send(self, method, url, **kwargs) -> requests.Response:
+        """Send a request; GET requests are made conditional if we have a cached response with an ETag.
+
+        When the server answers 304 Not Modified, the cached body is filled into the response."""
+        cached = self._cache_lookup(method, url, kwargs)
+        return self._cache_update(cached, self.send_limited(method, url, **kwargs))
+
+    def send_limited(self, method, url, **kwargs) -> requests.Response:
+        """Send a request through the rate limiter (if any), retrying when throttled."""
+        if self.limiter == None:
+            return self.session.request(method, url, timeout=self.timeout, **kwargs)
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                req = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except:
+                self.limiter.release(None)
+                raise
+            if not self._throttled(req, method, url, attempt):
+                return req
+            attempt += 1
 
     def get_paginated(self, endpoint, params={}, headers={}, use_form=False) -> list[dict[str, Any]]:
         result = self.maybe_get_paginated(
@@ -142,40 +478,109 @@ class ApiConnection:
         return result
 
     def maybe_get_paginated(
-        self, endpoint, params={}, headers={}, raise_on_error=False, debug=True, use_form=False
+        self, endpoint, params={}, headers={}, raise_on_error=False, debug=True, use_form=False,
+        prefetch: int | None = None
     ) -> list[dict[str, Any]] | None:
-        headers["Authorization"] = f"Bearer {self.token}"
-        results = []
+        """Fetch all pages of a list endpoint.
+
+        If the first response has numbered `next` and `last` links (as Canvas does for most
+        list endpoints), the remaining pages are fetched concurrently, with at most `prefetch`
+        requests in flight (default `self.prefetch_workers`). Otherwise, pages are followed one at a time."""
         endpoint = f"{self.base_url}{endpoint}"
-        params['per_page'] = 200
-        while endpoint != None:
-            log_entry = self.debug_request('GET*', endpoint, params, headers, debug)
-            self.log.insert(0, log_entry)
-            
-            req = requests.get(endpoint, params=params, headers=headers)
-            
-            if req.ok:
-                results = results + req.json()
-                if "next" in req.links:
-                    endpoint = req.links["next"]["url"]
-                else:
-                    endpoint = None
-                params = None
-            elif raise_on_error:
-                log_entry = log_entry._replace(result=req.status_code)
-                logger.error(
-                    f"Request failed: {endpoint} {req.status_code} {req.reason}"
-                )
-                raise ErrorResponse(
-                    f"Request failed: {req.reason}",
-                    endpoint,
-                    status_code=req.status_code,
-                )
-            else:
+        params = {**params, 'per_page': 200}
+        prefetch = self.prefetch_workers if prefetch == None else prefetch
+
+        page = self._get_page(endpoint, params, headers, raise_on_error, debug)
+        if page == None:
+            return None
+        results, links = page
+
+        page_urls = self._page_urls(links) if prefetch > 1 else None
+        if page_urls:
+            pages: list[list[dict[str, Any]] | None] = [None] * len(page_urls)
+            todo = deque(enumerate(page_urls))
+            running: dict[concurrent.futures.Future, int] = {}  # at most `prefetch` requests in flight
+            try:
+                while todo or running:
+                    while todo and len(running) < prefetch:
+                        i, url = todo.popleft()
+                        running[self.executor.submit(self._get_page, url, None, headers, raise_on_error, debug)] = i
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        page = future.result()
+                        if page == None:
+                            return None
+                        pages[running.pop(future)] = page[0]
+            finally:
+                for future in running:
+                    future.cancel()
+            for items in pages:
+                results.extend(items) # type: ignore
+            return results
+
+        while "next" in links:
+            page = self._get_page(links["next"]["url"], None, headers, raise_on_error, debug)
+            if page == None:
                 return None
-        log_entry = log_entry._replace(result=results)
+            results.extend(page[0])
+            links = page[1]
         return results
 
+    def iter_paginated(
+        self, endpoint, params={}, headers={}, debug=True, prefetch: int | None = None
+    ) -> Iterator[dict[str, Any]]:
+        """Yield the items of a list endpoint page by page.
+
+        While the caller works on one page, up to `prefetch` following pages are
+        downloaded in the background. Errors are raised as ErrorResponse."""
+        endpoint = f"{self.base_url}{endpoint}"
+        params = {**params, 'per_page': 200}
+        prefetch = self.prefetch_workers if prefetch == None else prefetch
+
+        items, links = self._get_page(endpoint, params, headers, True, debug) # type: ignore
+        # numbered pages are fetched `prefetch` at a time; otherwise (e.g. bookmarks) we follow `next` one page ahead
+        page_urls = self._page_urls(links) if prefetch > 1 else None
+        page_urls = iter(page_urls) if page_urls != None else None
+        pending: deque[concurrent.futures.Future] = deque()
+
+        def fetch_ahead():
+            if page_urls != None:
+                url = next(page_urls, None)
+                if url != None:
+                    pending.append(self.executor.submit(self._get_page, url, None, headers, True, debug))
+            elif prefetch > 1 and "next" in links and len(pending) == 0:
+                pending.append(self.executor.submit(self._get_page, links["next"]["url"], None, headers, True, debug))
+
+        try:
+            while True:
+                for _ in range(prefetch - len(pending)):
+                    fetch_ahead()
+                yield from items
+                if pending:
+                    items, links = pending.popleft().result()
+                elif "next" in links:
+                    items, links = self._get_page(links["next"]["url"], None, headers, True, debug) # type: ignore
+                else:
+                    return
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _get_page(self, url, params, headers, raise_on_error, debug) -> tuple[list[dict[str, Any]], dict] | None:
+        log_entry = self.debug_request('GET*', url, params, headers, debug)
+
+        req = self.send('GET', url, params=params, headers=headers)
+        return self._page_result(req, log_entry, url, raise_on_error)
+
+    @property
+    def executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Worker pool for concurrent page fetches; kept alive so the workers' sessions can be reused."""
+        with self.executor_lock:
+            if self._executor == None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.prefetch_workers, thread_name_prefix=type(self).__name__)
+            return self._executor
+
 class ObjectLikeDict(UserDict):
     def __init__(self, data={}):
         self.__readonly__ = set(["data", "__readonly__"])
@@ -226,7 +631,7 @@ Undefined = __create_undefined__()
 
 
 def required_attrs(cls):
-    annos = cls.__annotations__
+    annos = typing.get_type_hints(cls, include_extras=True)
     return [
         (k, typing.get_args(annos[k])[0], None)
         for k in annos
@@ -236,7 +641,9 @@ def required_attrs(cls):
 
 def all_attrs(cls):
     annos = typing.get_type_hints(cls, include_extras=True)
-    return [(k, annos[k], cls.__dict__.get(k, Undefined)) for k in annos]
+    def default(k):
+        return next((c.__dict__[k] for c in cls.__mro__ if k in c.__dict__), Undefined)
+    return [(k, annos[k], default(k)) for k in annos]
 
 
 camelcase_pattern = re.compile(r"(?<=[a-z])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
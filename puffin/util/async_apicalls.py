@@ -0,0 +1,246 @@
+import asyncio
+from collections import deque
+import threading
+import logging
+from typing import Any, AsyncIterator, Coroutine, TypeVar
+from urllib.parse import urlsplit
+
+import httpx
+
+from puffin.util.apicalls import BaseApiConnection
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+class AsyncApiConnection(BaseApiConnection):
+    """asyncio version of ApiConnection, with the same request methods as coroutines.
+
+    Requests to the same host are limited to `max_per_host` in flight at once. Use it
+    inside `async with conn:` (which opens and closes the HTTP client), or call
+    `conn.run(coroutine)` from synchronous code such as a Flask handler."""
+
+    config_options = ['max_per_host', *BaseApiConnection.config_options]
+
+    def __init__(
+        self, base_url: str, token: str, max_per_host: int = 8, max_retries: int = 3,
+        timeout: float | tuple[float, float] | None = (10, 120),
+        log_size: int = 200, log_result_size: int | None = None, rate_limit: bool = False,
+        cache_size: int = 0, cache_ttl: float = 24 * 3600, cache_path: str | None = None
+    ):
+        super().__init__(base_url, token, max_retries=max_retries, timeout=timeout, log_size=log_size,
+                         log_result_size=log_result_size, rate_limit=rate_limit,
+                         cache_size=cache_size, cache_ttl=cache_ttl, cache_path=cache_path)
+        self.max_per_host = max_per_host
+        # each thread runs its own event loop, so clients and semaphores are per thread
+        self.thread_local = threading.local()
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        """Run a coroutine (e.g. `course.get_users()`) to completion from synchronous code."""
+        async def main():
+            async with self:
+                return await coro
+        return asyncio.run(main())
+
+    async def __aenter__(self):
+        self.thread_local.depth = getattr(self.thread_local, 'depth', 0) + 1
+        self.client  # opens the client for the running loop
+        return self
+
+    async def __aexit__(self, *exc):
+        self.thread_local.depth -= 1
+        if self.thread_local.depth == 0:
+            await self.close()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if getattr(self.thread_local, 'loop', None) != loop:
+            self.thread_local.loop = loop
+            self.thread_local.client = self.create_client()
+            self.thread_local.semaphores = {}
+        return self.thread_local.client
+
+    def create_client(self) -> httpx.AsyncClient:
+        if isinstance(self.timeout, (tuple, list)):
+            timeout = httpx.Timeout(self.timeout[1], connect=self.timeout[0])
+        else:
+            timeout = httpx.Timeout(self.timeout)
+        return httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {self.token}"},
+            timeout=timeout,
+            transport=httpx.AsyncHTTPTransport(retries=self.max_retries),
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=self.max_per_host),
+        )
+
+    async def close(self):
+        client = getattr(self.thread_local, 'client', None)
+        if client != None:
+            await client.aclose()
+        self.thread_local.client = None
+        self.thread_local.loop = None
+
+    def host_limit(self, url: str) -> asyncio.Semaphore:
+        self.client  # semaphores belong to the running loop
+        host = urlsplit(url).netloc
+        sem = self.thread_local.semaphores.get(host)
+        if sem == None:
+            sem = self.thread_local.semaphores[host] = asyncio.Semaphore(self.max_per_host)
+        return sem
+
+    async def get_single(self, endpoint, params={}, headers={}, use_form=False) -> dict[str, Any]:
+        result = await self.maybe_request(
+            "GET", endpoint, params=params, headers=headers, raise_on_error=True, use_form=use_form
+        )
+        assert result != None
+        return result
+
+    async def post(self, endpoint, params={}, headers={}, debug=False, use_form=False) -> dict[str, Any]:
+        result = await self.maybe_request(
+            "POST", endpoint, params=params, headers=headers, raise_on_error=True, debug=debug, use_form=use_form
+        )
+        assert result != None
+        return result
+
+    async def put(self, endpoint, params={}, headers={}, debug=False, use_form=False) -> dict[str, Any]:
+        result = await self.maybe_request(
+            "PUT", endpoint, params=params, headers=headers, raise_on_error=True, debug=debug, use_form=use_form
+        )
+        assert result != None
+        return result
+
+    async def request(
+        self, method, endpoint, params={}, headers={}, debug=True, do_nothing=False, use_form=False
+    ) -> dict[str, Any]:
+        result = await self.maybe_request(
+            method, endpoint, params=params, headers=headers, raise_on_error=True,
+            debug=debug, do_nothing=do_nothing, use_form=use_form
+        )
+        assert result != None
+        return result
+
+    async def maybe_request(
+        self,
+        method,
+        endpoint,
+        params={},
+        headers={},
+        raise_on_error=False,
+        debug=True,
+        do_nothing=False,
+        use_form=False
+    ) -> dict[str, Any] | None:
+        url = f'{self.base_url.rstrip("/")}/{endpoint.lstrip("/")}'
+
+        log_entry = self.debug_request(method, url, params, headers, debug)
+
+        if do_nothing:
+            self.log.record(log_entry)
+            return params
+
+        if use_form:
+            req = await self.send(method, url, params=params, headers=headers)
+        else:
+            req = await self.send(method, url, json=params, headers=headers)
+
+        return self._result(req, log_entry, endpoint, raise_on_error)
+
+    async def send(self, method, url, **kwargs) -> httpx.Response:
+        """Send a request; GET requests are made conditional if we have a cached response (see ApiConnection.send)."""
+        cached = self._cache_lookup(method, url, kwargs)
+        return self._cache_update(cached, await self.send_limited(method, url, **kwargs))
+
+    async def send_limited(self, method, url, **kwargs) -> httpx.Response:
+        """Send a request within the per-host limit and the rate limiter (if any), retrying when throttled."""
+        async with self.host_limit(url):
+            if self.limiter == None:
+                return await self.client.request(method, url, **kwargs)
+            attempt = 0
+            while True:
+                while (delay := self.limiter.reserve_slot()) > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    req = await self.client.request(method, url, **kwargs)
+                except BaseException:
+                    self.limiter.release(None)
+                    raise
+                if not self._throttled(req, method, url, attempt):
+                    return req
+                attempt += 1
+
+    async def get_paginated(self, endpoint, params={}, headers={}) -> list[dict[str, Any]]:
+        result = await self.maybe_get_paginated(endpoint, params=params, headers=headers, raise_on_error=True)
+        assert result != None
+        return result
+
+    async def maybe_get_paginated(
+        self, endpoint, params={}, headers={}, raise_on_error=False, debug=True
+    ) -> list[dict[str, Any]] | None:
+        """Fetch all pages of a list endpoint; with numbered `last` links, remaining pages are fetched concurrently."""
+        endpoint = f"{self.base_url}{endpoint}"
+        page = await self._get_page(endpoint, {**params, 'per_page': 200}, headers, raise_on_error, debug)
+        if page == None:
+            return None
+        results, links = page
+
+        page_urls = self._page_urls(links)
+        if page_urls:
+            pages = await asyncio.gather(*[self._get_page(url, None, headers, raise_on_error, debug) for url in page_urls])
+            for page in pages:
+                if page == None:
+                    return None
+                results.extend(page[0])
+            return results
+
+        while "next" in links:
+            page = await self._get_page(links["next"]["url"], None, headers, raise_on_error, debug)
+            if page == None:
+                return None
+            results.extend(page[0])
+            links = page[1]
+        return results
+
+    async def iter_paginated(
+        self, endpoint, params={}, headers={}, debug=True, prefetch: int | None = None
+    ) -> AsyncIterator[dict[str, Any]]:
+        """Yield the items of a list endpoint page by page (see ApiConnection.iter_paginated).
+
+        Up to `prefetch` (default `max_per_host`) following pages are fetched while the caller works."""
+        endpoint = f"{self.base_url}{endpoint}"
+        params = {**params, 'per_page': 200}
+        prefetch = self.max_per_host if prefetch == None else prefetch
+
+        items, links = await self._get_page(endpoint, params, headers, True, debug) # type: ignore
+        page_urls = self._page_urls(links) if prefetch > 1 else None
+        page_urls = iter(page_urls) if page_urls != None else None
+        pending: deque[asyncio.Task] = deque()
+
+        def fetch_ahead():
+            if page_urls != None:
+                url = next(page_urls, None)
+                if url != None:
+                    pending.append(asyncio.ensure_future(self._get_page(url, None, headers, True, debug)))
+            elif prefetch > 1 and "next" in links and len(pending) == 0:
+                pending.append(asyncio.ensure_future(self._get_page(links["next"]["url"], None, headers, True, debug)))
+
+        try:
+            while True:
+                for _ in range(prefetch - len(pending)):
+                    fetch_ahead()
+                for item in items:
+                    yield item
+                if pending:
+                    items, links = await pending.popleft()
+                elif "next" in links:
+                    items, links = await self._get_page(links["next"]["url"], None, headers, True, debug) # type: ignore
+                else:
+                    return
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _get_page(self, url, params, headers, raise_on_error, debug) -> tuple[list[dict[str, Any]], dict] | None:
+        log_entry = self.debug_request('GET*', url, params, headers, debug)
+
+        req = await self.send('GET', url, params=params, headers=headers)
+        return self._page_result(req, log_entry, url, raise_on_error)
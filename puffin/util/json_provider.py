@@ -0,0 +1,82 @@
+from datetime import date, datetime, time
+import enum
+import json
+import logging
+from typing import Any
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def json_default(obj) -> Any:
+    """Encode values the json module doesn't know: dates/times like DateEncoder, enums by value,
+    and whatever Flask's default provider handles (Decimal, UUID, dataclasses, ...)."""
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat().replace('+00:00', 'Z')
+    if isinstance(obj, enum.Enum):
+        return obj.value  # same as orjson
+    return DefaultJSONProvider.default(obj)
+
+
+def dumps(obj, **kwargs) -> str:
+    """json.dumps with orjson (if installed), using json_default for other types."""
+    if orjson != None and not kwargs:
+        try:
+            return orjson.dumps(obj, default=json_default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass  # e.g. integers that don't fit in 64 bits; try again with json
+    return json.dumps(obj, default=json_default, **kwargs)
+
+
+class PuffinJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that uses orjson if it is installed (and JSON_USE_ORJSON isn't False),
+    otherwise Flask's default provider. Either way, datetimes are encoded as by DateEncoder
+    (ISO 8601 with `Z` for UTC) instead of as HTTP dates."""
+
+    default = staticmethod(json_default)
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.use_orjson = orjson != None and app.config.get('JSON_USE_ORJSON', True)
+
+    def _options(self, indent=False):
+        option = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if self.use_orjson and not kwargs:
+            try:
+                return orjson.dumps(obj, default=json_default, option=self._options()).decode()
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        if self.use_orjson and not kwargs:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                pass  # let json raise its usual error
+        return super().loads(s, **kwargs)
+
+    def response(self, *args: Any, **kwargs: Any):
+        if not self.use_orjson:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact == False or (self.compact == None and self._app.debug)
+        try:
+            data = orjson.dumps(obj, default=json_default, option=self._options(indent))
+        except TypeError:
+            logger.info('orjson failed, using json: %s', type(obj))
+            data = super().dumps(obj, indent=2 if indent else None).encode()
+        return self._app.response_class(data + b'\n', mimetype=self.mimetype)
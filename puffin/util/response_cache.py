@@ -0,0 +1,119 @@
+from collections import OrderedDict, namedtuple
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# headers we need to rebuild a response from the cache
+CACHED_HEADERS = ['Content-Type', 'Link', 'ETag', 'Last-Modified']
+
+CacheEntry = namedtuple('CacheEntry', ['content', 'headers', 'stored_at'])
+
+class ResponseCache:
+    """Stores GET response bodies with their ETag/Last-Modified, for conditional requests.
+
+    Entries are kept in memory (least recently used are evicted when the bodies add up to
+    more than `max_bytes`) and, if `path` is given, in an SQLite file shared between worker
+    processes. Entries older than `ttl` seconds are dropped."""
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, ttl: float = 24 * 3600, path: str | None = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = path
+        self.entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.size = 0  # bytes of content in `entries`
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY, content BLOB, headers TEXT, stored_at REAL)''')
+            self.db.commit()
+
+    @staticmethod
+    def key(namespace: str, method: str, url: str, params) -> str:
+        return f'{namespace} {method} {url} {json.dumps(params or {}, sort_keys=True)}'
+
+    def get(self, key: str) -> CacheEntry | None:
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry == None and self.db != None:
+                row = self.db.execute(
+                    'SELECT content, headers, stored_at FROM response_cache WHERE key = ?', (key,)).fetchone()
+                if row != None:
+                    entry = CacheEntry(row[0], json.loads(row[1]), row[2])
+                    self._put(key, entry)
+            if entry == None:
+                return None
+            if now - entry.stored_at > self.ttl:
+                self._delete(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def store(self, key: str, content: bytes, headers) -> CacheEntry:
+        entry = CacheEntry(content, {h: headers[h] for h in CACHED_HEADERS if h in headers}, time.time())
+        with self.lock:
+            self._put(key, entry)
+            if self.db != None:
+                self.db.execute('INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?)',
+                                (key, entry.content, json.dumps(entry.headers), entry.stored_at))
+                self.db.commit()
+        return entry
+
+    def touch(self, key: str, entry: CacheEntry) -> CacheEntry:
+        """Restart the TTL of an entry after the server confirmed it is still valid."""
+        return self.store(key, entry.content, entry.headers)
+
+    def hit(self, key: str, entry: CacheEntry) -> CacheEntry:
+        """Count a 304 Not Modified for a cached entry, and restart its TTL."""
+        with self.lock:
+            self.hits += 1
+        return self.touch(key, entry)
+
+    def miss(self, key: str, content: bytes, headers) -> CacheEntry:
+        """Count a new (or changed) response, and cache it."""
+        with self.lock:
+            self.misses += 1
+        return self.store(key, content, headers)
+
+    def invalidate(self, prefix: str = ''):
+        """Drop entries whose key starts with `prefix` (all entries by default)."""
+        with self.lock:
+            for key in [k for k in self.entries if k.startswith(prefix)]:
+                self.size -= len(self.entries.pop(key).content)
+            if self.db != None:
+                self.db.execute("DELETE FROM response_cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+                self.db.commit()
+
+    def _put(self, key: str, entry: CacheEntry):
+        old = self.entries.pop(key, None)
+        if old != None:
+            self.size -= len(old.content)
+        if len(entry.content) > self.max_bytes:
+            return  # (still in the file, if we have one)
+        self.entries[key] = entry
+        self.size += len(entry.content)
+        while self.size > self.max_bytes:
+            self.size -= len(self.entries.popitem(last=False)[1].content)
+
+    def _delete(self, key: str):
+        old = self.entries.pop(key, None)
+        if old != None:
+            self.size -= len(old.content)
+        if self.db != None:
+            self.db.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+            self.db.commit()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f'ResponseCache({len(self)} entries, {self.size}/{self.max_bytes} bytes, {self.hits} hits, {self.misses} misses)'
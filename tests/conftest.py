@@ -0,0 +1,102 @@
+import importlib
+import os
+from pathlib import Path
+import sys
+import types
+
+import pytest
+from flask import Flask, g
+
+from puffin.db import database
+
+# database tests run on SQLite, and also on PostgreSQL if a DSN is given, e.g.
+# PUFFIN_TEST_POSTGRESQL=postgresql+psycopg2://puffin@/puffin_test (the database is wiped!)
+POSTGRESQL_DSN = os.environ.get('PUFFIN_TEST_POSTGRESQL')
+DATABASES = ['sqlite'] + (['postgresql'] if POSTGRESQL_DSN else [])
+
+
+@pytest.fixture(params=DATABASES)
+def app(request, tmp_path):
+    """A Flask app with an empty Puffin database (tables, views and audit triggers)."""
+    app = Flask('puffin_test')
+    if request.param == 'postgresql':
+        app.config['SQLALCHEMY_DATABASE_URI'] = POSTGRESQL_DSN
+    else:
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path}/puffin.db'
+    database.configure(app)
+    from puffin.db import auth_model, model_tables, model_util, model_views
+    if request.param == 'postgresql':
+        with database.engine.begin() as conn:
+            conn.exec_driver_sql('DROP SCHEMA public CASCADE; CREATE SCHEMA public;')
+    database.Base.metadata.create_all(database.engine)
+    with app.app_context():
+        database.init(app)
+        yield app
+    database.db_scoped_session.remove()
+    database.engine.dispose()
+
+
+def import_app_module(name: str):
+    """Import a module of puffin.app without running the package's __init__ (which starts the whole web app)."""
+    if 'puffin.app' not in sys.modules:
+        package = types.ModuleType('puffin.app')
+        package.__path__ = [str(Path(__file__).parent.parent / 'puffin' / 'app')]
+        sys.modules['puffin.app'] = package
+    return importlib.import_module(f'puffin.app.{name}')
+
+
+@pytest.fixture
+def web_app(app):
+    """The app with the course views; requests are made as the user whose id is in the X-Test-User header."""
+    from flask_login import LoginManager
+    from puffin.db.model_tables import User
+    from puffin.util.errors import ErrorResponse
+    from puffin.util.json_provider import PuffinJSONProvider
+    view_courses = import_app_module('view_courses')
+    app.config['SECRET_KEY'] = 'test'
+    app.json = PuffinJSONProvider(app)
+    login_manager = LoginManager(app)
+
+    @login_manager.request_loader
+    def load_user(request):
+        user_id = request.headers.get('X-Test-User')
+        return database.db_session.get(User, int(user_id)) if user_id != None else None
+
+    @app.errorhandler(ErrorResponse)
+    def handle_error(e: ErrorResponse):
+        return app.json.response(e.to_dict()), e.status_code
+
+    @app.before_request
+    def new_request():
+        # the test client's requests share the fixture's app context, and with it flask.g
+        g.pop('_login_user', None)
+        view_courses.clear_request_caches()
+
+    view_courses.init(app, None)  # type: ignore
+    return app
+
+
+@pytest.fixture
+def client(web_app):
+    return web_app.test_client()
+
+
+@pytest.fixture
+def db(app):
+    return database.db_session
+
+
+@pytest.fixture
+def course(db):
+    from puffin.db.model_tables import Course
+    from puffin.db.model_util import new_id
+    course = Course(id=new_id(db, Course), external_id=1, name='INF100 26H', slug='inf100-26h')
+    db.add(course)
+    db.commit()
+    return course
+
+
+def canvas_rows(n, start=0, role='student'):
+    """Users as they come from CanvasCourse.get_users()."""
+    return [{'id': 1000 + i, 'sortable_name': f'Last{i}, First{i}', 'login_id': f'u{i}', 'email': f'u{i}@uib.no',
+             'avatar_url': None, 'role': role, 'locale': 'nb'} for i in range(start, start + n)]
@@ -0,0 +1,145 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import socket
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from puffin.util.apicalls import ApiConnection, LogEntry, RequestLog
+
+PAGES = 12
+PER_PAGE = 5
+
+
+class PagingServer(ThreadingHTTPServer):
+    """Serves `items` in PAGES pages, with numbered (Canvas style) or bookmark links."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), PagingHandler)
+        self.bookmarks = False
+        self.latency = 0.05
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests: list[tuple[float, int]] = []  # (time, page)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}/api/v1/'
+
+
+class PagingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: PagingServer
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        query = parse_qs(urlsplit(self.path).query)
+        page = query.get('page', ['1'])[0]
+        page = int(page.removeprefix('bookmark:'))
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+            self.server.requests.append((time.time(), page))
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.in_flight -= 1
+        body = json.dumps([{'id': (page - 1) * PER_PAGE + i} for i in range(PER_PAGE)]).encode()
+        base = f'{self.server.url}items?per_page={PER_PAGE}'
+        links = []
+        if page < PAGES:
+            links.append(f'<{base}&page={"bookmark:" if self.server.bookmarks else ""}{page + 1}>; rel="next"')
+            if not self.server.bookmarks:
+                links.append(f'<{base}&page={PAGES}>; rel="last"')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if links:
+            self.send_header('Link', ', '.join(links))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = PagingServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def conn(server):
+    conn = ApiConnection(server.url, 'token', prefetch_workers=8)
+    yield conn
+    conn.close()
+
+
+ALL_IDS = list(range(PAGES * PER_PAGE))
+
+
+@pytest.mark.parametrize('prefetch', [2, 3])
+def test_get_paginated_limits_requests_in_flight(server, conn, prefetch):
+    items = conn.maybe_get_paginated('items', prefetch=prefetch)
+    assert [item['id'] for item in items] == ALL_IDS
+    assert server.max_in_flight == prefetch
+
+
+def test_get_paginated_bookmarks(server, conn):
+    server.bookmarks = True
+    items = conn.maybe_get_paginated('items')
+    assert [item['id'] for item in items] == ALL_IDS
+    assert server.max_in_flight == 1
+
+
+def pages_requested(server):
+    with server.lock:
+        return sorted(page for (_, page) in server.requests)
+
+
+@pytest.mark.parametrize('bookmarks', [False, True])
+def test_iter_paginated_prefetches_while_consuming(server, conn, bookmarks):
+    server.bookmarks = bookmarks
+    ids = []
+    for item in conn.iter_paginated('items', prefetch=3):
+        if item['id'] == 0:
+            time.sleep(0.3)  # working on the first page
+            requested = pages_requested(server)
+        ids.append(item['id'])
+    assert ids == ALL_IDS
+    # the next page(s) were requested before we were done with the first one
+    assert requested == ([1, 2] if bookmarks else [1, 2, 3, 4])
+    assert server.max_in_flight <= 3
+
+
+def test_request_log_concurrent_record_and_read():
+    log = RequestLog(maxlen=50)
+    stop = threading.Event()
+
+    def writer():
+        while not stop.is_set():
+            log.record(LogEntry('GET x', 'GET', 'x', {}, {}, None))
+
+    writers = [threading.Thread(target=writer) for _ in range(4)]
+    for t in writers:
+        t.start()
+    try:
+        for _ in range(20000):
+            assert len(log.query(method='GET')) <= 50
+            list(log)
+    finally:
+        stop.set()
+        for t in writers:
+            t.join()
@@ -0,0 +1,111 @@
+import inspect
+import json
+
+import httpx
+import pytest
+
+from puffin.canvas import canvas
+from puffin.canvas.assignments import CanvasAssignment, CanvasSubmission
+from puffin.canvas.async_canvas import (AsyncCanvasAssignment, AsyncCanvasConnection, AsyncCanvasCourse,
+                                        AsyncCanvasGroup, AsyncCanvasGroupCategory, AsyncCanvasSubmission)
+from puffin.canvas.lib import CanvasConnection, CanvasObject
+from puffin.util.apicalls import ApiConnection, ObjectLikeDict
+
+from .test_canvas import raw_user
+
+PAIRS = [
+    (canvas.CanvasCourse, AsyncCanvasCourse),
+    (canvas.CanvasGroup, AsyncCanvasGroup),
+    (canvas.CanvasGroupCategory, AsyncCanvasGroupCategory),
+    (CanvasAssignment, AsyncCanvasAssignment),
+    (CanvasSubmission, AsyncCanvasSubmission),
+    (CanvasConnection, AsyncCanvasConnection),
+]
+# no requests, so the same on both sides (but returning async objects)
+STUB_METHODS = {'get_assignment', 'get_submission'}
+SYNC_ONLY = {'create_session', 'session', 'executor'}
+
+
+def public_methods(cls):
+    ignored = set(dir(ObjectLikeDict)) | {'create_params'}
+    return {name for name in dir(cls) if not name.startswith('_') and name not in ignored
+            and (callable(getattr(cls, name)) or isinstance(inspect.getattr_static(cls, name), property))}
+
+
+@pytest.mark.parametrize('sync_cls,async_cls', PAIRS, ids=lambda cls: cls.__name__)
+def test_async_classes_have_every_method(sync_cls, async_cls):
+    for name in public_methods(sync_cls) - SYNC_ONLY:
+        sync_method, async_method = getattr(sync_cls, name), getattr(async_cls, name, None)
+        assert async_method != None, name
+        if getattr(async_method, '__func__', async_method) is getattr(sync_method, '__func__', sync_method) \
+                or name in STUB_METHODS:
+            continue  # helpers that don't talk to Canvas are shared
+        if inspect.isgeneratorfunction(sync_method) or name.startswith('iter_'):
+            assert inspect.isasyncgenfunction(async_method), name
+        else:
+            assert inspect.iscoroutinefunction(async_method), name
+    # nothing is inherited from the synchronous classes
+    assert not issubclass(async_cls, (CanvasObject, ApiConnection))
+
+
+class CanvasStub:
+    """A paginated course user list with ETags; `requests` records (page, If-None-Match)."""
+
+    def __init__(self, users, per_page=2):
+        self.users = users
+        self.per_page = per_page
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        assert request.url.path == '/api/v1/courses/1/users'
+        page = int(request.url.params.get('page', 1))
+        self.requests.append((page, request.headers.get('If-None-Match')))
+        etag = f'"users-{page}"'
+        if request.headers.get('If-None-Match') == etag:
+            return httpx.Response(304, headers={'ETag': etag})
+        last = (len(self.users) + self.per_page - 1) // self.per_page
+        links = [f'<https://canvas.test/api/v1/courses/1/users?page={n}&per_page=200>; rel="{rel}"'
+                 for rel, n in [('next', page + 1), ('last', last)] if n <= last]
+        items = self.users[(page - 1) * self.per_page:page * self.per_page]
+        return httpx.Response(200, content=json.dumps(items).encode(),
+                              headers={'Content-Type': 'application/json', 'ETag': etag, 'Link': ', '.join(links)})
+
+
+class StubConnection(AsyncCanvasConnection):
+    def __init__(self, handler):
+        self.handler = handler
+        super().__init__('https://canvas.test/api/v1/', 'secret')
+
+    def create_client(self):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handler))
+
+
+def test_pagination_and_revalidation():
+    stub = CanvasStub([raw_user(i) for i in range(5)] + [raw_user(5, 'TeacherEnrollment')])
+    conn = StubConnection(stub)
+    course = AsyncCanvasCourse(conn, {'id': 1})
+    users = conn.run(course.get_users())
+    assert [(u['login_id'], u['role']) for u in users] == [(f'u{i}', 'student') for i in range(5)] + [('u5', 'teacher')]
+    assert sorted(stub.requests) == [(1, None), (2, None), (3, None)]
+
+    stub.requests.clear()
+    assert conn.run(course.get_users()) == users  # from the cache
+    assert sorted(stub.requests) == [(1, '"users-1"'), (2, '"users-2"'), (3, '"users-3"')]
+    assert conn.cache != None and conn.cache.hits == 3
+
+
+def test_iter_paginated_stops_early():
+    stub = CanvasStub([raw_user(i) for i in range(20)])
+
+    async def first_three(conn):
+        result = []
+        async for u in conn.iter_paginated('courses/1/users', prefetch=2):
+            result.append(u['login_id'])
+            if len(result) == 3:
+                break
+        return result
+
+    conn = StubConnection(stub)
+    assert conn.run(first_three(conn)) == ['u0', 'u1', 'u2']
+    # the first page, and no more than two pages ahead
+    assert len(stub.requests) <= 4
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+import os
+
+import pytest
+import sqlalchemy as sa
+
+from puffin.db import database
+from puffin.db.audit_archive import archive_audit_log, compact_audit_log, read_archive
+from puffin.db.model_tables import AuditLog, User
+from puffin.db.model_util import update_from_uib_bulk
+from puffin.maint import audit_log
+
+from .conftest import canvas_rows
+
+
+def log_entries(db):
+    return db.execute(sa.select(AuditLog.id, AuditLog.table_name, AuditLog.row_id).order_by(AuditLog.id)).all()
+
+
+def newest_per_object(entries):
+    return sorted({(table, row_id): id for (id, table, row_id) in entries}.values())
+
+
+def old_log(db, course):
+    """Inserts for the course and three users, two renames and a no-op update of one user and a change
+    to another, all from January 2020."""
+    users = [acc.user for acc in update_from_uib_bulk(db, canvas_rows(3), course)]
+    for name in ('Renamed', 'Renamed again'):
+        users[0].lastname = name
+        db.commit()
+    db.execute(sa.update(User).where(User.id == users[0].id).values(lastname=User.lastname))
+    users[1].email = 'new@uib.no'
+    db.execute(sa.update(AuditLog).values(timestamp=datetime(2020, 1, 15)))
+    db.commit()
+    return log_entries(db)
+
+
+def test_dry_run_deletes_nothing(db, course, tmp_path):
+    entries = old_log(db, course)
+    archive_dir = str(tmp_path / 'archive')
+    assert compact_audit_log(db, dry_run=True) == 1
+    assert archive_audit_log(db, datetime.now(timezone.utc), archive_dir, dry_run=True) \
+        == len(entries) - len(newest_per_object(entries))
+    assert log_entries(db) == entries
+    assert not os.path.exists(archive_dir)
+
+
+def test_archive_keeps_newest_entry_per_object(db, course, tmp_path):
+    entries = old_log(db, course)
+    archive_dir = str(tmp_path / 'archive')
+    kept = newest_per_object(entries)
+    assert len(kept) == 1 + 3 * 3  # the course; users, accounts and enrollments
+    assert archive_audit_log(db, datetime.now(timezone.utc), archive_dir, batch_size=3) == len(entries) - len(kept)
+    assert [id for (id, _, _) in log_entries(db)] == kept
+    assert [e['id'] for e in read_archive(archive_dir, '2020-01')] == [id for (id, _, _) in entries if id not in kept]
+    assert archive_audit_log(db, datetime.now(timezone.utc), archive_dir) == 0
+
+
+def test_archive_cutoff_in_database_time(db, course, tmp_path):
+    if db.get_bind().dialect.name == 'postgresql':
+        # the triggers store local time; somewhere well behind UTC, naive UTC would look like the future
+        db.execute(sa.text("SET TIME ZONE 'Pacific/Pago_Pago'"))
+    user = update_from_uib_bulk(db, canvas_rows(1), course)[0].user
+    user.lastname = 'Renamed'
+    db.commit()
+    now = datetime.now(timezone.utc)
+    archive_dir = str(tmp_path / 'archive')
+    assert archive_audit_log(db, now - timedelta(hours=1), archive_dir, dry_run=True) == 0
+    assert archive_audit_log(db, (now - timedelta(hours=1)).replace(tzinfo=None), archive_dir, dry_run=True) == 0
+    assert archive_audit_log(db, now + timedelta(minutes=1), archive_dir, dry_run=True) == 1
+
+
+def test_maintenance_command(app, db, course, tmp_path, capsys):
+    entries = old_log(db, course)
+    archive_dir = str(tmp_path / 'archive')
+    archived = len(entries) - len(newest_per_object(entries)) - 1  # the no-op update is compacted first
+    args = ['--compact', '--archive', '--days', '30', '--archive-dir', archive_dir]
+
+    audit_log.main(args + ['--dry-run', '--vacuum'], app)
+    out = capsys.readouterr().out
+    assert 'Found 1 no-op updates' in out and f'Found {archived + 1} entries' in out
+    assert log_entries(db) == entries
+
+    audit_log.main(args + ['--vacuum'], app)
+    out = capsys.readouterr().out
+    assert 'Deleted 1 no-op updates' in out and f'Archived {archived} entries' in out
+    assert len(log_entries(db)) == len(entries) - archived - 1
+    assert len(list(read_archive(archive_dir))) == archived
+    if database.engine.dialect.name == 'sqlite':
+        assert db.execute(sa.text('PRAGMA freelist_count')).scalar() == 0
+
+    with pytest.raises(SystemExit):
+        audit_log.main(['--archive'], app)  # no archive directory
+    assert '--archive needs --archive-dir' in capsys.readouterr().err
@@ -0,0 +1,55 @@
+import csv
+from types import SimpleNamespace
+
+from flask import Flask
+import pytest
+
+from puffin.canvas.canvas import CanvasCourse
+
+
+def raw_user(i, type='StudentEnrollment'):
+    return {'id': 1000 + i, 'name': f'First{i} Last{i}', 'sortable_name': f'Last{i}, First{i}', 'login_id': f'u{i}',
+            'email': f'u{i}@uib.no', 'enrollments': [{'enrollment_state': 'active', 'type': type, 'role': type}]}
+
+
+def fake_course(users):
+    return CanvasCourse(SimpleNamespace(iter_paginated=lambda *args: iter(users)), {'id': 1})
+
+
+def sync_csv(tmp_path):
+    with open(tmp_path / 'last_canvas_sync.csv') as f:
+        return [row['login_id'] for row in csv.DictReader(f)]
+
+
+@pytest.fixture
+def app_path(tmp_path):
+    app = Flask('puffin_test')
+    app.config['APP_PATH'] = str(tmp_path)
+    with app.app_context():
+        yield tmp_path
+
+
+def test_concurrent_syncs_write_whole_files(app_path):
+    # big enough that the rows don't all sit in the file buffer until the end
+    first = fake_course([raw_user(i) for i in range(200)]).iter_users()
+    second = fake_course([raw_user(i) for i in range(1000, 1300)]).iter_users()
+    # interleaved, as two requests in different threads would be
+    for _ in range(200):
+        next(first), next(second)
+    assert len(list(second)) == 100
+    assert next(first, None) == None  # finishes last, with fewer rows
+    assert sync_csv(app_path) == [f'u{i}' for i in range(200)]
+    assert [p.name for p in app_path.iterdir()] == ['last_canvas_sync.csv']
+
+
+def test_aborted_sync_keeps_last_file(app_path):
+    assert len(fake_course([raw_user(i) for i in range(3)]).get_users()) == 3
+    users = fake_course([raw_user(i) for i in range(3, 6)]).iter_users()
+    next(users)
+    users.close()
+    assert sync_csv(app_path) == ['u0', 'u1', 'u2']
+    assert [p.name for p in app_path.iterdir()] == ['last_canvas_sync.csv']
+
+
+def test_sync_without_app_path():
+    assert [u['role'] for u in fake_course([raw_user(0, 'TaEnrollment')]).iter_users()] == ['ta']
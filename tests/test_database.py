@@ -0,0 +1,30 @@
+import pytest
+import sqlalchemy as sa
+
+from puffin.db import database
+from puffin.db.model_tables import Course, Group
+from puffin.db.model_util import new_id
+
+
+def test_begin_write_after_reading(db, course):
+    if db.get_bind().dialect.name != 'sqlite':
+        pytest.skip('SQLite only')
+    db.expire_all()
+    assert course.name == 'INF100 26H'  # a read transaction
+    # someone else writes while we're working
+    with database.engine.begin() as conn:
+        conn.execute(sa.update(Course).where(Course.id == course.id).values(expiry_date=sa.func.current_timestamp()))
+    database.begin_write(db)
+    assert 'name' in course.__dict__  # not expired
+    # a DEFERRED read transaction couldn't write now ("database is locked")
+    course.name = 'INF100 26H (new)'
+    db.commit()
+    assert db.execute(sa.select(Course.name)).scalar() == 'INF100 26H (new)'
+
+
+def test_begin_write_keeps_written_transaction(db, course):
+    db.add(Group(id=new_id(db, Group), kind='team', course_id=course.id, name='Team 1', slug='team-1'))
+    db.flush()
+    database.begin_write(db)
+    db.rollback()
+    assert db.execute(sa.select(sa.func.count()).select_from(Group)).scalar() == 0
@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from types import SimpleNamespace
+
+from puffin.gitlab.directory import UserDirectory
+
+
+def gitlab_user(id, username):
+    return SimpleNamespace(id=id, username=username, name=username.title(), state='active')
+
+
+class FakeGitlab:
+    """Lists `users`; each listing waits for `release` to be set."""
+
+    def __init__(self, users):
+        self.users = SimpleNamespace(list=self.list)
+        self.all_users = users
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+
+    def list(self, **kwargs):
+        self.calls.append(kwargs)
+        self.started.set()
+        assert self.release.wait(5)
+        yield from self.all_users
+
+
+def test_lookups_during_refresh(tmp_path):
+    directory = UserDirectory(path=str(tmp_path / 'users.json'))
+    directory.put([gitlab_user(1, 'alice')])
+    gl = FakeGitlab([gitlab_user(1, 'alice'), gitlab_user(2, 'bob')])
+    with ThreadPoolExecutor(2) as pool:
+        refresh = pool.submit(directory.refresh, gl)
+        assert gl.started.wait(5)
+        # the directory isn't locked while the users are fetched
+        assert pool.submit(directory.find_username, 'Alice').result(1) == [directory.get(1)]
+        assert directory.get(2) == None
+        # and only one thread fetches at a time
+        assert directory.refresh(gl, full=True) == 0
+        gl.release.set()
+        assert refresh.result(5) == 2
+    assert len(gl.calls) == 1
+    assert directory.find_username('bob')[0].id == 2
+    assert UserDirectory(path=directory.path).find_username('bob')[0].id == 2  # saved to the file
+
+
+def test_incremental_refresh(tmp_path):
+    directory = UserDirectory(refresh_interval=0)
+    gl = FakeGitlab([gitlab_user(1, 'alice'), gitlab_user(2, 'bob')])
+    gl.release.set()
+    assert directory.refresh(gl) == 2
+    gl.all_users = [gitlab_user(2, 'robert')]
+    assert directory.refresh(gl) == 1
+    assert 'updated_after' in gl.calls[-1]
+    assert directory.find_username('bob') == []
+    assert [u.id for u in directory.find_username('robert')] == [2]
+    assert directory.get(1).username == 'alice'
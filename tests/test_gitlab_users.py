@@ -0,0 +1,101 @@
+from types import SimpleNamespace
+
+import sqlalchemy as sa
+
+from puffin.db import database
+from puffin.db.model_tables import Account, User
+from puffin.db.model_util import new_id, update_from_uib_bulk
+from puffin.gitlab.directory import UserDirectory
+from puffin.gitlab.users import GitlabConnection, bot_user_re
+
+from .conftest import canvas_rows
+from .test_model_tables import StatementCounter
+
+
+class Member(SimpleNamespace):
+    """A GitLab member list entry."""
+
+    def __init__(self, id, username):
+        super().__init__(id=id, username=username, name=username.title(), state='active')
+
+    def get_id(self):
+        return self.id
+
+
+class FakeGitlabConnection(GitlabConnection):
+    """Member lists by project name, without talking to GitLab; direct members are those with an even id."""
+
+    def __init__(self, projects: dict[str, list[Member]]):
+        super().__init__('https://gitlab.test/', 'secret')
+        self.projects = projects
+
+    def get_project_or_group(self, name_or_id):
+        members = self.projects[name_or_id]
+        return SimpleNamespace(members=SimpleNamespace(list=lambda get_all: [m for m in members if m.id % 2 == 0]),
+                               members_all=SimpleNamespace(list=lambda get_all: members))
+
+
+def old_project_members_incl_unmapped(session, members):
+    """The per-member lookup that projects_members_incl_unmapped() replaced."""
+    result = [(session.execute(sa.select(User).where(Account.user_id == User.id, Account.provider_name == 'gitlab',
+                                                     Account.external_id == u.get_id())).scalar_one_or_none(), u)
+              for u in members]
+    return ([pu for (pu, gu) in result if pu],
+            [gu.username for (pu, gu) in result if not pu and not bot_user_re.match(gu.username)])
+
+
+def add_gitlab_account(db, user, external_id, username):
+    db.add(Account(id=new_id(db, Account), provider_name='gitlab', user_id=user.id, external_id=external_id,
+                   username=username, fullname=f'{user.firstname} {user.lastname}'))
+
+
+def test_member_mapping_matches_per_member_lookup(db, course):
+    users = [acc.user for acc in update_from_uib_bulk(db, canvas_rows(5), course)]
+    add_gitlab_account(db, users[0], 1, 'first0')
+    add_gitlab_account(db, users[1], 2, 'first1')  # renamed on GitLab since
+    add_gitlab_account(db, users[2], 3, 'project_7_bot_abc123')  # a bot that somehow got mapped
+    db.commit()
+    projects = {
+        'inf100/a': [Member(id=2, username='u1-renamed'), Member(id=10, username='stranger'),
+                     Member(id=1, username='first0'), Member(id=11, username='project_7_bot_f00')],
+        'inf100/b': [Member(id=3, username='project_7_bot_abc123'), Member(id=12, username='group_8_bot_x'),
+                     Member(id=2, username='u1-renamed')],
+        'inf100/empty': [],
+    }
+    gitlab = FakeGitlabConnection(projects)
+    result = gitlab.projects_members_incl_unmapped(db, list(projects))
+    assert result == [old_project_members_incl_unmapped(db, members) for members in projects.values()]
+    assert result[0] == ([users[1], users[0]], ['stranger'])
+    assert gitlab.project_members_incl_unmapped(db, 'inf100/b') == result[1]
+    assert gitlab.map_gitlab_user(db, Member(2, 'first1')) == users[1]
+    assert gitlab.map_gitlab_user(db, Member(10, 'stranger')) == None
+
+
+def test_list_members(tmp_path):
+    members = [Member(id=1, username='alice'), Member(id=2, username='project_7_bot_f00'), Member(id=4, username='bob')]
+    gitlab = FakeGitlabConnection({'inf100/a': members})
+    gitlab.directory = UserDirectory(path=str(tmp_path / 'users.json'))
+    assert gitlab.list_members('inf100/a') == [members[0], members[2]]
+    assert gitlab.list_members('inf100/a', indirect=False) == [members[2]]
+    assert gitlab.list_members('inf100/a', bots=True) == members
+    # seen members go into the user directory, bots too
+    assert [gitlab.directory.get(m.id).username for m in members] == ['alice', 'project_7_bot_f00', 'bob']
+
+
+def test_members_of_many_projects_are_mapped_with_one_query(db, course):
+    users = [acc.user for acc in update_from_uib_bulk(db, canvas_rows(20), course)]
+    for i, user in enumerate(users):
+        add_gitlab_account(db, user, 100 + i, f'first{i}')
+    db.commit()
+    users = db.execute(sa.select(User).order_by(User.id)).scalars().all()
+    # projects of 3 members each, in reverse order; every third member isn't a Puffin user
+    projects = {f'inf100/team-{t}': [Member(id=100 + i if i % 3 else 500 + i, username=f'first{i}')
+                                     for i in range(t * 3 + 2, t * 3 - 1, -1)]
+                for t in range(6)}
+    gitlab = FakeGitlabConnection(projects)
+    with StatementCounter(database.engine) as counter:
+        result = gitlab.projects_members_incl_unmapped(db, list(projects))
+    assert counter.count == 1
+    assert result[0] == ([users[2], users[1]], ['first0'])
+    assert result == [old_project_members_incl_unmapped(db, members) for members in projects.values()]
+    assert gitlab.projects_members_incl_unmapped(db, list(projects), indirect=False)[1] == ([users[4]], [])
@@ -0,0 +1,58 @@
+import importlib.util
+from pathlib import Path
+
+import sqlalchemy as sa
+
+from puffin.db.model_tables import Group, JoinModel, Membership
+from puffin.db.model_util import new_id, update_from_uib_bulk
+
+from .conftest import canvas_rows
+
+# importing the puffin.app package starts the web app (which needs its secrets), so load the module on its own
+_spec = importlib.util.spec_from_file_location(
+    'puffin_group_sync', Path(__file__).parent.parent / 'puffin' / 'app' / 'group_sync.py')
+group_sync = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(group_sync)  # type: ignore
+
+
+class FakeGroupSync(group_sync.GroupSync):
+    """Canvas group members by the group's external_id; an exception is raised instead of returned."""
+
+    members: dict[str, list | Exception] = {}
+
+    def fetch(self, group, source):
+        result = self.members[group.external_id]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def make_group(db, course, external_id, join_source):
+    group = Group(id=new_id(db, Group), kind='group', course_id=course.id, name=f'Gruppe {external_id}',
+                  slug=f'gruppe-{external_id}', external_id=external_id, join_source=join_source)
+    db.add(group)
+    return group
+
+
+def members(db, group):
+    return dict(db.execute(sa.select(Membership.user_id, Membership.join_model)
+                           .where(Membership.group_id == group.id)).all())
+
+
+def test_failed_sources_dont_stop_the_sync(db, course):
+    accs = update_from_uib_bulk(db, canvas_rows(4), course)
+    uids = [acc.user_id for acc in accs]
+    ok, failing, broken = [make_group(db, course, str(i), f'canvas_group({i})') for i in (1, 2, 3)]
+    broken.join_source = 'canvas_group('
+    db.add(Membership(id=new_id(db, Membership), group_id=failing.id, user_id=uids[2], role='student',
+                      join_model=JoinModel.AUTO))
+    db.commit()
+
+    sync = FakeGroupSync(db, course)
+    sync.members = {'1': [{'user_id': 1000}, {'user_id': 1001}], '2': ConnectionError('Canvas is down'), '3': []}
+    sync.sync([ok, failing, broken])
+    assert members(db, ok) == {uids[0]: JoinModel.AUTO, uids[1]: JoinModel.AUTO}
+    # not removed just because we couldn't get the member list
+    assert members(db, failing) == {uids[2]: JoinModel.AUTO}
+    assert sorted(sync.errors) == sorted([failing.id, broken.id])
+    assert 'Canvas is down' in sync.errors[failing.id][0]
@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+import random
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from puffin.db import database
+from puffin.db.model_tables import Group, Id, Membership
+from puffin.db.model_util import IdAllocator, id_allocator
+
+THREADS = 8
+ROUNDS = 40
+
+
+def allocate(allocator: IdAllocator, seed: int) -> list[tuple[int, str]]:
+    """Allocate ids in many small transactions; returns (id, type) of the committed ones."""
+    rnd = random.Random(seed)
+    committed = []
+    with Session(database.engine) as session:
+        for _ in range(ROUNDS):
+            cls = rnd.choice([Group, Membership])
+            ids = allocator.allocate(session, cls, rnd.randint(1, 30))
+            if rnd.random() < 0.2:
+                session.rollback()
+            else:
+                session.commit()
+                committed.extend((id, cls.__tablename__) for id in ids)
+    return committed
+
+
+@pytest.mark.parametrize('shared', [True, False], ids=['one process', 'many processes'])
+def test_concurrent_allocation_gives_unique_ids(db, shared):
+    # with shared=False, each thread has its own allocator, like separate worker processes
+    allocators = [id_allocator if shared else IdAllocator(block_size=10) for _ in range(THREADS)]
+    try:
+        with ThreadPoolExecutor(THREADS) as pool:
+            results = list(pool.map(allocate, allocators, range(THREADS)))
+    finally:
+        for allocator in allocators:
+            if allocator is not id_allocator:
+                allocator.close()
+    allocated = [a for result in results for a in result]
+    assert len(allocated) == len({id for (id, _) in allocated})
+    # every id handed out was reserved in the id table, with the right type
+    ids = [id for (id, _) in allocated]
+    rows = db.execute(sa.select(Id.id, Id.type).where(Id.id.in_(ids))).all()
+    assert dict(rows) == dict(allocated)
+    if not shared:
+        # leftovers are kept by the allocator that reserved them
+        assert all(allocator.pools for allocator in allocators)
+
+
+def test_ids_stay_with_their_database(tmp_path):
+    engines = [sa.create_engine(f'sqlite:///{tmp_path}/{name}.db') for name in ('a', 'b')]
+    allocator = IdAllocator(block_size=10)
+    try:
+        for engine in engines:
+            Id.__table__.create(engine)
+        with Session(engines[0]) as session:
+            session.execute(sa.insert(Id), [{'type': 'other'}] * 100)
+            assert allocator.allocate(session, Group, 2) == [101, 102]
+            session.commit()
+        with Session(engines[1]) as session:
+            # not the ids left over from a.db
+            assert allocator.allocate(session, Group, 2) == [1, 2]
+            session.commit()
+        with Session(engines[0]) as session:
+            assert allocator.allocate(session, Group, 2) == [103, 104]
+            # another allocator doesn't get our reserved ids
+            other = IdAllocator(block_size=10)
+            try:
+                assert other.allocate(session, Group, 1) == [111]
+            finally:
+                other.close()
+            session.commit()
+        assert [list(allocator.pools[engine]['group']) for engine in engines] == [list(range(105, 111)), list(range(3, 11))]
+    finally:
+        allocator.close()
+        for engine in engines:
+            engine.dispose()
@@ -0,0 +1,72 @@
+from datetime import date, datetime, timedelta, timezone
+import enum
+import json
+
+from flask import Flask
+import pytest
+
+from puffin.util import json_provider
+from puffin.util.json_provider import PuffinJSONProvider
+from puffin.util.util import DateEncoder
+
+
+class Color(enum.Enum):
+    RED = 'red'
+    BLUE = 2
+
+
+DATA = {
+    'utc': datetime(2026, 10, 18, 12, 30, 5, 123456, tzinfo=timezone.utc),
+    'oslo': datetime(2026, 10, 18, 14, 30, tzinfo=timezone(timedelta(hours=2))),
+    'naive': datetime(2026, 10, 18, 12, 30),
+    'day': date(2026, 10, 18),
+    'colors': [Color.RED, Color.BLUE],
+    'text': 'blåbær',
+    'nested': {'n': None, 'f': 1.5, 'b': True},
+}
+EXPECTED = {
+    'utc': '2026-10-18T12:30:05.123456Z',
+    'oslo': '2026-10-18T14:30:00+02:00',
+    'naive': '2026-10-18T12:30:00',
+    'day': '2026-10-18',
+    'colors': ['red', 2],
+    'text': 'blåbær',
+    'nested': {'n': None, 'f': 1.5, 'b': True},
+}
+
+
+@pytest.fixture(params=['orjson', 'json', 'no orjson'])
+def provider(request, monkeypatch):
+    app = Flask('puffin_test')
+    if request.param == 'json':
+        app.config['JSON_USE_ORJSON'] = False
+    elif request.param == 'no orjson':
+        monkeypatch.setattr(json_provider, 'orjson', None)
+    app.json = PuffinJSONProvider(app)
+    with app.app_context():
+        yield app.json
+    assert app.json.use_orjson == (request.param == 'orjson')
+
+
+def test_round_trip(provider):
+    assert provider.loads(provider.dumps(DATA)) == EXPECTED
+    assert provider.loads(json_provider.dumps(DATA)) == EXPECTED
+    # dates are encoded as DateEncoder does
+    dates = {k: v for k, v in DATA.items() if k in ('utc', 'oslo', 'naive', 'day')}
+    assert provider.loads(provider.dumps(dates)) == json.loads(json.dumps(dates, cls=DateEncoder))
+
+
+def test_response(provider):
+    response = provider.response(DATA)
+    assert response.mimetype == 'application/json'
+    assert response.get_data().endswith(b'\n')
+    assert json.loads(response.get_data()) == EXPECTED
+    assert provider.response(a=1, b=Color.RED).json == {'a': 1, 'b': 'red'}
+
+
+def test_values_orjson_cant_encode(provider):
+    big = 2**70
+    assert provider.loads(provider.dumps({'big': big})) == {'big': big}
+    assert json.loads(provider.response({'big': big}).get_data()) == {'big': big}
+    with pytest.raises(json.JSONDecodeError):
+        provider.loads('{"not json"')
@@ -0,0 +1,91 @@
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from puffin.db import database
+from puffin.db.model_tables import Course, Enrollment, Group, LastSync, Membership, User
+from puffin.db.model_util import new_id, new_ids, sync_batch, update_from_uib_bulk
+
+from .conftest import canvas_rows
+
+USERS = 500
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        sa.event.listen(self.engine, 'before_cursor_execute', self)
+        return self
+
+    def __exit__(self, *exc):
+        sa.event.remove(self.engine, 'before_cursor_execute', self)
+
+
+def test_details_profile_statement_count(db, course):
+    update_from_uib_bulk(db, canvas_rows(USERS), course)
+    teams = [Group(id=id, kind='team', course=course, name=f'Team {id}', slug=f'team-{id}')
+             for id in new_ids(db, Group, 10)]
+    db.add_all(teams)
+    db.flush()
+    user_ids = db.execute(sa.select(User.id)).scalars().all()
+    db.execute(sa.insert(Membership), [{'id': id, 'user_id': uid, 'group_id': teams[i % 10].id, 'role': 'student'}
+                                       for i, (id, uid) in enumerate(zip(new_ids(db, Membership, USERS), user_ids))])
+    db.commit()
+    team = (teams[0].id, teams[0].slug)
+    course_id = course.id
+    db.expunge_all()
+    course = db.get(Course, course_id)
+
+    with StatementCounter(database.engine) as counter:
+        users = db.execute(sa.select(User).join(User.enrollments).where(Enrollment.course_id == course.id)
+                           .options(*User.load_options('details'))).scalars().all()
+        details = [(u.enrollment(course).role, u.account('canvas').username,
+                    [m.group.slug for m in u.membership(course, 'team')], u.is_member(team[0]))
+                   for u in users]
+    assert len(details) == USERS
+    assert details[0] == ('student', 'u0', [team[1]], True)
+    # users, accounts, enrollments (with courses) and memberships (with groups) – not one per user
+    assert counter.count == 4
+
+
+def test_enrollment_lookup_of_pending_enrollment(db, course):
+    accs = update_from_uib_bulk(db, canvas_rows(1), course)
+    user = accs[0].user
+    other = Course(id=new_id(db, Course), external_id=2, name='INF101 26H', slug='inf101-26h')
+    db.add(other)
+    db.commit()
+    with sync_batch(db):
+        assert user.enrollment(other) == None
+        # course_id isn't set until the enrollment is flushed
+        en = Enrollment(id=new_id(db, Enrollment), user=user, course=other, role='ta')
+        db.add(en)
+        assert user.enrollment(other) is en
+        assert user.enrollment(other.id) is en
+        assert user.enrollment(course).role == 'student'
+
+
+def sync_times(db):
+    return {ls.obj_id: (ls.sync_incoming, ls.sync_outgoing) for ls in db.execute(sa.select(LastSync)).scalars()}
+
+
+def test_last_sync_upserts(db, course):
+    groups = [Group(id=new_id(db, Group), kind='team', course_id=course.id, name=f'Team {i}', slug=f'team-{i}')
+              for i in range(4)]
+    db.add_all(groups)
+    db.flush()
+    never_synced = groups.pop()
+    t1, t2, t3 = datetime(2026, 10, 1), datetime(2026, 10, 2), datetime(2026, 10, 3)
+    LastSync.set_sync(db, groups[0], sync_incoming=t1)
+    LastSync.set_sync(db, groups[0], sync_outgoing=t2)  # keeps sync_incoming
+    LastSync.set_sync_many(db, groups[1:], sync_incoming=t1)
+    LastSync.set_sync_many(db, groups, sync_incoming=t3)
+    LastSync.set_sync_many(db, [], sync_incoming=t3)
+    LastSync.set_sync_many(db, groups + [never_synced])  # nothing to set, no rows added
+    db.commit()
+    assert sync_times(db) == {groups[0].id: (t3, t2), groups[1].id: (t3, None), groups[2].id: (t3, None)}
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta, timezone
+
+import sqlalchemy as sa
+
+from puffin.db.model_tables import Account, AuditLog, Enrollment, Group, LogType, User
+from puffin.db.model_util import course_audit_log, new_id, update_from_uib_bulk
+
+from .conftest import canvas_rows
+
+
+def count(db, cls, *where):
+    return db.execute(sa.select(sa.func.count()).select_from(cls).where(*where)).scalar()
+
+
+def test_update_from_uib_bulk(db, course):
+    rows = canvas_rows(30)
+    accs = update_from_uib_bulk(db, rows, course, batch_size=7)
+    assert [acc.username for acc in accs] == [row['login_id'] for row in rows]
+    assert count(db, User) == 30
+    assert count(db, Enrollment, Enrollment.course_id == course.id) == 30
+
+    rows[3]['email'] = 'new@uib.no'
+    rows[4]['role'] = 'ta'
+    changes = []
+    update_from_uib_bulk(db, rows, course, changes=changes, batch_size=7)
+    assert count(db, User) == 30
+    assert db.execute(sa.select(User.email).where(User.key == 'canvas#1003')).scalar() == 'new@uib.no'
+    assert db.execute(sa.select(Enrollment.role).where(Enrollment.user_id == accs[4].user_id)).scalar() == 'ta'
+    assert sorted(t for (t, _) in changes) == ['account', 'enrollment', 'user']
+
+
+def test_update_from_uib_bulk_skips_rows_without_login_id(db, course):
+    rows = canvas_rows(5)
+    del rows[1]['login_id']
+    rows[3]['login_id'] = None
+    skipped = []
+    accs = update_from_uib_bulk(db, rows, course, skipped=skipped)
+    assert [acc.username for acc in accs] == ['u0', 'u2', 'u4']
+    assert [row['id'] for row in skipped] == [1001, 1003]
+    # not merged into one account without a username
+    assert count(db, Account, Account.provider_name == 'canvas') == 3
+    assert count(db, Account, Account.username == None) == 0
+
+
+def test_audit_triggers(db, course):
+    group = Group(id=new_id(db, Group), kind='team', course_id=course.id, name='Team 1', slug='team-1')
+    db.add(group)
+    db.commit()
+    group.name = 'Team One'
+    db.commit()
+    db.delete(group)
+    db.commit()
+    log = db.execute(sa.select(AuditLog).where(AuditLog.table_name == 'group').order_by(AuditLog.id)).scalars().all()
+    assert [(l.type, l.row_id) for l in log] == [(LogType.INSERT, group.id), (LogType.UPDATE, group.id), (LogType.DELETE, group.id)]
+    assert log[0].old_data == None and log[0].new_data['name'] == 'Team 1'
+    assert (log[1].old_data['name'], log[1].new_data['name']) == ('Team 1', 'Team One')
+    assert log[2].old_data['slug'] == 'team-1' and log[2].new_data == None
+    # the course was logged first, with a lower id
+    assert db.execute(sa.select(sa.func.min(AuditLog.id)).where(AuditLog.table_name == 'course')).scalar() < log[0].id
+
+
+def test_course_audit_log_tables(db, course):
+    update_from_uib_bulk(db, canvas_rows(3), course)
+    other = update_from_uib_bulk(db, canvas_rows(2, start=3), None)
+    assert {l.table_name for l in course_audit_log(db, course)} == {'course', 'enrollment'}
+    assert len(course_audit_log(db, course, tables=['enrollment'])) == 3
+    # not the whole audit log, which also has the other users and accounts
+    assert other and course_audit_log(db, course, tables=['user']) == []
+    assert course_audit_log(db, course, tables=[]) == []
+
+
+def test_course_audit_log_after(db, course):
+    if db.get_bind().dialect.name == 'postgresql':
+        db.execute(sa.text("SET TIME ZONE 'Pacific/Pago_Pago'"))  # see test_archive_cutoff_in_database_time
+    update_from_uib_bulk(db, canvas_rows(2), course)
+    now = datetime.now(timezone.utc)
+    assert len(course_audit_log(db, course, tables=['enrollment'], after=now - timedelta(hours=1))) == 2
+    assert len(course_audit_log(db, course, tables=['enrollment'], after=(now - timedelta(hours=1)).replace(tzinfo=None))) == 2
+    assert course_audit_log(db, course, tables=['enrollment'], after=now + timedelta(minutes=1)) == []
@@ -0,0 +1,78 @@
+import re
+
+import pytest
+import sqlalchemy as sa
+
+from puffin.db.model_tables import Account, AuditLog, Course, Enrollment, Group, JoinModel, LastSync, Membership, User
+
+COURSES = 20
+USERS = 2000
+
+# the hot lookups, as the views and sync code write them, and the index each one should use
+QUERIES = {
+    'course users': (
+        'ix_enrollment_course_id_user_id',
+        sa.select(Account.user_id, Account.fullname, Enrollment).where(
+            Account.user_id == Enrollment.user_id, Account.provider_name == 'canvas',
+            Enrollment.course_id == 1, Enrollment.join_model != JoinModel.REMOVED)),
+    'group members': (
+        'ix_membership_group_id_user_id',
+        sa.select(Account.external_id).where(
+            Membership.group_id == 1, Membership.join_model != JoinModel.REMOVED,
+            Membership.user_id == User.id, Account.user_id == User.id, Account.provider_name == 'canvas')),
+    'course teams': (
+        'ix_group_course_id_kind',
+        sa.select(Group).where(Group.course_id == 1, Group.kind == 'team')),
+    'user account': (
+        'ix_account_user_id_provider_name',
+        sa.select(Account).where(Account.user_id == 1, Account.provider_name == 'gitlab')),
+    'account by username': (
+        'ix_account_provider_name_username',
+        sa.select(User).where(User.id == Account.user_id, Account.username == 'canvas1', Account.provider_name == 'canvas')),
+    'object history': (
+        'ix_audit_log_table_name_row_id',
+        sa.select(AuditLog).where(AuditLog.table_name == 'group', AuditLog.row_id == 1)),
+    'sync state by type': (
+        'ix_last_sync_obj_type_obj_id',
+        sa.select(LastSync).where(LastSync.obj_type == 'group')),
+}
+
+
+def populate(db):
+    """Fill in a database shaped like a real one, so the planner's statistics are realistic."""
+    db.execute(sa.insert(Course), [{'id': c, 'external_id': c, 'name': f'C{c}', 'slug': f'c{c}'}
+                                   for c in range(1, COURSES + 1)])
+    db.execute(sa.insert(User), [{'id': u, 'key': f'canvas#{u}', 'lastname': 'L', 'firstname': 'F',
+                                  'email': f'u{u}@uib.no'} for u in range(1, USERS + 1)])
+    db.execute(sa.insert(Account), [{'id': 2 * u + p, 'provider_name': provider, 'user_id': u, 'external_id': u,
+                                     'username': f'{provider}{u}', 'fullname': 'F L'}
+                                    for u in range(1, USERS + 1) for p, provider in enumerate(['canvas', 'gitlab'])])
+    # each user takes three courses, and is in a group in each
+    enrollments = [(u, 1 + (u + k * 7) % COURSES) for u in range(1, USERS + 1) for k in range(3)]
+    db.execute(sa.insert(Enrollment), [{'id': i, 'user_id': u, 'course_id': c, 'role': 'student'}
+                                       for i, (u, c) in enumerate(enrollments, 1)])
+    db.execute(sa.insert(Group), [{'id': g, 'kind': 'team' if g % 4 else 'section', 'course_id': 1 + g % COURSES,
+                                   'name': f'G{g}', 'slug': f'g{g}'} for g in range(1, 40 * COURSES + 1)])
+    db.execute(sa.insert(Membership), [{'id': i, 'user_id': u, 'group_id': 1 + (u + c * 13) % (40 * COURSES),
+                                        'role': 'student'} for i, (u, c) in enumerate(enrollments, 1)])
+    db.execute(sa.insert(LastSync), [{'obj_id': i, 'obj_type': t} for t in ['user', 'group', 'membership']
+                                     for i in range(1, 1000)])
+    db.commit()
+    db.execute(sa.text('ANALYZE'))
+
+
+def query_plan(db, stmt) -> list[str]:
+    sql = stmt.compile(dialect=db.get_bind().dialect, compile_kwargs={'literal_binds': True})
+    return [row[-1] for row in db.execute(sa.text(f'EXPLAIN QUERY PLAN {sql}')).all()]
+
+
+@pytest.mark.parametrize('name', QUERIES)
+def test_hot_lookups_use_indexes(db, name):
+    if db.get_bind().dialect.name != 'sqlite':
+        pytest.skip('EXPLAIN QUERY PLAN is SQLite only')
+    populate(db)
+    index, stmt = QUERIES[name]
+    plan = query_plan(db, stmt)
+    assert any(index in step for step in plan), plan
+    # every table is searched by index or primary key, never scanned
+    assert not [step for step in plan if re.match(r'SCAN (?!.*USING)', step)], plan
@@ -0,0 +1,109 @@
+import time
+
+import httpx
+import pytest
+
+from puffin.util.apicalls import RateLimiter
+from puffin.util.async_apicalls import AsyncApiConnection
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_requests_are_paid_from_the_quota(clock):
+    limiter = RateLimiter(capacity=700, refill_rate=10, reserve=100, max_concurrency=8, clock=clock)
+    assert limiter.reserve_slot() == 0
+    assert limiter.release(200, {'X-Rate-Limit-Remaining': '160', 'X-Request-Cost': '50'}) == False
+    assert limiter.remaining == 160
+    # one request at a time is always allowed; more only if the quota (above the reserve) pays for them
+    assert limiter.reserve_slot() == 0
+    assert limiter.reserve_slot() == pytest.approx(4.0)  # (cost 50 - 10 available) / 10 per second
+    clock.now += 4
+    assert limiter.reserve_slot() == 0
+    assert limiter.in_flight == 2
+
+
+def test_concurrency_is_limited(clock):
+    limiter = RateLimiter(max_concurrency=3, clock=clock)
+    assert [limiter.reserve_slot() for _ in range(3)] == [0, 0, 0]
+    assert limiter.reserve_slot() > 0
+    limiter.release(200)
+    assert limiter.reserve_slot() == 0
+
+
+def test_cost_is_averaged(clock):
+    limiter = RateLimiter(clock=clock)
+    limiter.reserve_slot()
+    limiter.release(200, {'X-Request-Cost': '100'})
+    assert limiter.cost == pytest.approx(60)
+
+
+@pytest.mark.parametrize('status,text', [(429, ''), (403, '403 Forbidden (Rate Limit Exceeded)')])
+def test_throttled_responses_back_off(clock, status, text):
+    limiter = RateLimiter(max_backoff=4, clock=clock)
+    delays = []
+    for _ in range(4):
+        limiter.reserve_slot()
+        assert limiter.release(status, {}, text) == True
+        delays.append(limiter.reserve_slot())
+        clock.now += delays[-1]
+    assert delays == [1, 2, 4, 4]
+    assert limiter.remaining == 0
+    # successes halve the backoff again
+    limiter.release(200)
+    assert limiter.backoff == 2
+
+
+def test_forbidden_is_not_throttled(clock):
+    limiter = RateLimiter(clock=clock)
+    limiter.reserve_slot()
+    assert limiter.release(403, {}, 'Forbidden') == False
+    assert limiter.reserve_slot() == 0
+
+
+def test_one_limiter_per_host():
+    try:
+        limiter = RateLimiter.for_host('canvas.limiter.test')
+        assert RateLimiter.for_host('canvas.limiter.test') is limiter
+        assert RateLimiter.for_host('other.limiter.test') is not limiter
+        conn = AsyncApiConnection('https://canvas.limiter.test/api/v1/', 'secret', rate_limit=True)
+        assert conn.limiter is limiter
+    finally:
+        RateLimiter.limiters.pop('canvas.limiter.test', None)
+        RateLimiter.limiters.pop('other.limiter.test', None)
+
+
+def test_throttled_request_is_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            return httpx.Response(403, text='403 Forbidden (Rate Limit Exceeded)')
+        return httpx.Response(200, json={'ok': True}, headers={'X-Rate-Limit-Remaining': '650'})
+
+    class Connection(AsyncApiConnection):
+        def create_client(self):
+            return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    # (refills fast, so we only wait for the backoff)
+    RateLimiter.limiters['throttled.limiter.test'] = limiter = RateLimiter(refill_rate=1000)
+    try:
+        conn = Connection('https://throttled.limiter.test/', 'secret', rate_limit=True)
+        started = time.monotonic()
+        assert conn.run(conn.get_single('courses/1')) == {'ok': True}
+        assert time.monotonic() - started >= 1  # the first backoff
+    finally:
+        del RateLimiter.limiters['throttled.limiter.test']
+    assert len(calls) == 2
+    assert limiter.in_flight == 0 and limiter.backoff == 1
@@ -0,0 +1,107 @@
+import json
+
+from flask import Flask
+import requests
+from requests.adapters import BaseAdapter
+
+from puffin.canvas.async_canvas import AsyncCanvasConnection
+from puffin.canvas.lib import CanvasConnection
+from puffin.util.apicalls import ApiConnection
+from puffin.util.response_cache import ResponseCache
+
+ETAG = {'ETag': '"v1"', 'Content-Type': 'application/json'}
+
+
+def test_lru_eviction_by_size():
+    cache = ResponseCache(max_bytes=100)
+    cache.store('a', b'a' * 40, ETAG)
+    cache.store('b', b'b' * 40, ETAG)
+    assert cache.get('a') != None  # now b is the least recently used
+    cache.store('c', b'c' * 40, ETAG)
+    assert cache.get('b') == None
+    assert [k for k in cache.entries] == ['a', 'c'] and cache.size == 80
+    cache.store('a', b'a' * 10, ETAG)  # replaced, not counted twice
+    assert cache.size == 50
+    cache.store('huge', b'h' * 101, ETAG)  # never fits
+    assert cache.get('huge') == None and cache.size == 50
+    cache.invalidate('c')
+    assert cache.size == 10 and len(cache) == 1
+
+
+def test_ttl(monkeypatch):
+    cache = ResponseCache(ttl=60)
+    cache.store('a', b'[]', ETAG)
+    now = cache.entries['a'].stored_at
+    monkeypatch.setattr('time.time', lambda: now + 61)
+    assert cache.get('a') == None and cache.size == 0
+
+
+def test_file_backend(tmp_path):
+    path = str(tmp_path / 'responses.sqlite')
+    first = ResponseCache(max_bytes=10, path=path)
+    second = ResponseCache(path=path)  # e.g. another worker process
+    first.store('a', b'[1, 2, 3]', {**ETAG, 'Link': '<x>; rel="next"', 'X-Other': 'dropped'})
+    first.store('b', b'[4, 5, 6]', ETAG)
+    assert 'a' not in first.entries
+    for cache in (first, second):
+        entry = cache.get('a')
+        assert entry != None and entry.content == b'[1, 2, 3]'
+        assert entry.headers == {'Content-Type': 'application/json', 'Link': '<x>; rel="next"', 'ETag': '"v1"'}
+    second.invalidate('a')
+    assert ResponseCache(path=path).get('a') == None
+    assert ResponseCache(path=path).get('b') != None
+
+
+class StubAdapter(BaseAdapter):
+    """Answers every GET with `body` and an ETag, or 304 if the client already has it."""
+
+    def __init__(self, body):
+        super().__init__()
+        self.body = body
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request.headers.get('If-None-Match'))
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        etag = f'"{self.body["name"]}"'
+        response.headers.update({'ETag': etag, 'Content-Type': 'application/json'})
+        if request.headers.get('If-None-Match') == etag:
+            response.status_code = 304
+            response._content = b''
+        else:
+            response.status_code = 200
+            response._content = json.dumps(self.body).encode()
+        return response
+
+    def close(self):
+        pass
+
+
+def test_revalidation():
+    conn = ApiConnection('https://api.test/', 'secret', cache_size=1000)
+    adapter = StubAdapter({'name': 'INF100'})
+    conn.session.mount('https://', adapter)
+    assert conn.get_single('courses/1') == {'name': 'INF100'}
+    assert conn.get_single('courses/1') == {'name': 'INF100'}  # 304, from the cache
+    adapter.body = {'name': 'INF101'}
+    assert conn.get_single('courses/1') == {'name': 'INF101'}
+    assert conn.log[1].status == 304
+    assert adapter.requests[0] == None and adapter.requests[1] == adapter.requests[2] != None
+    assert conn.cache != None and (conn.cache.hits, conn.cache.misses) == (1, 2)
+    # another token doesn't get our responses
+    other = ApiConnection('https://api.test/', 'other', cache_size=1000)
+    other.cache = conn.cache
+    other.session.mount('https://', adapter)
+    other.get_single('courses/1')
+    assert adapter.requests[-1] == None
+
+
+def test_async_connection_shares_the_cache():
+    app = Flask('puffin_test')
+    app.config.update(CANVAS_BASE_URL='https://canvas.test/api/v1/', CANVAS_SECRET_TOKEN='secret', CANVAS_CACHE_SIZE=4096)
+    conn = CanvasConnection(app)
+    async_conn = AsyncCanvasConnection(app)
+    assert conn.cache != None and conn.cache.max_bytes == 4096
+    assert async_conn.cache is conn.cache
@@ -0,0 +1,67 @@
+import enum
+
+import sqlalchemy as sa
+
+from puffin.db.database import Base, ViewBase
+from puffin.db.model_tables import Course, Group, JoinModel, Membership
+from puffin.db.model_util import new_id, update_from_uib_bulk
+
+from .conftest import canvas_rows
+
+
+def old_to_result(obj, privileged=False):
+    """PreBase.to_result() before the serializers; to_json() was the same, always privileged."""
+    def col_json(col):
+        val = getattr(obj, col.key)
+        if isinstance(val, enum.Enum):
+            return val.name
+        else:
+            return val
+    result = {col.key: col_json(col) for col in obj.__table__.c if not col.info.get('secret', False)}
+    if not privileged:
+        if 'json_data' in result:
+            allowed = getattr(obj, 'info', {}).get('public_json', [])
+            result['json_data'] = {k: v for k, v in result['json_data'].items() if k in allowed}
+    result['_type'] = obj.__tablename__
+    return result
+
+
+def test_serializers_match_old_to_result(db, course):
+    accs = update_from_uib_bulk(db, canvas_rows(3), course)
+    course.json_data['gitlab_path'] = 'inf100/26h'
+    groups = [Group(id=new_id(db, Group), kind='team', course_id=course.id, name=f'Team {i}', slug=f'team-{i}',
+                    json_data=data, join_model=join_model)
+              for i, (data, join_model) in enumerate([({'project_name': 'p1', 'share': True, 'notes': 'private'},
+                                                       JoinModel.OPEN),
+                                                      ({}, JoinModel.RESTRICTED)])]
+    db.add_all(groups)
+    db.add(Membership(id=new_id(db, Membership), user_id=accs[0].user_id, group_id=groups[0].id, role='student',
+                      join_model=JoinModel.AUTO))
+    db.commit()
+    db.expire_all()
+
+    checked = set()
+    for mapper in [*Base.registry.mappers, *ViewBase.registry.mappers]:
+        cls = mapper.class_
+        order = [*mapper.primary_key]
+        objs = db.execute(sa.select(cls).order_by(*order)).scalars().all()
+        if not objs:
+            continue
+        checked.add(cls.__tablename__)
+        ser = cls.serializer()
+        # in another column order than the table's, as from a join
+        rows = db.execute(sa.select(*reversed(cls.__table__.c)).order_by(*order)).all()
+        for privileged in (True, False):
+            expected = [old_to_result(obj, privileged) for obj in objs]
+            assert [ser.obj(obj, privileged) for obj in objs] == expected, cls
+            assert [obj.to_result(privileged) for obj in objs] == expected, cls
+            assert ser.rows(rows, privileged) == expected, cls
+            assert [ser.row(row, privileged) for row in rows] == expected, cls
+        assert [obj.to_json() for obj in objs] == [old_to_result(obj, True) for obj in objs], cls
+    assert {'user', 'account', 'course', 'enrollment', 'group', 'membership', 'course_user'} <= checked
+
+    team = groups[0].to_result(privileged=False)
+    assert team['json_data'] == {'project_name': 'p1', 'share': True} and team['join_model'] == 'OPEN'
+    assert groups[0].to_json()['json_data']['notes'] == 'private'
+    # no public keys
+    assert db.get(Course, course.id).to_result()['json_data'] == {}
@@ -0,0 +1,80 @@
+import json
+
+import requests
+from requests.adapters import BaseAdapter
+
+from puffin.canvas.lib import CanvasConnection, TermCache
+
+TERMS = [{'id': 1, 'name': 'Haust 2026', 'start_at': '2026-08-01', 'end_at': '2026-12-31'},
+         {'id': 2, 'name': 'Vår 2027', 'start_at': '2027-01-01', 'end_at': '2027-06-30'}]
+
+
+def test_term_cache(monkeypatch):
+    cache = TermCache(ttl=60)
+    cache.put(7, [dict(TERMS[0])])
+    assert cache.get(7, 1)['term_slug'] == '26h'
+    assert cache.get(8, 1) == None and not cache.is_loaded(7)
+    cache.put(7, [dict(t) for t in TERMS], all_terms=True)
+    assert cache.is_loaded(7) and cache.get(7, 2)['term_slug'] == '27v'
+    now = cache.terms[(7, 1)][0]
+    monkeypatch.setattr('time.time', lambda: now + 61)
+    assert cache.get(7, 1) == None and not cache.is_loaded(7)
+
+
+def test_term_cache_file(tmp_path):
+    path = str(tmp_path / 'terms.json')
+    first, second = TermCache(path=path), TermCache(path=path)  # e.g. two worker processes
+    first.put(7, [dict(t) for t in TERMS], all_terms=True)
+    assert second.is_loaded(7) and second.get(7, 2)['name'] == 'Vår 2027'
+    assert TermCache(path=path).get(7, 1)['term_slug'] == '26h'
+
+
+class TermsAdapter(BaseAdapter):
+    """Canvas term endpoints; listing all terms is only allowed if `admin`."""
+
+    def __init__(self, admin):
+        super().__init__()
+        self.admin = admin
+        self.paths = []
+
+    def send(self, request, **kwargs):
+        path = request.path_url.split('?')[0].removeprefix('/api/v1/')
+        self.paths.append(path)
+        response = requests.Response()
+        response.request = request
+        response.headers['Content-Type'] = 'application/json'
+        if path == 'accounts/7/terms':
+            response.status_code = 200 if self.admin else 403
+            response._content = json.dumps({'enrollment_terms': TERMS}).encode()
+        else:
+            term = next(t for t in TERMS if path == f'accounts/7/terms/{t["id"]}')
+            response.status_code = 200
+            response._content = json.dumps(term).encode()
+        return response
+
+    def close(self):
+        pass
+
+
+def connection(admin):
+    conn = CanvasConnection('https://canvas.test/api/v1/', 'secret')
+    conn.terms = TermCache()
+    adapter = TermsAdapter(admin)
+    conn.session.mount('https://', adapter)
+    return conn, adapter
+
+
+def test_terms_are_loaded_in_bulk():
+    conn, adapter = connection(admin=True)
+    assert conn.get_term(7, 1)['term_slug'] == '26h'
+    assert conn.get_term(7, 2)['term_slug'] == '27v'
+    assert adapter.paths == ['accounts/7/terms']
+
+
+def test_terms_one_by_one_without_admin():
+    conn, adapter = connection(admin=False)
+    assert conn.get_term(7, 1)['term_slug'] == '26h'
+    assert conn.get_term(7, 2)['term_slug'] == '27v'
+    assert conn.get_term(7, 1)['term_slug'] == '26h'
+    # the listing is only tried once (per TTL)
+    assert adapter.paths == ['accounts/7/terms', 'accounts/7/terms/1', 'accounts/7/terms/2']
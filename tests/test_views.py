@@ -0,0 +1,183 @@
+import csv
+import gzip
+import io
+import zlib
+
+import sqlalchemy as sa
+
+from puffin.db import database
+from puffin.db.model_tables import Account, Enrollment, Group, JoinModel, Membership, User
+from puffin.db.model_util import new_id, new_ids, update_from_uib_bulk
+
+from .conftest import canvas_rows, import_app_module
+from .test_canvas import raw_user
+from .test_model_tables import USERS, StatementCounter
+
+view_courses = import_app_module('view_courses')
+
+
+def test_request_caches_are_cleared_by_writes(web_app, db, course):
+    user = update_from_uib_bulk(db, canvas_rows(1), course)[0].user
+    group = Group(id=new_id(db, Group), kind='team', course_id=course.id, name='Team 1', slug='team-1')
+    db.add(group)
+    db.commit()
+    with web_app.test_request_context(headers={'X-Test-User': str(user.id)}):
+        assert view_courses.current_enrollments() == {course.id: 'student'}
+        assert view_courses.get_group(course, 'team-1', privileged=True) == group
+        assert not view_courses.is_privileged(user, course)
+
+        db.execute(sa.update(Enrollment).where(Enrollment.user_id == user.id).values(role='ta'))
+        group.slug = 'team-one'
+        db.commit()
+        assert view_courses.current_enrollments() == {course.id: 'ta'}
+        assert view_courses.is_privileged(user, course)
+        assert view_courses.get_group(course, 'team-1', privileged=True) == None
+        assert view_courses.get_group(course, 'team-one', privileged=True) == group
+
+
+def test_course_user_details_statement_count(client, db, course):
+    update_from_uib_bulk(db, canvas_rows(USERS), course)
+    teacher = update_from_uib_bulk(db, canvas_rows(1, start=USERS, role='teacher'), course)[0].user
+    teams = [Group(id=id, kind='team', course=course, name=f'Team {id}', slug=f'team-{id}')
+             for id in new_ids(db, Group, 10)]
+    db.add_all(teams)
+    db.flush()
+    user_ids = db.execute(sa.select(User.id).where(User.id != teacher.id).order_by(User.id)).scalars().all()
+    db.execute(sa.insert(Membership), [{'id': id, 'user_id': uid, 'group_id': teams[i % 10].id, 'role': 'student'}
+                                       for i, (id, uid) in enumerate(zip(new_ids(db, Membership, USERS), user_ids))])
+    db.commit()
+    url, headers, team = f'/courses/{course.slug}/users/?details=1', {'X-Test-User': str(teacher.id)}, teams[0].slug
+    db.expunge_all()  # nothing already loaded
+
+    with StatementCounter(database.engine) as counter:
+        response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    details = {d['id']: d for d in response.json}
+    assert len(details) == USERS + 1
+    first = details[user_ids[0]]
+    assert (first['role'], first['canvas_username']) == ('student', 'u0')
+    assert [(g['group_slug'], g['kind']) for g in first['groups']] == [(team, 'team')]
+    # current user, its enrollments, the course and the users; then accounts and memberships per batch of 500
+    assert counter.count == 4 + 2 * 2
+
+
+def test_course_user_details_match_single_user_details(web_app, db, course):
+    users = [acc.user for acc in update_from_uib_bulk(db, canvas_rows(4), course)]
+    team = Group(id=new_id(db, Group), kind='team', course_id=course.id, name='Team 1', slug='team-1')
+    db.add(team)
+    db.add(Membership(id=new_id(db, Membership), user_id=users[0].id, group_id=team.id, role='student'))
+    for user, external_id, username in [(users[0], 1, 'first0'), (users[1], 2, 'old-name'), (users[1], 3, 'new-name')]:
+        db.add(Account(id=new_id(db, Account), provider_name='gitlab', user_id=user.id, external_id=external_id,
+                       username=username, fullname=user.lastname))
+    db.commit()
+    db.expire_all()
+    users = db.execute(sa.select(User).order_by(User.id)).scalars().all()
+    with web_app.test_request_context(headers={'X-Test-User': str(users[0].id)}):
+        details = getattr(view_courses, '__course_users_details')(users, {u.id: 'student' for u in users}, course)
+        assert details == [getattr(view_courses, '__user_details')(u, course) for u in users]
+    assert [d.get('gitlab_username') for d in details] == ['first0', 'old-name', None, None]
+
+
+def csv_export_course(db, course):
+    """USERS students (half of them in a team) and a teacher; returns the teacher's request headers."""
+    update_from_uib_bulk(db, canvas_rows(USERS), course)
+    teacher = update_from_uib_bulk(db, canvas_rows(1, start=USERS, role='teacher'), course)[0].user
+    team = Group(id=new_id(db, Group), kind='team', course_id=course.id, name='Team 1', slug='team-1')
+    db.add(team)
+    db.flush()
+    user_ids = db.execute(sa.select(User.id).where(User.id != teacher.id).order_by(User.id)).scalars().all()
+    db.execute(sa.insert(Membership), [{'id': id, 'user_id': uid, 'group_id': team.id, 'role': 'student'}
+                                       for id, uid in zip(new_ids(db, Membership, USERS // 2), user_ids)])
+    db.commit()
+    return {'X-Test-User': str(teacher.id)}
+
+
+def test_course_users_csv_is_streamed(client, db, course):
+    headers = csv_export_course(db, course)
+    response = client.get(f'/courses/{course.slug}/users/?csv=1&details=1', headers=headers)
+    assert response.status_code == 200 and response.is_streamed
+    assert response.content_type.startswith('text/csv') and 'Content-Encoding' not in response.headers
+    assert response.headers['Content-Disposition'] == f'attachment; filename="{course.slug}_users.csv"'
+    chunks = list(response.response)
+    assert len(chunks) == 2  # one per batch of 500 users
+    rows = list(csv.DictReader(io.StringIO(b''.join(chunks).decode())))
+    assert len(rows) == USERS + 1
+    assert 'groups' not in rows[0] and 'is_admin' not in rows[0]
+    u0 = next(row for row in rows if row['canvas_username'] == 'u0')
+    assert (u0['sortable_name'], u0['team'], u0['section'], u0['review_team']) == ('Last0, First0', 'team-1', '', '')
+    assert {row['role'] for row in rows} == {'student', 'teacher'}
+
+
+def test_course_users_csv_is_gzipped_when_accepted(client, db, course):
+    headers = csv_export_course(db, course)
+    url = f'/courses/{course.slug}/users/?details=1'
+    plain = client.get(url, headers={**headers, 'Accept': 'text/csv'}).get_data()
+    response = client.get(url, headers={**headers, 'Accept': 'text/csv', 'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in response.headers['Vary']
+    chunks = list(response.response)
+    assert len(chunks) == 3  # each batch is flushed, then the gzip trailer
+    decompressor = zlib.decompressobj(wbits=31)
+    # each chunk can be decompressed as it arrives
+    assert decompressor.decompress(chunks[0]).decode().startswith('id,')
+    assert gzip.decompress(b''.join(chunks)) == plain
+    assert plain.decode().count('\r\n') == USERS + 2
+
+
+class FakeCanvas:
+    """A Canvas connection with a fixed user list; `during_fetch` runs while the users are fetched."""
+
+    def __init__(self, users, during_fetch):
+        self.users = users
+        self.during_fetch = during_fetch
+
+    def iter_paginated(self, *args):
+        self.during_fetch()
+        yield from self.users
+
+    def get_paginated(self, *args):
+        return []
+
+
+def test_canvas_sync_sees_writes_made_while_fetching(client, web_app, db, course):
+    users = [acc.user for acc in update_from_uib_bulk(db, canvas_rows(4) + canvas_rows(1, 4, 'teacher'), course)]
+    team = Group(id=new_id(db, Group), kind='team', course_id=course.id, name='Team 1', slug='team-1')
+    db.add(team)
+    db.add(Membership(id=new_id(db, Membership), user_id=users[3].id, group_id=team.id, role='student'))
+    users[3].enrollment(course).join_model = JoinModel.REMOVED
+    db.commit()
+    user_ids, url = [u.id for u in users], f'/courses/{course.slug}/sync?sync_canvas=1'
+
+    def re_enroll():
+        # someone puts user 3 back in the course while we're waiting for Canvas
+        with database.engine.begin() as conn:
+            conn.execute(sa.update(Enrollment).where(Enrollment.user_id == user_ids[3])
+                         .values(join_model=JoinModel.AUTO))
+
+    # users 2 and 3 have left the course in Canvas
+    canvas_users = [{**canvas_rows(1, i)[0], **raw_user(i, type)}
+                    for i, type in [(0, 'StudentEnrollment'), (1, 'StudentEnrollment'), (4, 'TeacherEnrollment')]]
+    web_app.extensions['puffin_canvas_connection'] = FakeCanvas(canvas_users, re_enroll)
+    response = client.post(url, headers={'X-Test-User': str(user_ids[4])})
+    assert response.status_code == 200
+
+    db.expire_all()
+    enrollments = dict(db.execute(sa.select(Enrollment.user_id, Enrollment.join_model)).all())
+    assert [enrollments[uid] for uid in user_ids] == [JoinModel.AUTO] * 2 + [JoinModel.REMOVED] * 2 + [JoinModel.AUTO]
+    assert db.execute(sa.select(Membership.join_model)).scalars().all() == [JoinModel.REMOVED]
+
+
+def test_course_audit_validation(client, db, course):
+    users = [acc.user for acc in update_from_uib_bulk(db, canvas_rows(2) + canvas_rows(1, 2, 'teacher'), course)]
+    student, teacher = {'X-Test-User': str(users[0].id)}, {'X-Test-User': str(users[2].id)}
+    url = f'/courses/{course.slug}/audit'
+
+    response = client.get(f'{url}?tables=enrollment&limit=2', headers=teacher)
+    assert response.status_code == 200
+    assert [e['table_name'] for e in response.json['entries']] == ['enrollment'] * 2 and response.json['more']
+    response = client.get(f'{url}?tables=enrollment,user,bogus', headers=teacher)
+    assert response.status_code == 400
+    assert response.json['message'] == 'unknown tables' and response.json['args'] == ['user', 'bogus']
+    for limit in (0, -1):
+        response = client.get(f'{url}?limit={limit}', headers=teacher)
+        assert response.status_code == 400 and response.json['args'] == [limit]
+    assert client.get(url, headers=student).status_code == 403